@@ -1,19 +1,20 @@
 #Copyright 2021 Lixian WANG. All Rights Reserved.
 # Standard library
 import os
+from collections.abc import Mapping
 
 # Third party
-import matplotlib
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from scipy.optimize import curve_fit
 
 # Local application
 from .physconst import *
 from .functions import *
+from .prefetch import prefetch
+from .profiling import stage, staged
+from .sweepset import SweepSet
 
-__all__ = ['Databs','Datags','Datamap','DataX']
+__all__ = ['Databs','Datags','Datamap','Mapfc','DataX']
 
 class Datajungle:
     """ Parent Class for Generic data type
@@ -24,19 +25,65 @@ class Datajungle:
     spr: skipped rows in the header of source file
     ref: reference resistance in series
     AspRatio: aspect ratio of Hall bar, set to 3 by default
+    dtype: storage type of the data, e.g. np.float32 halves the memory of large maps (fits always run in float64).
+           None (default) keeps the types inferred by pandas
+    prefetch: number of files read ahead in the background while the current one is processed (slow network
+              folders), 0 (default) reads every file when it is needed. prefetch_memory caps the bytes read ahead
 
     Return:
 
     CHILDREN CLASS:
     Databs, Datags, Datafc
     """
-    def __init__(self,directory,step,ucols,nms,spr):
+    prefetch_memory = 256 * 2 ** 20
+
+    def __init__(self,directory,step,ucols,nms,spr,dtype=None,prefetch=0):
         self.dir = directory # directories for all the files in current folder.
         self.step = step # values of parameter B
         self.ucols = ucols # choose columns to import
         self.nms = nms # to name chosen columns
         self.spr = spr  # to skip rows in the header of .dat file
+        self.dtype = None if dtype is None else np.dtype(dtype)  # storage type of all columns
+        self.prefetch = prefetch  # files read ahead
+
+    def read(self,i,raw=None):
+        """read the i-th file into a DataFrame with the columns nms, raw: its content if it was already read"""
+        with stage('read_file') as record:
+            data = read_dat(self.dir[i] if raw is None else raw, self.spr, self.ucols, self.nms, self.dtype)
+            if record is not None:
+                record.points = len(data)
+        return data
+
+    def reads(self):
+        """(i, DataFrame) of all files in order, the next files are read ahead if prefetch is set"""
+        if not self.prefetch:
+            for i in range(len(self.dir)):
+                yield i, self.read(i)
+        else:
+            for i, raw in prefetch(self.dir, self.prefetch, self.prefetch_memory):
+                yield i, self.read(i, raw)
+
+    def stepvalue(self,i):
+        """step value of the i-th file in the storage type"""
+        return self.step[i] if self.dtype is None else self.dtype.type(self.step[i])
+
+    def transport(self,data):
+        """add the transport tensor (rxx, rxy, sxx, sxy) of a Hall bar to data, needs ref and AspRatio"""
+        ref = self.ref
+        AspRatio = self.AspRatio
+        with stage('transport_tensor',len(data)):
+            data['rxx'] = data.uxx/data.curr*ref
+            data['rxy'] = data.uxy/data.curr*ref
+            data['sxx'] = data['rxx']/AspRatio/((data['rxx']/AspRatio)**2+data['rxy']**2)
+            data['sxy'] = data['rxy']/((data['rxx']/AspRatio)**2+data['rxy']**2)
+        return data
 
+    def getsweeps(self,step_name,transport=True):
+        """all files in a SweepSet (one array per column, no long-form DataFrame), with the transport tensor"""
+        sweeps = []
+        for i, data in self.reads():
+            sweeps.append(self.transport(data) if transport else data)
+        return SweepSet.from_frames(sweeps,[self.stepvalue(i) for i in range(len(self.dir))],step_name)
 
 
 class Databs(Datajungle):
@@ -47,51 +94,39 @@ class Databs(Datajungle):
     plotdata: plot magnetic field sweep type data in a specific way
     plotfc: plot fan chart"""
 
-    def __init__(self, directory, step, ucols, spr, ref, nms=['bf', 'curr', 'uxx', 'uxy'],AspRatio=3):
-        super().__init__(directory,step,ucols,nms,spr)
+    def __init__(self, directory, step, ucols, spr, ref, nms=['bf', 'curr', 'uxx', 'uxy'],AspRatio=3,dtype=None,prefetch=0):
+        super().__init__(directory,step,ucols,nms,spr,dtype,prefetch)
         self.ref = ref # reference resistance in series
         self.AspRatio = AspRatio  # Aspect ratio of Hall bar structure
 
     def __str__(self):
-        return ', '.join(['Databs', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['AspRatio','ucols','nms','spr','ref']])])
+        return ', '.join(['Databs', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['AspRatio','ucols','nms','spr','ref','dtype','prefetch']])])
 
     def __repr__(self):
         pass
 
     def getdata(self):
-        databundle = pd.DataFrame()
-        ref = self.ref
-        AspRatio = self.AspRatio
-        for i in range(len(self.dir)):
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['rxx'] = data.uxx/data.curr*ref
-            data['rxy'] = data.uxy/data.curr*ref
-            data['sxx'] = data['rxx']/AspRatio/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['sxy'] = data['rxy']/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['gate'] = self.step[i]
-            # databundle = databundle.append(data) # Deprecated in Pandas 1.4.0 and above
-            databundle = pd.concat([databundle, data],ignore_index=False)
-        return databundle
+        return self.getsweeps('gate').to_frame()
 
-    def hallfit(self,fitrange):
+    @staged('hallfit',points=lambda self,*args,**kwargs: len(self.dir))
+    def hallfit(self,fitrange,call=True):
         Dens = []
         Mob = []
-        ref = self.ref
         AspRatio = self.AspRatio
-        for i in range(len(self.dir)):
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['rxx'] = data.uxx/data.curr*ref
-            data['rxy'] = data.uxy/data.curr*ref
+        for i, data in self.reads():
+            data = self.transport(data)
             bf_fit = data['bf'][(data['bf']<fitrange[1])&(data['bf']>fitrange[0])]
             rxx_fit = data['rxx'][(data['bf']<fitrange[1])&(data['bf']>fitrange[0])]
             rxy_fit = data['rxy'][(data['bf']<fitrange[1])&(data['bf']>fitrange[0])]
-            dens,mob = H1st_ft(bf_fit,rxx_fit,rxy_fit,AspRatio=AspRatio)
+            dens,mob = H1st_ft(bf_fit,rxx_fit,rxy_fit,AspRatio=AspRatio,call=call)
             Dens.append(dens)
             Mob.append(mob)
         FitRes = pd.DataFrame({'gate':self.step,'dens':Dens,'mob':Mob})
         return FitRes
 
-    def plotdata(self,label_value = '$V_g$={:02.2f}V' ):
+    def plotdata(self,label_value = '$V_g$={:02.2f}V',decimate=True):
+        import matplotlib
+        import matplotlib.pyplot as plt
         font = {'family' : 'normal','weight' : 'normal','size'   : 15}
         matplotlib.rc('font', **font)
         jet= plt.get_cmap('jet')
@@ -100,18 +135,14 @@ class Databs(Datajungle):
         ax_rxy = plt.subplot(2,1,1)
         ax_rxx = plt.subplot(2,2,3)
         ax_sxy = plt.subplot(2,2,4)
-        ref = self.ref
-        AspRatio = self.AspRatio
-        for i in range(len(self.dir)):
+        # long sweeps are drawn as their min/max envelope at screen resolution
+        plot = plot_decimated if decimate else lambda ax, *args, **kwargs: ax.plot(*args, **kwargs)
+        for i, data in self.reads():
             line_color = next(colors)
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['rxx'] = data.uxx/data.curr*ref
-            data['rxy'] = data.uxy/data.curr*ref
-            data['sxx'] = data['rxx']/AspRatio/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['sxy'] = data['rxy']/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            ax_rxx.plot(data.bf,data['rxx'],color = line_color,label=label_value.format(self.step[i]))
-            ax_rxy.plot(data.bf,data['rxy'],color = line_color,label=label_value.format(self.step[i]))
-            ax_sxy.plot(data.bf,data['sxy'],color = line_color,label=label_value.format(self.step[i]))
+            data = self.transport(data)
+            plot(ax_rxx,data.bf,data['rxx'],color = line_color,label=label_value.format(self.step[i]))
+            plot(ax_rxy,data.bf,data['rxy'],color = line_color,label=label_value.format(self.step[i]))
+            plot(ax_sxy,data.bf,data['sxy'],color = line_color,label=label_value.format(self.step[i]))
         ax_rxx.set_xlabel(r'$B_{field}(T)$',fontsize = 18)
         ax_rxx.set_ylabel(r'$R_{xx}(\Omega)$',fontsize = 18)
         ax_rxy.set_xlabel(r'$B_{field}(T)$',fontsize = 18)
@@ -134,32 +165,22 @@ class Datags(Datajungle):
     plotdata: plot gate sweep type data in a specific way
     plotfc: plot fan chart'''
 
-    def __init__(self, directory, step, ucols, spr, ref, nms=['gate', 'curr', 'uxx', 'uxy'], AspRatio=3):
-        super().__init__(directory,step,ucols,nms,spr)
+    def __init__(self, directory, step, ucols, spr, ref, nms=['gate', 'curr', 'uxx', 'uxy'], AspRatio=3, dtype=None,prefetch=0):
+        super().__init__(directory,step,ucols,nms,spr,dtype,prefetch)
         self.ref = ref # reference resistance in series
         self.AspRatio = AspRatio  # Aspect ratio of Hall bar structure
 
     def __str__(self):
-        return ', '.join(['Datags', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['AspRatio','ucols','nms','spr','ref']])])
+        return ', '.join(['Datags', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['AspRatio','ucols','nms','spr','ref','dtype','prefetch']])])
 
     def __repr__(self):
         pass
 
     def getdata(self):
-        databundle = pd.DataFrame()
-        ref = self.ref
-        AspRatio = self.AspRatio
-        for i in range(len(self.dir)):
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['rxx'] = data.uxx/data.curr*ref
-            data['rxy'] = data.uxy/data.curr*ref
-            data['sxx'] = data['rxx']/AspRatio/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['sxy'] = data['rxy']/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['bf'] = self.step[i]
-            # databundle = databundle.append(data) # Deprecated in Pandas 1.4.0 and above
-            databundle = pd.concat([databundle,data],ignore_index=False)
-        return databundle
-    def plotdata(self,label_value='$B$={:02.2f}T'):
+        return self.getsweeps('bf').to_frame()
+    def plotdata(self,label_value='$B$={:02.2f}T',decimate=True):
+        import matplotlib
+        import matplotlib.pyplot as plt
         font = {'family' : 'normal','weight' : 'normal','size' : 15}
         matplotlib.rc('font', **font)
         jet= plt.get_cmap('jet')
@@ -168,18 +189,14 @@ class Datags(Datajungle):
         ax_rxy = plt.subplot(2,1,1)
         ax_rxx = plt.subplot(2,2,3)
         ax_sxy = plt.subplot(2,2,4)
-        ref = self.ref
-        AspRatio = self.AspRatio
-        for i in range(len(self.dir)):
+        # long sweeps are drawn as their min/max envelope at screen resolution
+        plot = plot_decimated if decimate else lambda ax, *args, **kwargs: ax.plot(*args, **kwargs)
+        for i, data in self.reads():
             line_color = next(colors)
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['rxx'] = data.uxx/data.curr*ref
-            data['rxy'] = data.uxy/data.curr*ref
-            data['sxx'] = data['rxx']/AspRatio/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['sxy'] = data['rxy']/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            ax_rxx.plot(data.gate,data['rxx'],color = line_color,label=label_value.format(self.step[i]))
-            ax_rxy.plot(data.gate,data['rxy'],color = line_color,label=label_value.format(self.step[i]))
-            ax_sxy.plot(data.gate,data['sxy'],color = line_color,label=label_value.format(self.step[i]))
+            data = self.transport(data)
+            plot(ax_rxx,data.gate,data['rxx'],color = line_color,label=label_value.format(self.step[i]))
+            plot(ax_rxy,data.gate,data['rxy'],color = line_color,label=label_value.format(self.step[i]))
+            plot(ax_sxy,data.gate,data['sxy'],color = line_color,label=label_value.format(self.step[i]))
         ax_rxx.set_xlabel(r'$V_g(V)$',fontsize = 18)
         ax_rxx.set_ylabel(r'$R_{xx}(\Omega)$',fontsize = 18)
         ax_rxy.set_xlabel(r'$V_g(V)$',fontsize = 18)
@@ -197,68 +214,60 @@ class Datags(Datajungle):
 class Datamap(Datajungle):
     '''Inherent from Class Datajungle
     METHODS:
-    getdata: return x, y and a 2D array with z-value
+    getdata: return x, y and a 2D array with z-value, sweeps of different lengths/setpoints are put on one v1 grid
+    getmap: the same grids as getdata, computed on demand (Mapfc)
     plotmap: plot 2D mapping'''
 
-    def __init__(self,directory,step,ucols,spr,ref,nms=['v1','curr','uxx','uxy'],AspRatio=3):
-        super().__init__(directory,step,ucols,nms,spr)
+    def __init__(self,directory,step,ucols,spr,ref,nms=['v1','curr','uxx','uxy'],AspRatio=3,dtype=None,prefetch=0):
+        super().__init__(directory,step,ucols,nms,spr,dtype,prefetch)
         self.ref = ref # reference resistance in series
         self.AspRatio = AspRatio  # Aspect ratio of Hall bar structure
 
     def __str__(self):
-        return ', '.join(['Datagmap', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['AspRatio','ucols','nms','spr','ref']])])
+        return ', '.join(['Datagmap', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['AspRatio','ucols','nms','spr','ref','dtype','prefetch']])])
 
     def __repr__(self):
         pass
 
-    def getdata(self):
-        databundle = pd.DataFrame()
-        diffsxy2D_v1 = pd.DataFrame()
-        diffsxy2D_v2 = pd.DataFrame()
-        rxx2D = pd.DataFrame()
-        rxy2D = pd.DataFrame()
-        sxy2D = pd.DataFrame()
-        sxx2D = pd.DataFrame()
-        ref = self.ref
-        AspRatio = self.AspRatio
-        for i in range(len(self.dir)):
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['rxx'] = data.uxx/data.curr*ref
-            data['rxy'] = data.uxy/data.curr*ref
-            data['sxx'] = data['rxx']/AspRatio/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['sxy'] = data['rxy']/((data['rxx']/AspRatio)**2+data['rxy']**2)
-            data['v2'] = self.step[i]
-            rxx2D = pd.concat([rxx2D,data['rxx']],axis=1)
-            # rxy2D = rxy2D.append(data['rxy'])
-            rxy2D = pd.concat([rxy2D,data['rxy']],axis=1)
-            # sxy2D = sxy2D.append(data['sxy'])
-            sxy2D = pd.concat([sxy2D,data['sxy']],axis=1)
-            # sxx2D = sxx2D.append(data['sxx'])
-            sxx2D = pd.concat([sxx2D,data['sxx']],axis=1)
-            # databundle = databundle.append(data)
-            databundle = pd.concat([databundle,data],ignore_index=False)
-
-        diffsxy2D_v1 = sxy2D.diff(axis=0)/abs(databundle['v1'].unique()[0]-databundle['v1'].unique()[1])
-        diffsxy2D_v2 = sxy2D.diff(axis=1)/abs(self.step[0]-self.step[1])
-
-        datafc = {'v1':databundle['v1'].unique(),'v2':self.step,'dv1':diffsxy2D_v1,'dv2':diffsxy2D_v2,'rxx2d':rxx2D,'rxy2d':rxy2D,'sxy2d':sxy2D,'sxx2d':sxx2D}
-        return datafc, databundle
-
-    def plotmap(self,vmin1,vmax1,vmin2,vmax2,cmap='terrain'): # plot gate-mapping
-        fc,_ = self.getdata()
-        v1 = fc['v1']
-        v2 = fc['v2']
-        diffsxy2D_v1 = fc['dv1']
-        diffsxy2D_v2 = fc['dv2']
+    def getdata(self,v1grid=None,method='interp',derivative=None,**options):
+        """
+        v1grid: None: the common v1 values if all sweeps were measured at the same setpoints, otherwise an equally
+                spaced grid over the whole v1 range with the number of points of the longest sweep
+                int: equally spaced grid with this number of points, array: ascending v1 values of the grid
+        method: how the sweeps are put on the grid, 'interp' or 'bin' (see resample_sweeps)
+        derivative: None: dv1/dv2 are first differences (first row/column NaN),
+                    'gradient', 'savgol' or 'gaussian': see map_diff, options (window, order, sigma) are passed on
+        return: datafc (dict of all grids, see Mapfc), databundle
+        """
+        fc = self.getmap(v1grid,method,derivative,**options)
+        datafc = {key:fc[key] for key in Mapfc.grids}
+        return datafc, fc['bundle']
+
+    def getmap(self,v1grid=None,method='interp',derivative=None,**options):
+        """same arguments as getdata, return a Mapfc: every grid is only computed when it is used"""
+        return Mapfc(self,v1grid,method,derivative,**options)
+
+    def plotmap(self,vmin1,vmax1,vmin2,vmax2,cmap='terrain',v1grid=None,derivative=None,pyramid=False,**options): # plot gate-mapping
+        """pyramid: draw the maps from min/mean/max pyramids cached in a user folder, at the resolution of the view
+        (see pyramid.py), the maps are only computed when the cache is missing"""
+        import matplotlib.pyplot as plt
+        fc = self.getmap(v1grid,derivative=derivative,**options)  # only v1, v2 and the derivatives are computed
 
         fig = plt.figure(figsize=(8,12),constrained_layout=True)
         gs = fig.add_gridspec(2, 1)
         ax1,ax2 = [fig.add_subplot(x) for x in gs]
-        dv1plot = ax1.imshow(diffsxy2D_v1,aspect='auto', interpolation='none',extent=extents(v1.tolist()) + extents(v2.tolist()), origin='lower',cmap=cmap,vmin=vmin1, vmax=vmax1)
+        if pyramid:
+            from .pyramid import map_pyramid, plot_pyramid
+            dv1plot, dv2plot = [plot_pyramid(ax,map_pyramid(self,key,v1grid=v1grid,derivative=derivative,fc=fc,**options),cmap=cmap,vmin=vmin,vmax=vmax)
+                                for ax,key,vmin,vmax in [(ax1,'dv1',vmin1,vmax1),(ax2,'dv2',vmin2,vmax2)]]
+        else:
+            v1 = fc['v1']
+            v2 = fc['v2']
+            dv1plot = ax1.imshow(fc['dv1'].T,aspect='auto', interpolation='none',extent=extents(list(v1)) + extents(list(v2)), origin='lower',cmap=cmap,vmin=vmin1, vmax=vmax1)
+            dv2plot = ax2.imshow(fc['dv2'].T,aspect='auto', interpolation='none',extent=extents(list(v1)) + extents(list(v2)), origin='lower',cmap=cmap,vmin=vmin2, vmax=vmax2)
         cbaxes1 = fig.add_axes([.8, .9, 0.15, 0.01])
         cb1 = fig.colorbar(dv1plot, cax=cbaxes1, orientation='horizontal', pad=10)
         cb1.ax.set_xlabel('$d\sigma_{xy}/dV_{1}$')
-        dv2plot = ax2.imshow(diffsxy2D_v2,aspect='auto', interpolation='none',extent=extents(v1.tolist()) + extents(v2.tolist()), origin='lower',cmap=cmap,vmin=vmin2, vmax=vmax2)
         cbaxes2 = fig.add_axes([.8, .4, 0.15, 0.01])
         cb2 = fig.colorbar(dv2plot, cax=cbaxes2, orientation='horizontal', pad=10)
         cb2.ax.set_xlabel('$d\sigma_{xy}/dV_{2}$')
@@ -268,29 +277,114 @@ class Datamap(Datajungle):
         ax2.set_xlabel('$V_{1}$')
         return [ax1,ax2]
 
+class Mapfc(Mapping):
+    """Grids of a Datamap, each computed on first access and then kept
+    KEYS:
+    v1, v2: grid values, dv1, dv2: derivatives of sxy along v1/v2, rxx2d, rxy2d, sxy2d, sxx2d: tensors (v1 x v2),
+    bundle: all files in one DataFrame (with the column v2)
+    The files are read on first access of any key."""
+    grids = ['v1','v2','dv1','dv2','rxx2d','rxy2d','sxy2d','sxx2d']
+    quantities = {'rxx2d':'rxx','rxy2d':'rxy','sxy2d':'sxy','sxx2d':'sxx'}
+
+    def __init__(self,datamap,v1grid=None,method='interp',derivative=None,**options):
+        self.datamap = datamap
+        self.v1grid = v1grid
+        self.method = method
+        self.derivative = derivative
+        self.options = options
+        self.cache = {}
+
+    def memo(self,key,compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def __getitem__(self,key):
+        if key in self.quantities:
+            return self.memo(key,lambda: self._grid(self.quantities[key]))
+        if key in self.grids or key == 'bundle':
+            return self.memo(key,getattr(self,'_'+key))
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.grids + ['bundle'])
+
+    def __len__(self):
+        return len(self.grids) + 1
+
+    def __repr__(self):
+        return 'Mapfc({}, computed: {})'.format(len(self.datamap.dir), ', '.join(self.cache) or 'none')
+
+    def _sweeps(self):
+        return self.datamap.getsweeps('v2')
+
+    def _aligned(self):
+        # same strictly monotonic v1 in all files: the columns of the files are the grid, no resampling
+        sweeps = self.memo('sweeps',self._sweeps)
+        v1 = sweeps.values('v1',0)
+        steps = np.diff(v1)
+        return self.v1grid is None and ((steps > 0).all() or (steps < 0).all()) and (sweeps.lengths == len(v1)).all() \
+            and np.array_equal(sweeps['v1'].reshape(len(sweeps),len(v1)),np.broadcast_to(v1,(len(sweeps),len(v1))))
+
+    def _v1(self):
+        sweeps = self.memo('sweeps',self._sweeps)
+        if self.memo('aligned',self._aligned):
+            return sweeps.values('v1',0)
+        v1s = sweeps.split('v1')
+        v1 = uniform_grid(v1s, self.v1grid) if self.v1grid is None or np.ndim(self.v1grid) == 0 else np.asarray(self.v1grid)
+        return v1 if self.datamap.dtype is None else v1.astype(self.datamap.dtype)
+
+    def _v2(self):
+        return self.datamap.step
+
+    def _grid(self,quantity):
+        sweeps = self.memo('sweeps',self._sweeps)
+        if self.memo('aligned',self._aligned):
+            grid = sweeps[quantity].reshape(len(sweeps),-1).T
+        else:
+            grid = resample_sweeps(sweeps.split('v1'),sweeps.split(quantity),self['v1'],self.method).T
+            if self.datamap.dtype is not None:
+                grid = grid.astype(self.datamap.dtype)
+        return pd.DataFrame(grid, columns=[quantity] * len(sweeps))
+
+    def _dv1(self):
+        sxy2D, v1 = self['sxy2d'], self['v1']
+        if self.derivative is not None:
+            return pd.DataFrame(map_diff(sxy2D, v1, 0, self.derivative, **self.options).astype(sxy2D.dtypes.iloc[0]),
+                                columns=sxy2D.columns)
+        spacing = np.abs(np.diff(v1))
+        if np.allclose(spacing, spacing[0], rtol=1e-3): # equally spaced up to the precision of the files
+            return sxy2D.diff(axis=0)/abs(v1[0]-v1[1])
+        return sxy2D.diff(axis=0).div(np.append(np.nan, spacing).astype(spacing.dtype), axis=0)
+
+    def _dv2(self):
+        sxy2D, v2 = self['sxy2d'], self['v2']
+        if self.derivative is not None:
+            return pd.DataFrame(map_diff(sxy2D, v2, 1, self.derivative, **self.options).astype(sxy2D.dtypes.iloc[0]),
+                                columns=sxy2D.columns)
+        return sxy2D.diff(axis=1)/abs(v2[0]-v2[1])
+
+    def _bundle(self):
+        return self.memo('sweeps',self._sweeps).to_frame()
+
 class DataX(Datajungle):
     '''Inherent from Class Datajungle
     METHODS:
     getdata: return databundle'''
 
-    def __init__(self,directory,step,ucols,spr,nms):
-        super().__init__(directory,step,ucols,nms,spr)
+    def __init__(self,directory,step,ucols,spr,nms,dtype=None,prefetch=0):
+        super().__init__(directory,step,ucols,nms,spr,dtype,prefetch)
 
     def __str__(self):
-        return ', '.join(['DataX', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['ucols','nms','spr','step']])])
+        return ', '.join(['DataX', ', '.join(['{key} = {value}'.format(key = key, value = self.__dict__[key]) for key in ['ucols','nms','spr','step','dtype','prefetch']])])
 
     def __repr__(self):
         pass
 
     def getdata(self):
-        databundle = pd.DataFrame()
-        for i in range(len(self.dir)):
-            data = pd.read_csv(self.dir[i], sep="\t",skiprows=self.spr, usecols=self.ucols, names=self.nms, header=None, encoding='unicode_escape')
-            data['x'] = self.step[i]
-            # databundle = databundle.append(data) # Deprecated in Pandas 1.4.0 and above
-            databundle = pd.concat([databundle,data],ignore_index=False)
-        return databundle
+        return self.getsweeps('x',transport=False).to_frame()
 
+@staged('denCal_single')
 def denCal_single(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit, residual_field_in_T, call=False):
     # PURPOSE: calculate the carier density/mobility by the low-field Hall and transverse resistance
     # INPUT: databs | type class Databs() or Datafc()
@@ -298,7 +392,7 @@ def denCal_single(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit,
     if isinstance(data_formatted, (Databs, Datags)):
         data = data_formatted.getdata()
     elif isinstance(data_formatted, Datamap):
-        _, data = data_formatted.getdata()
+        data = data_formatted.getmap()['bundle']  # the grids are not needed
     else:
         raise TypeError('Error: Wrong input data type')
 
@@ -312,12 +406,13 @@ def denCal_single(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit,
     for gate in gates:
         data_p = df_range(df_range(data, 'bf', bf_range), 'gate', [gate - 0.005, gate + 0.005])  # data
         para1, para2 = H1st_ft(data_p.bf - residual_field_in_T, data_p.rxx, data_p.rxy, AspRatio=AspRatio,
-                               threshold=1000)
+                               threshold=1000, call=call)
         dens.append(para1 / 1e11)
         mob.append(para2)
     return dens, mob
 
 
+@staged('denCal_double')
 def denCal_double(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit, residual_field_in_T, alternating=False, call=False):
     # PURPOSE: calculate the carier density/mobility by a two-carrier model
     # INPUT: databs | type class Databs, Datags and Datamap
@@ -325,7 +420,7 @@ def denCal_double(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit,
     if isinstance(data_formatted, (Databs, Datags)):
         data = data_formatted.getdata()
     elif isinstance(data_formatted, Datamap):
-        _, data = data_formatted.getdata()
+        data = data_formatted.getmap()['bundle']  # the grids are not needed
     else:
         raise TypeError('Error: Wrong input data type')
 
@@ -334,6 +429,7 @@ def denCal_double(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit,
     ndens, nmob, pdens, pmob = [], [], [], []
 
     if call == True:
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(5, 5), constrained_layout=True)
         ax1 = fig.add_subplot(111)
     for n, gate in enumerate(gates):
@@ -1,6 +1,18 @@
 from .functions import *
 from .physconst import *
 from .SciData import *
+from .sweepset import *
 from .utils import *
 
-__all__ = functions.__all__ + SciData.__all__
\ No newline at end of file
+__all__ = functions.__all__ + SciData.__all__ + sweepset.__all__
+
+# modules that are only needed in some workflows are imported on first access, e.g. SciData.functions_LandauLL.
+# Plotting (matplotlib.pyplot, ipywidgets) and fitting (scipy) are imported inside the functions that use them.
+_lazy_modules = ['functions_LandauLL', 'peakFind', 'batch', 'fitstore', 'outofcore', 'pyramid', 'sharedmem', 'workqueue']
+
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
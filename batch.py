@@ -0,0 +1,197 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Headless batch pipeline: turn a manifest of data folders into processed arrays (.npz) without Jupyter.
+Nothing in this module imports matplotlib.pyplot.
+
+Manifest (JSON), either a list of jobs or {"jobs": [...]}. Each job describes one folder:
+{"folder": "D:/data/cooldown1/bs_sweep",  # folder with the .dat files
+ "kind": "bs",                             # bs: Databs, gs: Datags, map: Datamap, x: DataX
+ "ucols": [0, 1, 2, 3], "spr": 1, "ref": 1e4,
+ "nms": ["bf", "curr", "uxx", "uxy"],      # optional, the class default is used otherwise (required for x)
+ "AspRatio": 3,                            # optional
+ "sort_by_fnm": true,                      # optional, sort files by the step value in their names
+ "fitrange": [-0.5, 0.5],                  # optional, Hall fit for kind bs
+ "dtype": "float32",                       # optional, storage type of the arrays (fits run in float64)
+ "prefetch": 4,                            # optional, files read ahead in the background (slow network folders)
+ "v1grid": 2000,                           # optional, for kind map: v1 grid (number of points or list of values)
+ "name": "cooldown1_bs"}                   # optional, name of the output file (default: folder basename),
+                                           # required when two folders have the same basename
+
+Usage:
+python -m SciData.batch manifest.json -o processed -j 4
+'''
+# Standard library
+import argparse
+import contextlib
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+# Third party
+import numpy as np
+
+# Local application
+from .functions import read_folder, scan_folder
+from .profiling import profile
+from .SciData import Databs, Datags, Datamap, DataX
+
+__all__ = ['load_manifest', 'check_names', 'process_job', 'run_job', 'run']
+
+CLASSES = {'bs': Databs, 'gs': Datags, 'map': Datamap, 'x': DataX}
+REQUIRED = ['folder', 'kind', 'ucols', 'spr']
+
+
+def load_manifest(path):
+    '''
+    Read and check a JSON manifest
+    :param path: path of the manifest
+    :return: a list of jobs (dict)
+    '''
+    with open(path) as f:
+        manifest = json.load(f)
+    jobs = manifest['jobs'] if isinstance(manifest, dict) else manifest
+    for job in jobs:
+        missing = [key for key in REQUIRED if key not in job]
+        if missing:
+            raise ValueError('Error: job {} misses {}'.format(job, missing))
+        if job['kind'] not in CLASSES:
+            raise ValueError('Error: unknown kind {}, choose from {}'.format(job['kind'], list(CLASSES)))
+        if job['kind'] != 'x' and 'ref' not in job:
+            raise ValueError('Error: job {} misses ref'.format(job))
+    check_names(jobs)
+    return jobs
+
+
+def output_name(job):
+    return job.get('name') or os.path.basename(os.path.normpath(job['folder']))
+
+
+def check_names(jobs):
+    '''
+    Every job needs its own output name, e.g. folders with the same basename (/a/bs_sweep and /b/bs_sweep)
+    would write the same output and overwrite each other
+    '''
+    names = {}
+    for job in jobs:
+        name = output_name(job)
+        key = name.lower()  # the output folder may be on a case-insensitive filesystem
+        if key in names:
+            raise ValueError('Error: the jobs of {} and {} both write {}.npz, set a different "name" for them'.format(
+                names[key]['folder'], job['folder'], name))
+        names[key] = job
+
+
+def build(job):
+    '''
+    Create the Datajungle child instance for a job
+    '''
+    sort_by_fnm = job.get('sort_by_fnm', False)
+    directory, step = read_folder(job['folder'], sort_by_fnm=sort_by_fnm)
+    if job['kind'] == 'x':
+        return DataX(directory, step, job['ucols'], job['spr'], job['nms'], dtype=job.get('dtype'),
+                     prefetch=job.get('prefetch', 0))
+    kwargs = {key: job[key] for key in ['nms', 'AspRatio', 'dtype', 'prefetch'] if key in job}
+    return CLASSES[job['kind']](directory, step, job['ucols'], job['spr'], job['ref'], **kwargs)
+
+
+def process_job(job):
+    '''
+    Load one folder and compute its transport tensors, Hall fit (bs) and derivative maps (map)
+    :return: a dict of numpy arrays
+    '''
+    data = build(job)
+    arrays = {}
+    if job['kind'] == 'map':
+        fc, databundle = data.getdata(job.get('v1grid'))
+        for key, value in fc.items():
+            arrays[key] = np.asarray(value)
+    else:
+        databundle = data.getdata()
+    for column in databundle.columns:
+        arrays['bundle_' + column] = databundle[column].to_numpy()
+    if job['kind'] == 'bs' and job.get('fitrange'):
+        fitres = data.hallfit(job['fitrange'], call=False)
+        for column in fitres.columns:
+            arrays['hallfit_' + column] = fitres[column].to_numpy(dtype=float)
+    return arrays
+
+
+def is_uptodate(job, output):
+    '''
+    An output is up to date if it was written with the same settings after the last change in the folder
+    '''
+    if not os.path.isfile(output):
+        return False
+    output_mtime = os.path.getmtime(output)
+    # rescan, files rewritten in place do not change the modification time of the folder
+    inputs = scan_folder(job['folder'], rescan=True)
+    if max([os.path.getmtime(job['folder'])] + [entry.mtime for entry in inputs]) > output_mtime:
+        return False
+    with np.load(output) as stored:
+        return 'settings' in stored and str(stored['settings']) == json.dumps(job, sort_keys=True)
+
+
+def run_job(job, outdir, force=False, profiled=False):
+    '''
+    Process one job unless its output is up to date
+    :param profiled: record the time per stage (see profiling.py)
+    :return: (name, status, report), status is one of 'done', 'skipped' or the error message,
+             report is the profiling report as a dict (None if not profiled)
+    '''
+    name = output_name(job)
+    output = os.path.join(outdir, name + '.npz')
+    try:
+        if not force and is_uptodate(job, output):
+            return name, 'skipped', None
+        with profile(memory=True) if profiled else contextlib.nullcontext() as report:
+            arrays = process_job(job)
+        arrays['settings'] = np.array(json.dumps(job, sort_keys=True))
+        tmp = '{}.{}.tmp'.format(output, uuid.uuid4().hex)  # workers of a queue never share a temp file
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, output)  # never leave a half-written output behind
+        return name, 'done', report.as_dict() if profiled else None
+    except Exception as error:
+        return name, 'failed: {!r}'.format(error), None
+
+
+def run(jobs, outdir, processes=None, force=False, profiled=False):
+    '''
+    Process all jobs in parallel
+    :param jobs: list of jobs (see load_manifest)
+    :param outdir: output folder
+    :param processes: number of worker processes (default: number of CPUs), 1 runs in the current process
+    :param force: reprocess jobs even if their outputs are up to date
+    :param profiled: record the time per stage of every job
+    :return: list of (name, status, report)
+    '''
+    check_names(jobs)
+    os.makedirs(outdir, exist_ok=True)
+    if processes == 1:
+        return [run_job(job, outdir, force, profiled) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(run_job, jobs, [outdir] * len(jobs), [force] * len(jobs), [profiled] * len(jobs)))
+
+
+def main(argv=None):
+    ''' command line entry '''
+    parser = argparse.ArgumentParser(description='Process folders of .dat files into .npz arrays')
+    parser.add_argument('manifest', help='JSON manifest of folders')
+    parser.add_argument('-o', '--outdir', default='processed', help='output folder')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-f', '--force', action='store_true', help='ignore up-to-date outputs')
+    parser.add_argument('--profile', default=None, help='write the time/memory per stage of every job to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(load_manifest(args.manifest), args.outdir, args.processes, args.force, args.profile is not None)
+    for name, status, _ in results:
+        print('{}: {}'.format(name, status))
+    if args.profile:
+        with open(args.profile, 'w') as f:
+            json.dump({name: report for name, _, report in results if report}, f, indent=2)
+    return int(any(status.startswith('failed') for _, status, _ in results))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
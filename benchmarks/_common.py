@@ -0,0 +1,40 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Shared helpers for the benchmark scripts in this folder
+'''
+# Standard library imports
+import importlib.util
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the Landau level module is imported as a top-level script module, like in the notebooks
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """Run func repeat times
+    Return:
+    best wall time in seconds, result of the last call
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def load_package(name='SciData'):
+    """Import the repository as a package under name, whatever the folder is called on disk
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO, '__init__.py'),
+                                                  submodule_search_locations=[REPO])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[name] = package
+    spec.loader.exec_module(package)
+    return package
@@ -0,0 +1,55 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Compare TBLLsimu.angle_sweep against looping get_ll_en/IDOS_generator over the angles
+Example:
+python benchmarks/bench_angle_sweep.py --angles 10 --fields 20 --energies 200
+'''
+# Standard library imports
+import argparse
+
+# Third party imports
+import numpy as np
+
+# Local application import
+from _common import timed
+from functions_LandauLL import TBLLsimu, find_energy_bydensity
+from physconst import e0
+
+
+def angle_loop(simu, angles, Brange, Erange, Nmax, den_top, den_bot, den_vps, threeband):
+    IDOS, mu = [], []
+    for angle in angles:
+        LL = simu.get_ll_en(angle, Brange, Nmax, den_top, den_bot, den_vps, threeband)
+        IDOS_angle = simu.IDOS_generator(angle, Brange, Erange, *LL)
+        density = den_top + den_bot - (den_vps if threeband else 0)
+        IDOS.append(IDOS_angle)
+        mu.append([find_energy_bydensity(density, B, IDOS_B, Erange) for B, IDOS_B in zip(Brange, IDOS_angle)])
+    return np.array(IDOS), np.array(mu)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--angles', type=int, default=5)
+    parser.add_argument('--fields', type=int, default=10)
+    parser.add_argument('--energies', type=int, default=200)
+    parser.add_argument('--nmax', type=int, default=10)
+    parser.add_argument('--threeband', action='store_true')
+    args = parser.parse_args()
+
+    simu = TBLLsimu(vf=0.5e6, gfactor=28, sigmaE=1e-3 * e0, sigmaH=2e-3 * e0, meff=-0.2)
+    angles = np.linspace(0, 60, args.angles)
+    Brange = np.linspace(1, 7, args.fields)
+    Erange = np.linspace(-0.05, 0.1, args.energies) * e0
+    setting = (Brange, Erange, args.nmax, 2e15, 3e15, 1e15, args.threeband)
+
+    t_loop, (IDOS_loop, mu_loop) = timed(angle_loop, simu, angles, *setting)
+    t_batch, result = timed(simu.angle_sweep, angles, *setting)
+    print('grid (angle x B x E) = {} x {} x {}'.format(args.angles, args.fields, args.energies))
+    print('loop over angles: {:.3f} s'.format(t_loop))
+    print('angle_sweep     : {:.3f} s ({:.1f}x)'.format(t_batch, t_loop / t_batch))
+    print('max |dIDOS|/max|IDOS| = {:.2e}'.format(np.abs(result['IDOS'] - IDOS_loop).max() / np.abs(IDOS_loop).max()))
+    print('max |dmu| = {:.2e} meV'.format(np.abs(result['mu'] - mu_loop).max() * 1e3 / e0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Compare LL_fillfactor_map against calling LL_fillfactor point by point on a field x energy grid.
+The loop is only timed on --check fields and scaled to the whole grid, its results are compared on these fields.
+Example:
+python benchmarks/bench_fillfactor.py --fields 1000 --energies 1000 --nmax 30
+'''
+# Standard library imports
+import argparse
+
+# Third party imports
+import numpy as np
+
+# Local application import
+from _common import timed
+from functions_LandauLL import LL_fillfactor, LL_fillfactor_map, llenergy_generator_batch
+from physconst import e0
+
+
+def fillfactor_loop(Erange, LLenergy):
+    return np.array([[LL_fillfactor(E, list(ll)) for E in Erange] for ll in LLenergy])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fields', type=int, default=1000)
+    parser.add_argument('--energies', type=int, default=1000)
+    parser.add_argument('--nmax', type=int, default=30)
+    parser.add_argument('--check', type=int, default=20, help='fields computed by the loop')
+    args = parser.parse_args()
+
+    Brange = np.linspace(0.5, 7, args.fields)
+    Erange = np.linspace(-0.05, 0.15, args.energies) * e0
+    LL_ts, LL_bs, _, _ = llenergy_generator_batch(0.08 * e0, 0.05 * e0, -0.02 * e0, Brange, 0, -0.2, Nmax=args.nmax,
+                                                  vf=0.5e6)
+    LLenergy = np.sort(np.concatenate([LL_ts, LL_bs], axis=-1), axis=-1)
+    check = np.linspace(0, args.fields - 1, min(args.check, args.fields)).astype(int)
+
+    t_loop, nu_loop = timed(fillfactor_loop, Erange, LLenergy[check])
+    t_map, (_, nu_map) = timed(LL_fillfactor_map, Erange, LLenergy, repeat=3)
+    t_loop *= args.fields / len(check)
+    print('grid (B x E) = {} x {}, {} levels'.format(args.fields, args.energies, LLenergy.shape[-1]))
+    print('LL_fillfactor loop: {:.3f} s (scaled from {} fields)'.format(t_loop, len(check)))
+    print('LL_fillfactor_map : {:.3f} s ({:.1f}x)'.format(t_map, t_loop / t_map))
+    print('identical on the checked fields: {}'.format(np.array_equal(nu_map[check], nu_loop)))
+
+
+if __name__ == '__main__':
+    main()
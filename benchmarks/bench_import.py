@@ -0,0 +1,51 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Measure the import time of the package and its modules in fresh interpreters, and which heavy modules
+(matplotlib.pyplot, scipy, ipywidgets, ...) every import pulls in.
+Example:
+python benchmarks/bench_import.py --repeat 5
+'''
+# Standard library imports
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY = ['matplotlib', 'matplotlib.pyplot', 'scipy', 'scipy.optimize', 'scipy.integrate', 'ipywidgets', 'pandas']
+TARGETS = {'package': 'import SciData',
+           'loaders': 'from SciData import Databs, Datamap, dir2fnm, read_file',
+           'batch': 'import SciData.batch',
+           'Landau levels': 'import SciData.functions_LandauLL'}
+
+SNIPPET = '''
+import json, sys, time
+sys.path.insert(0, {bench!r})
+from _common import load_package
+start = time.perf_counter()
+load_package()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'time': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(statement, repeat):
+    code = SNIPPET.format(bench=os.path.dirname(os.path.abspath(__file__)), statement=statement, heavy=HEAVY)
+    runs = [json.loads(subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                                      text=True).stdout) for _ in range(repeat)]
+    return statistics.median(run['time'] for run in runs), runs[-1]['loaded']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per target')
+    args = parser.parse_args()
+    for label, statement in TARGETS.items():
+        elapsed, loaded = measure(statement, args.repeat)
+        print('{:<14} {:7.1f} ms  loads: {}'.format(label, elapsed * 1e3, ', '.join(loaded) or '-'))
+
+
+if __name__ == '__main__':
+    main()
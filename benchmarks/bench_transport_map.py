@@ -0,0 +1,64 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Compare TBLLsimu.transport_map against computing the chemical potential, DOS and filling factor point by point
+(IDOS per field, find_energy_bydensity, electron/hole_density_of_state and LL_fillfactor) on a field x density grid
+Example:
+python benchmarks/bench_transport_map.py --fields 100 --densities 100 --threeband
+'''
+# Standard library imports
+import argparse
+
+# Third party imports
+import numpy as np
+
+# Local application import
+from _common import timed
+from functions_LandauLL import (LL_fillfactor, TBLLsimu, electron_density_of_state, erfIntegral_electron_DOS,
+                                erfIntegral_hole_DOS, find_energy_bydensity, hole_density_of_state)
+from physconst import e0
+
+
+def point_loop(simu, angle, Brange, densities, Erange, Nmax, den_top, den_bot, den_vps, threeband):
+    LL = simu.get_ll_en(angle, Brange, Nmax, den_top, den_bot, den_vps, threeband)
+    mu, dos, nu = [np.zeros((len(Brange), len(densities))) for _ in range(3)]
+    for i, B in enumerate(Brange):
+        IDOS_B = erfIntegral_electron_DOS(Erange, B, simu.sigmaE, angle, LL[0][i], LL[1][i])
+        if threeband:
+            IDOS_B = IDOS_B + erfIntegral_hole_DOS(Erange, B, simu.sigmaH, angle, LL[2][i], LL[3][i])
+        for j, density in enumerate(densities):
+            mu[i, j] = E = find_energy_bydensity(density, B, IDOS_B, Erange)
+            dos[i, j] = electron_density_of_state(E, B, simu.sigmaE, angle, LL[0][i], LL[1][i])
+            nu[i, j] = LL_fillfactor(E, LL[0][i]) + LL_fillfactor(E, LL[1][i])
+            if threeband:
+                dos[i, j] += hole_density_of_state(E, B, simu.sigmaH, angle, LL[2][i], LL[3][i])
+                nu[i, j] -= sum(ll > E for ll in LL[2][i] + LL[3][i])
+    return mu, dos, nu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fields', type=int, default=50)
+    parser.add_argument('--densities', type=int, default=50)
+    parser.add_argument('--energies', type=int, default=2000)
+    parser.add_argument('--nmax', type=int, default=20)
+    parser.add_argument('--threeband', action='store_true')
+    args = parser.parse_args()
+
+    simu = TBLLsimu(vf=0.5e6, gfactor=28, sigmaE=1e-3 * e0, sigmaH=2e-3 * e0, meff=-0.2)
+    Brange = np.linspace(0.5, 7, args.fields)
+    densities = np.linspace(1e15, 8e15, args.densities)
+    Erange = np.linspace(-0.1, 0.2, args.energies) * e0
+    setting = (20, Brange, densities, Erange, args.nmax, 2e15, 3e15, 1e15, args.threeband)
+
+    t_loop, (mu, dos, nu) = timed(point_loop, simu, *setting)
+    t_map, result = timed(simu.transport_map, *setting)
+    print('grid (B x density) = {} x {}, {} energies'.format(args.fields, args.densities, args.energies))
+    print('point by point: {:.3f} s'.format(t_loop))
+    print('transport_map : {:.3f} s ({:.1f}x)'.format(t_map, t_loop / t_map))
+    print('max |dmu| = {:.2e} meV'.format(np.abs(result['mu'] - mu).max() * 1e3 / e0))
+    print('max |dDOS|/max|DOS| = {:.2e}'.format(np.abs(result['dos'] - dos).max() / np.abs(dos).max()))
+    print('identical filling factors: {}'.format(np.array_equal(result['nu'], nu)))
+
+
+if __name__ == '__main__':
+    main()
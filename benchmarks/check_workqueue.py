@@ -0,0 +1,91 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Check of workqueue.py with several local worker processes on synthetic field sweep folders: every job has to be
+processed exactly once by all workers together, in a first run, in a run again (nothing to do), in a forced run
+and with a stale lock left behind by a crashed worker. Exits with 1 if a check fails.
+Example:
+python benchmarks/check_workqueue.py --jobs 12 --processes 4
+'''
+# Standard library imports
+import argparse
+import collections
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Local application import
+from _common import load_package
+from synthetic import make_bs_folder
+
+
+def work(*arguments, **kwargs):
+    load_package()  # also in spawned worker processes
+    return importlib.import_module('SciData.workqueue').work(*arguments, **kwargs)
+
+
+def run_workers(processes, jobs, outdir, queue, force=False, stale=120.):
+    '''work in several processes at once, like python -m SciData.workqueue -j processes'''
+    since = time.time()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(work, jobs, outdir, queue, force, False, stale / 4, stale, False, since)
+                   for _ in range(processes)]
+        return [result for future in futures for result in future.result()]
+
+
+def check(title, results, expected):
+    '''every job in expected processed once ('done'), no other job processed'''
+    counts = collections.Counter(name for name, _, _ in results)
+    failed = [(name, state) for name, state, _ in results if state != 'done']
+    passed = counts == collections.Counter(expected) and not failed
+    print('{:<32}{:>4} jobs processed, {}'.format(title, len(results), 'ok' if passed else 'FAILED'))
+    if not passed:
+        print('    processed more than once: {}'.format(sorted(name for name, n in counts.items() if n > 1)))
+        print('    not processed: {}'.format(sorted(set(expected) - set(counts))))
+        print('    failed: {}'.format(failed))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=12)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--files', type=int, default=4, help='files per folder')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='workqueue_')
+    try:
+        jobs = [{'folder': make_bs_folder(os.path.join(root, 'data', 'bs{}'.format(index)), files=args.files,
+                                          points=500, seed=index),
+                 'kind': 'bs', 'ucols': [0, 1, 2, 3], 'spr': 1, 'ref': 1e4, 'fitrange': [-0.5, 0.5]}
+                for index in range(args.jobs)]
+        names = ['bs{}'.format(index) for index in range(args.jobs)]
+        outdir, queue = os.path.join(root, 'out'), os.path.join(root, 'queue')
+        passed = [check('first run', run_workers(args.processes, jobs, outdir, queue), names),
+                  check('run again (up to date)', run_workers(args.processes, jobs, outdir, queue), []),
+                  check('forced run', run_workers(args.processes, jobs, outdir, queue, force=True), names)]
+
+        # a worker crashed while holding bs0: its lock is older than the stale time, the output is missing
+        os.remove(os.path.join(outdir, 'bs0.npz'))
+        lockfile = os.path.join(queue, 'locks', 'bs0.lock')
+        with open(lockfile, 'w') as f:
+            json.dump({'host': 'crashed', 'pid': 0, 'worker': 'crashed', 'claimed': 0}, f)
+        os.utime(lockfile, (time.time() - 10, time.time() - 10))
+        passed.append(check('stale lock taken over', run_workers(args.processes, jobs, outdir, queue, stale=5.),
+                            ['bs0']))
+        leftovers = [entry for entry in os.listdir(os.path.join(queue, 'locks'))] + [
+            entry for entry in os.listdir(outdir) if entry.endswith('.tmp')]
+        passed.append(not leftovers)
+        print('{:<32}{}'.format('no locks or temp files left', 'ok' if not leftovers else 'FAILED {}'.format(
+            leftovers)))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return int(not all(passed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
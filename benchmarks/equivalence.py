@@ -0,0 +1,220 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Differential test of the accelerated functions against the reference implementations they replace.
+Both are run on the same generated inputs; for every output the maximum absolute error and the maximum error
+relative to the largest reference value are reported, together with the time of both and the speedup.
+Pairs: H1st_ft/fastH1st_ft, fastIntegral_*_DOS/erfIntegral_*_DOS, *_density_of_state/windowed_*_DOS,
+erfIntegral_electron_DOS exact/windowed (tol), diffz_df/fastdiffz_df, fc_interp/fastfc_interp,
+peakIden/fastpeakIden, pandas.read_csv/read_dat, and the float64/float32 storage of Databs (Hall fit) and Datamap (maps).
+Exits with 1 if an error is larger than the tolerance of its pair.
+Example:
+python benchmarks/equivalence.py --size 4 -o equivalence.json
+'''
+# Standard library imports
+import argparse
+import atexit
+import functools
+import json
+import shutil
+import sys
+import tempfile
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+# Local application import
+from _common import load_package, timed
+from synthetic import REF, density, hallbar, make_bs_folder, make_map_folder
+
+
+def hall_inputs(sd, size, rng):
+    bf = np.linspace(-0.5, 0.5, 1000 * size)
+    rxx, rxy = hallbar(bf, density(rng.uniform(-1, 1)), rng=rng)
+    return (pd.Series(bf), pd.Series(rxx), pd.Series(rxy)), {'AspRatio': 3, 'fitpara_output': True, 'call': False}
+
+
+def hall_outputs(result):
+    density, mobility, fitParams = result
+    return {'density': density, 'mobility': mobility, 'fitParams': fitParams}
+
+
+def landau_inputs(sd, size, rng, hole=False):
+    LL = sd.functions_LandauLL
+    B = rng.uniform(1, 7)
+    levels = LL.llenergy_generator(0.08 * sd.e0, 0.05 * sd.e0, -0.02 * sd.e0, B, 30, -0.2, Nmax=10 * size)
+    energy = np.linspace(-0.1, 0.2, 500 * size) * sd.e0
+    return (energy, B, 1e-3 * sd.e0, 30) + tuple(levels[2:] if hole else levels[:2]), {}
+
+
+def dos_loop(density_of_state):
+    '''density_of_state of functions_LandauLL evaluated energy by energy, as in TBLLsimu.plot_DOS'''
+    def dos(energy, *args):
+        return np.array([density_of_state(E, *args) for E in energy])
+    return dos
+
+
+def map_frame(size, rng):
+    gate, bf = np.meshgrid(np.linspace(-1, 1, 10 * size), np.linspace(-2, 2, 200 * size), indexing='ij')
+    frame = pd.DataFrame({'gate': gate.ravel(), 'bf': bf.ravel(),
+                          'sxy': np.sin(3 * gate.ravel() * bf.ravel()) + 1e-3 * rng.standard_normal(gate.size)})
+    return frame.sample(frac=1, random_state=0)  # the functions have to sort the rows themselves
+
+
+def diff_inputs(sd, size, rng):
+    return (map_frame(size, rng), ['gate', 'bf'], 'sxy'), {}
+
+
+def diff_outputs(result):
+    ax_rest, ax_diff, z_array, z_df = result
+    return {'ax_rest': ax_rest, 'ax_diff': ax_diff, 'z_array': z_array, 'z_df': z_df.to_numpy()}
+
+
+def interp_inputs(sd, size, rng):
+    ax_rest, ax_diff, _, z_df = sd.fastdiffz_df(map_frame(size, rng), ['gate', 'bf'], 'sxy')
+    return (ax_rest, ax_diff, z_df.sxy), {}
+
+
+def peak_inputs(sd, size, rng):
+    x = np.linspace(0, 100, 10000 * size)
+    y = np.sin(x) + 0.3 * np.sin(7.3 * x) + 0.01 * rng.standard_normal(len(x))
+    return (x.tolist(), y.tolist(), list(range(len(x)))), {}
+
+
+def folder_inputs(maker, sd, size, rng):
+    # odd number of points: the zero-field point used for the mobility is unique, no tie between +-B
+    path = maker(tempfile.mkdtemp(prefix='equivalence_'), 5 * size, 2000 * size + 1, seed=int(rng.integers(1 << 31)))
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return (sd.dir2fnm(path, sort_by_fnm=True), sd.read_file(path, sort_by_fnm=True), [0, 1, 2, 3], 1, REF), {}
+
+
+def file_inputs(sd, size, rng):
+    path = folder_inputs(make_bs_folder, sd, size, rng)[0][0][0]
+    return (path, 1, [0, 1, 2, 3], ['bf', 'curr', 'uxx', 'uxy']), {}
+
+
+def read_csv(path, spr, ucols, nms):
+    return pd.read_csv(path, sep="\t", skiprows=spr, usecols=ucols, names=nms, header=None, encoding='unicode_escape')
+
+
+def frame_outputs(result):
+    return {column: result[column].to_numpy() for column in result.columns}
+
+
+def hallfit(cls, dtype, *args):
+    return cls(*args, dtype=dtype).hallfit([-0.5, 0.5], call=False)
+
+
+def hallfit_outputs(result):
+    return {'dens': result.dens.to_numpy(), 'mob': result.mob.to_numpy()}
+
+
+def getmap(cls, dtype, *args):
+    return cls(*args, dtype=dtype).getdata()
+
+
+def map_outputs(result):
+    fc, _ = result
+    return {key: fc[key] for key in ['rxx2d', 'rxy2d', 'sxy2d', 'dv1', 'dv2']}
+
+
+def outputs(result):
+    if isinstance(result, tuple):
+        return {'out{}'.format(index): value for index, value in enumerate(result)}
+    return {'out': result}
+
+
+# name: (inputs, reference, accelerated, outputs, tolerance of the relative error)
+CASES = {
+    'H1st_ft': (hall_inputs, lambda sd: sd.H1st_ft, lambda sd: sd.fastH1st_ft, hall_outputs, 1e-6),
+    'Integral_electron_DOS': (landau_inputs, lambda sd: sd.functions_LandauLL.fastIntegral_electron_DOS,
+                              lambda sd: sd.functions_LandauLL.erfIntegral_electron_DOS, outputs, 1e-9),
+    'Integral_hole_DOS': (lambda sd, size, rng: landau_inputs(sd, size, rng, hole=True),
+                          lambda sd: sd.functions_LandauLL.fastIntegral_hole_DOS,
+                          lambda sd: sd.functions_LandauLL.erfIntegral_hole_DOS, outputs, 1e-9),
+    'electron_DOS': (landau_inputs, lambda sd: dos_loop(sd.functions_LandauLL.electron_density_of_state),
+                     lambda sd: sd.functions_LandauLL.windowed_electron_DOS, outputs, 1e-9),
+    'hole_DOS': (lambda sd, size, rng: landau_inputs(sd, size, rng, hole=True),
+                 lambda sd: dos_loop(sd.functions_LandauLL.hole_density_of_state),
+                 lambda sd: sd.functions_LandauLL.windowed_hole_DOS, outputs, 1e-9),
+    'IDOS_windowed': (landau_inputs, lambda sd: sd.functions_LandauLL.erfIntegral_electron_DOS,
+                      lambda sd: functools.partial(sd.functions_LandauLL.erfIntegral_electron_DOS, tol=1e-12),
+                      outputs, 1e-9),
+    'diffz_df': (diff_inputs, lambda sd: sd.diffz_df, lambda sd: sd.fastdiffz_df, diff_outputs, 0),
+    'fc_interp': (interp_inputs, lambda sd: sd.fc_interp, lambda sd: sd.fastfc_interp, outputs, 0),
+    'peakIden': (peak_inputs, lambda sd: sd.peakFind.peakIden, lambda sd: sd.peakFind.fastpeakIden, outputs, 0),
+    'read_dat': (file_inputs, lambda sd: read_csv, lambda sd: sd.read_dat, frame_outputs, 0),
+    'Databs_float32': (functools.partial(folder_inputs, make_bs_folder),
+                       lambda sd: functools.partial(hallfit, sd.Databs, None),
+                       lambda sd: functools.partial(hallfit, sd.Databs, 'float32'), hallfit_outputs, 1e-5),
+    'Datamap_float32': (functools.partial(folder_inputs, make_map_folder),
+                        lambda sd: functools.partial(getmap, sd.Datamap, None),
+                        lambda sd: functools.partial(getmap, sd.Datamap, 'float32'), map_outputs, 1e-3),
+}
+
+
+def errors(reference, accelerated):
+    '''max absolute error and max absolute error / max |reference| of two outputs'''
+    reference = np.asarray(reference, dtype=float)
+    accelerated = np.asarray(accelerated, dtype=float)
+    if reference.shape != accelerated.shape:
+        return float('inf'), float('inf')
+    if reference.size == 0:
+        return 0., 0.
+    absolute = float(np.nanmax(np.abs(accelerated - reference))) if np.isfinite(reference).any() else 0.
+    if not np.array_equal(np.isnan(reference), np.isnan(accelerated)):
+        absolute = float('inf')
+    scale = float(np.nanmax(np.abs(reference))) if np.isfinite(reference).any() else 0.
+    return absolute, absolute / scale if scale else absolute
+
+
+def check(name, size=1, repeat=3, seed=0):
+    '''
+    Run one pair on generated inputs
+    :return: {'reference_time', 'accelerated_time', 'speedup', 'tolerance', 'passed', 'outputs': {output: errors}}
+    '''
+    sd = load_package()
+    make_inputs, reference, accelerated, split, tolerance = CASES[name]
+    args, kwargs = make_inputs(sd, size, np.random.default_rng(seed))
+    t_reference, result_reference = timed(reference(sd), *args, repeat=repeat, **kwargs)
+    t_accelerated, result_accelerated = timed(accelerated(sd), *args, repeat=repeat, **kwargs)
+    expected = split(result_reference)
+    found = split(result_accelerated)
+    report = {'reference_time': t_reference, 'accelerated_time': t_accelerated,
+              'speedup': t_reference / t_accelerated, 'tolerance': tolerance, 'outputs': {}}
+    for output in expected:
+        absolute, relative = errors(expected[output], found[output])
+        report['outputs'][output] = {'max_abs': absolute, 'max_rel': relative}
+    report['passed'] = all(entry['max_rel'] <= tolerance for entry in report['outputs'].values())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--size', type=int, default=1, help='scale of the generated inputs')
+    parser.add_argument('--repeat', type=int, default=3, help='best of repeat runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help='write the reports to this JSON file')
+    args = parser.parse_args()
+
+    reports = {}
+    print('{:<24}{:<12}{:>11}{:>11}{:>12}{:>12}{:>9}'.format('pair', 'output', 'max abs', 'max rel', 'ref (s)',
+                                                             'fast (s)', 'speedup'))
+    for name in args.cases:
+        report = reports[name] = check(name, args.size, args.repeat, args.seed)
+        for index, (output, entry) in enumerate(report['outputs'].items()):
+            timing = ('{:12.5f}{:12.5f}{:8.1f}x'.format(report['reference_time'], report['accelerated_time'],
+                                                        report['speedup']) if index == 0 else '')
+            print('{:<24}{:<12}{:11.2e}{:11.2e}{}'.format(name if index == 0 else '', output, entry['max_abs'],
+                                                          entry['max_rel'], timing))
+        if not report['passed']:
+            print('{:<24}FAILED, tolerance {:.0e}'.format('', report['tolerance']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+    return int(not all(report['passed'] for report in reports.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
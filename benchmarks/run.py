@@ -0,0 +1,205 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Benchmark suite: time the hot paths of the package on synthetic data folders (see synthetic.py) at several scales
+and store the results as JSON, so that commits can be compared.
+Workloads: load (Databs/Datamap.getdata), hallfit, twocarrierfit, diff/interp (diffz_df + fc_interp),
+FFT map (cutout_bkgd + interp_user + FFT_bs per gate), peak finding (peakFilter.peakPos per gate),
+TBLLsimu IDOS (get_ll_en + IDOS_generator) and Landau fan (get_ll_den).
+The data folders are generated once in --data and reused.
+Example:
+python benchmarks/run.py --scales small medium -o before.json
+python benchmarks/run.py --scales small medium -o after.json --compare before.json
+python benchmarks/run.py --scales large --workloads load_map --memory --dtype float32
+'''
+# Standard library imports
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+
+# Third party imports
+import numpy as np
+
+# Local application import
+from _common import REPO, load_package, timed
+from synthetic import REF, make_bs_folder, make_map_folder
+
+# files x points of the data folders, fields x energies x Landau levels of the simulations
+SCALES = {'small': {'files': 5, 'points': 1000, 'fields': 10, 'energies': 200, 'nmax': 10},
+          'medium': {'files': 20, 'points': 5000, 'fields': 40, 'energies': 500, 'nmax': 20},
+          'large': {'files': 50, 'points': 20000, 'fields': 60, 'energies': 1000, 'nmax': 30}}
+UCOLS = [0, 1, 2, 3]
+FITRANGE = [-0.5, 0.5]
+FFT_RANGE = [0.5, 4.]
+
+
+def folder(data, kind, scale, maker):
+    path = os.path.join(data, '{}_{}x{}'.format(kind, scale['files'], scale['points']))
+    if not os.path.isdir(path):
+        maker(path, scale['files'], scale['points'])
+    return path
+
+
+def loader(sd, cls, path, dtype=None):
+    return cls(sd.dir2fnm(path, sort_by_fnm=True), sd.read_file(path, sort_by_fnm=True), UCOLS, 1, REF, dtype=dtype)
+
+
+def load_bs(sd, bs, databundle, scale):
+    return bs.getdata()
+
+
+def load_map(sd, datamap, databundle, scale):
+    return datamap.getdata()
+
+
+def hallfit(sd, bs, databundle, scale):
+    return bs.hallfit(FITRANGE, call=False)
+
+
+def twocarrierfit(sd, bs, databundle, scale):
+    low_field = sd.df_range(databundle, 'bf', [-1, 1])
+    return [sd.twocarrierfit(block.bf, block.rxy) for _, block in low_field.groupby('gate')]
+
+
+def diff_interp(sd, bs, databundle, scale):
+    x_bybf, y_bybf, _, diffsxy_bybf = sd.diffz_df(databundle, ['gate', 'bf'], 'sxy')
+    return sd.fc_interp(x_bybf, y_bybf, diffsxy_bybf.sxy)
+
+
+def fft_map(sd, bs, databundle, scale):
+    spectra = []
+    for _, block in sd.df_range(databundle, 'bf', FFT_RANGE).groupby('gate'):
+        signal = sd.cutout_bkgd(1. / block.bf.values, block.rxx.values)
+        x_vals, yinterp = sd.interp_user(1. / block.bf.values, signal, len(block))
+        spectra.append(sd.FFT_bs(x_vals, yinterp))
+    return spectra
+
+
+def peaks(sd, bs, databundle, scale):
+    finder = sd.peakFind.peakFilter(databundle.rxx.mean(), 0.5, 8.)
+    return [finder.peakPos(block.bf.tolist(), block.rxx.tolist()) for _, block in databundle.groupby('gate')]
+
+
+def simulation(sd, scale):
+    simu = sd.functions_LandauLL.TBLLsimu(vf=0.5e6, gfactor=28, sigmaE=1e-3 * sd.e0, sigmaH=2e-3 * sd.e0, meff=-0.2)
+    Brange = np.linspace(1, 7, scale['fields'])
+    Erange = np.linspace(-0.05, 0.1, scale['energies']) * sd.e0
+    return simu, Brange, Erange
+
+
+def ll_idos(sd, bs, databundle, scale):
+    simu, Brange, Erange = simulation(sd, scale)
+    LL = simu.get_ll_en(30, Brange, scale['nmax'], 2e15, 3e15)
+    return simu.IDOS_generator(30, Brange, Erange, *LL)
+
+
+def ll_fan(sd, bs, databundle, scale):
+    simu, Brange, Erange = simulation(sd, scale)
+    return simu.get_ll_den(30, Brange, Erange, scale['nmax'], 2e15, 3e15)
+
+
+# name: (workload, points processed)
+WORKLOADS = {'load_bs': (load_bs, lambda s: s['files'] * s['points']),
+             'load_map': (load_map, lambda s: s['files'] * s['points']),
+             'hallfit': (hallfit, lambda s: s['files'] * s['points']),
+             'twocarrierfit': (twocarrierfit, lambda s: s['files']),
+             'diff_interp': (diff_interp, lambda s: s['files'] * s['points']),
+             'fft_map': (fft_map, lambda s: s['files'] * s['points']),
+             'peaks': (peaks, lambda s: s['files'] * s['points']),
+             'll_idos': (ll_idos, lambda s: s['fields'] * s['energies']),
+             'll_fan': (ll_fan, lambda s: s['fields'] * s['energies'])}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    import pandas
+    import scipy
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pandas.__version__,
+            'scipy': scipy.__version__, 'machine': platform.platform()}
+
+
+def run(scales, workloads, data, repeat=1, dtype=None, memory=False):
+    '''
+    Time the workloads at the given scales
+    :param dtype: storage type of the loaded data (see Datajungle)
+    :param memory: also record the memory high-water mark of every workload (tracemalloc, slower)
+    :return: {scale: {workload: {'time': best wall time (s), 'points': points processed, 'peak_memory': bytes}}}
+    '''
+    sd = load_package()
+    # the fits import scipy on first use, keep the import out of the timings
+    import scipy.interpolate
+    import scipy.optimize
+    results = {}
+    for name in scales:
+        scale = SCALES[name]
+        bs = loader(sd, sd.Databs, folder(data, 'bs', scale, make_bs_folder), dtype)
+        datamap = loader(sd, sd.Datamap, folder(data, 'map', scale, make_map_folder), dtype)
+        databundle = bs.getdata()
+        results[name] = {}
+        for workload in workloads:
+            func, points = WORKLOADS[workload]
+            target = datamap if workload == 'load_map' else bs
+            elapsed, _ = timed(func, sd, target, databundle, scale, repeat=repeat)
+            entry = results[name][workload] = {'time': elapsed, 'points': points(scale)}
+            if memory:
+                tracemalloc.start()
+                func(sd, target, databundle, scale)
+                entry['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            print('{:<8}{:<15}{:10.4f} s{}'.format(name, workload, elapsed, '{:10.1f} MB'.format(
+                entry['peak_memory'] / 2 ** 20) if memory else ''), flush=True)
+    return results
+
+
+def compare(results, reference):
+    '''text table of the times relative to a reference run (ratio > 1: slower than the reference)'''
+    lines = ['{:<8}{:<15}{:>11}{:>11}{:>8}'.format('scale', 'workload', 'ref (s)', 'now (s)', 'ratio')]
+    for name, workloads in results.items():
+        for workload, entry in workloads.items():
+            old = reference.get(name, {}).get(workload)
+            if old is None:
+                continue
+            lines.append('{:<8}{:<15}{:11.4f}{:11.4f}{:8.2f}'.format(name, workload, old['time'], entry['time'],
+                                                                     entry['time'] / old['time']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'])
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument('--repeat', type=int, default=1, help='best of repeat runs')
+    parser.add_argument('--dtype', default=None, help='storage type of the loaded data, e.g. float32')
+    parser.add_argument('--memory', action='store_true', help='record the memory high-water mark of every workload')
+    parser.add_argument('--data', default=os.path.join(REPO, 'benchmarks', 'data'), help='synthetic data folders')
+    parser.add_argument('-o', '--output', default=None,
+                        help='result file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='result file of a reference run')
+    args = parser.parse_args()
+
+    meta = environment()
+    results = run(args.scales, args.workloads, args.data, args.repeat, args.dtype, args.memory)
+    output = args.output or os.path.join(REPO, 'benchmarks', 'results', '{}.json'.format(meta['commit'] or 'run'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'meta': dict(meta, dtype=args.dtype), 'scales': {name: SCALES[name] for name in args.scales}, 'results': results}, f,
+                  indent=2)
+    print('results written to {}'.format(output))
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        print('compared to {} ({})'.format(args.compare, reference['meta'].get('commit')))
+        print(compare(results, reference['results']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
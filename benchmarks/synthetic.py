@@ -0,0 +1,116 @@
+# Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Synthetic measurement folders in the instrument format (tab-separated, one header line) for the benchmarks.
+A Hall bar with a gate-tunable density: Hall slope 1/(n e), quantum Hall plateaus h/(nu e^2) at high field
+and Shubnikov-de Haas oscillations in Rxx, plus noise.
+Columns: swept quantity, voltage over the reference resistor (curr), uxx, uxy -> load with
+ucols=[0, 1, 2, 3], spr=1, ref=REF
+Example:
+python benchmarks/synthetic.py bs /tmp/bs_folder --files 50 --points 10000
+'''
+# Standard library imports
+import argparse
+import os
+
+# Third party imports
+import numpy as np
+
+e0 = 1.6021766208E-19
+h0 = 6.62607015E-34
+REF = 1e4  # reference resistor in series
+CURRENT = 1e-8  # excitation current
+ASPRATIO = 3
+
+
+def density(gate):
+    '''carrier density (m^-2) at a gate voltage'''
+    return 2e15 + 1e15 * gate
+
+
+def hallbar(bf, n, mobility=10., broadening=0.08, noise=1e-3, rng=None):
+    '''
+    Rxx and Rxy of a Hall bar with density n at the fields bf
+    :param mobility: in m^2/Vs, sets the onset of the SdH oscillations and plateaus
+    :param broadening: width of the steps between quantum Hall plateaus (in units of filling factor)
+    :param noise: relative noise
+    '''
+    rng = np.random.default_rng(0) if rng is None else rng
+    bf = np.where(np.abs(bf) < 1e-6, 1e-6, bf)
+    nu = n * h0 / e0 / np.abs(bf)  # filling factor
+    fraction = nu - np.floor(nu)
+    staircase = np.floor(nu) + 0.5 * (1 + np.tanh((fraction - 0.5) / broadening))
+    steps = 1 / np.cosh((fraction - 0.5) / broadening) ** 2  # 1 between plateaus, 0 on a plateau
+    damping = np.exp(-np.pi / (mobility * np.abs(bf)))  # SdH amplitude
+    quantum = damping ** 4  # plateaus develop at higher field
+    nu_eff = (1 - quantum) * nu + quantum * np.maximum(staircase, 0.5)
+    rxy = np.sign(bf) * h0 / e0 ** 2 / nu_eff
+    rxx0 = ASPRATIO / (n * e0 * mobility)
+    rxx = rxx0 * (1 + damping * (2 * steps - 1)) * (1 + 0.02 * bf ** 2)
+    rxx = rxx * (1 + noise * rng.standard_normal(len(bf)))
+    rxy = rxy * (1 + noise * rng.standard_normal(len(bf)))
+    return rxx, rxy
+
+
+def step_name(value, unit):
+    '''filename tag readable by getnumber, e.g. -0.25 V -> m0p2500V'''
+    return '{:.4f}'.format(value).replace('-', 'm').replace('.', 'p') + unit
+
+
+def write_sweep(path, x, rxx, rxy, header):
+    curr = np.full(len(x), CURRENT * REF)
+    with open(path, 'w') as f:
+        f.write(header + '\n')
+        np.savetxt(f, np.column_stack([x, curr, rxx * CURRENT, rxy * CURRENT]), delimiter='\t', fmt='%.9e')
+
+
+def make_bs_folder(folder, files=20, points=2000, bmax=8., gates=(-1., 1.), seed=0):
+    '''field sweeps (-bmax..bmax) at equally spaced gate voltages, load with Databs'''
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    bf = np.linspace(-bmax, bmax, points)
+    for gate in np.linspace(gates[0], gates[1], files):
+        rxx, rxy = hallbar(bf, density(gate), rng=rng)
+        write_sweep(os.path.join(folder, 'bsweep_{}.dat'.format(step_name(gate, 'V'))), bf, rxx, rxy,
+                    'B(T)\tUref(V)\tUxx(V)\tUxy(V)')
+    return folder
+
+
+def make_gs_folder(folder, files=20, points=2000, fields=(0.5, 8.), gates=(-1., 1.), seed=0):
+    '''gate sweeps at equally spaced fields, load with Datags'''
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    gate = np.linspace(gates[0], gates[1], points)
+    for bf in np.linspace(fields[0], fields[1], files):
+        rxx, rxy = hallbar(np.full(points, bf), density(gate), rng=rng)
+        write_sweep(os.path.join(folder, 'gsweep_{}.dat'.format(step_name(bf, 'T'))), gate, rxx, rxy,
+                    'Vg(V)\tUref(V)\tUxx(V)\tUxy(V)')
+    return folder
+
+
+def make_map_folder(folder, files=20, points=2000, bf=4., gates=(-1., 1.), seed=0):
+    '''dual-gate map: sweeps of gate 1 at equally spaced gate 2 and fixed field, load with Datamap'''
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    v1 = np.linspace(gates[0], gates[1], points)
+    for v2 in np.linspace(gates[0], gates[1], files):
+        rxx, rxy = hallbar(np.full(points, bf), density(0.6 * v1 + 0.4 * v2), rng=rng)
+        write_sweep(os.path.join(folder, 'map_{}.dat'.format(step_name(v2, 'V'))), v1, rxx, rxy,
+                    'V1(V)\tUref(V)\tUxx(V)\tUxy(V)')
+    return folder
+
+
+MAKERS = {'bs': make_bs_folder, 'gs': make_gs_folder, 'map': make_map_folder}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=list(MAKERS))
+    parser.add_argument('folder')
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+    MAKERS[args.kind](args.folder, args.files, args.points)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Disk-backed store of fit results (sqlite), so that Hall fits and density/mobility calculations are only done once
+per folder and settings and can be compared across devices and cooldowns.
+
+A fit is identified by its source folder, its kind (hallfit, denCal_single, denCal_double) and its settings
+(loader settings + fit arguments); it is valid as long as the files (names, modification times, sizes) are unchanged.
+    store = FitStore('fits.sqlite')
+    fitres = store.hallfit(databs, [-0.5, 0.5])          # computed once, then read from the store
+    dens, mob = store.denCal_single(datamap, 3, [-1, 1], gates, 0)
+    store.query(kind='hallfit', quantity='dens', x_range=[-0.1, 0.1])   # all stored Hall densities around 0 V
+'''
+# Standard library
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Third party
+import numpy as np
+import pandas as pd
+
+# Local application
+from .SciData import denCal_double, denCal_single
+
+__all__ = ['FitStore', 'source_signature']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fits (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (folder, kind, settings));
+CREATE TABLE IF NOT EXISTS results (
+    fit_id INTEGER NOT NULL REFERENCES fits (id) ON DELETE CASCADE,
+    row INTEGER,
+    x REAL,
+    quantity TEXT NOT NULL,
+    value REAL);
+CREATE INDEX IF NOT EXISTS results_fit ON results (fit_id);
+CREATE INDEX IF NOT EXISTS results_quantity ON results (quantity, x);
+CREATE INDEX IF NOT EXISTS fits_kind ON fits (kind, folder);
+'''
+
+
+def source_signature(files):
+    '''
+    Hash of the names, modification times and sizes of the files of a data set
+    '''
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update('{}|{}|{}\n'.format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size).encode())
+    return digest.hexdigest()
+
+
+def _plain(value):
+    '''numpy scalars and arrays (e.g. in ucols or ref) as JSON values'''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('Error: {} is not JSON serialisable'.format(type(value).__name__))
+
+
+def _settings_key(settings):
+    return json.dumps(settings, sort_keys=True, default=_plain)
+
+
+def _folder(data):
+    return os.path.dirname(os.path.commonprefix([os.path.abspath(path) for path in data.dir]) + 'x')
+
+
+def _loader_settings(data):
+    settings = {key: data.__dict__[key] for key in ['ucols', 'nms', 'spr', 'ref', 'AspRatio'] if key in data.__dict__}
+    settings['class'] = type(data).__name__
+    settings['dtype'] = None if getattr(data, 'dtype', None) is None else str(data.dtype)
+    return settings
+
+
+class FitStore:
+    '''
+    Fit results in an sqlite file
+    METHODS:
+    hallfit: Databs.hallfit, cached
+    denCal_single, denCal_double: the functions of the same name, cached
+    get/put: read/write a result table by folder, kind, settings
+    query: all stored results as a long DataFrame (folder, kind, settings, created, x, quantity, value)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')  # readers do not block a writing batch job
+        self.connection.executescript(SCHEMA)
+        if 'row' not in [column[1] for column in self.connection.execute('PRAGMA table_info(results)')]:
+            with self.connection:  # stores written before the row position was stored
+                self.connection.execute('ALTER TABLE results ADD COLUMN row INTEGER')
+
+    def __repr__(self):
+        return 'FitStore(path = {!r}, fits = {})'.format(self.path, len(self))
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM fits').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, folder, kind, settings, signature=None):
+        '''
+        Stored result table {x, quantity: value} as a DataFrame with the rows in stored order, None if there is none
+        or if it was computed from other files than signature
+        '''
+        fit = self.connection.execute('SELECT id, signature FROM fits WHERE folder = ? AND kind = ? AND settings = ?',
+                                      (folder, kind, _settings_key(settings))).fetchone()
+        if fit is None or (signature is not None and fit[1] != signature):
+            return None
+        results = pd.read_sql_query('SELECT row, x, quantity, value FROM results WHERE fit_id = ? ORDER BY rowid',
+                                    self.connection, params=(fit[0],))
+        # position of every value in the stored table (x may repeat), older stores: the order of insertion
+        results['row'] = results['row'].fillna(results.groupby('quantity').cumcount()).astype(int)
+        table = results.pivot(index='row', columns='quantity', values='value')
+        x = results.drop_duplicates('row').set_index('row')['x']
+        # keep the order of the rows and of the quantities as they were stored
+        table = table.loc[x.index, pd.unique(results.quantity)]
+        table.insert(0, 'x', x.to_numpy())
+        return table.reset_index(drop=True).rename_axis(columns=None)
+
+    def put(self, folder, kind, settings, signature, table):
+        '''
+        Store a result table (DataFrame with the column x and one column per quantity), replacing an older one
+        '''
+        with self.connection:
+            self.connection.execute('DELETE FROM fits WHERE folder = ? AND kind = ? AND settings = ?',
+                                    (folder, kind, _settings_key(settings)))
+            fit_id = self.connection.execute(
+                'INSERT INTO fits (folder, kind, settings, signature, created) VALUES (?, ?, ?, ?, ?)',
+                (folder, kind, _settings_key(settings), signature, time.time())).lastrowid
+            quantities = [column for column in table.columns if column != 'x']
+            x = table['x'].to_numpy(dtype=float)
+            self.connection.executemany(
+                'INSERT INTO results (fit_id, row, x, quantity, value) VALUES (?, ?, ?, ?, ?)',
+                [(fit_id, position, float(xi), quantity, float(value)) for quantity in quantities
+                 for position, (xi, value) in enumerate(zip(x, table[quantity].to_numpy(dtype=float)))])
+
+    def cached(self, data, kind, arguments, compute):
+        '''
+        Result table of compute() for the data set, read from the store if data and arguments are unchanged
+        '''
+        folder = _folder(data)
+        settings = dict(_loader_settings(data), **arguments)
+        signature = source_signature(data.dir)
+        table = self.get(folder, kind, settings, signature)
+        if table is None:
+            table = compute()
+            self.put(folder, kind, settings, signature, table)
+        return table
+
+    def hallfit(self, data, fitrange, call=False):
+        '''
+        Databs.hallfit(fitrange) through the store
+        :return: DataFrame with the columns gate, dens, mob
+        '''
+        def compute():
+            return data.hallfit(fitrange, call=call).rename(columns={'gate': 'x'})
+        table = self.cached(data, 'hallfit', {'fitrange': list(fitrange)}, compute)
+        return table.rename(columns={'x': 'gate'})
+
+    def denCal_single(self, data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit, residual_field_in_T,
+                      call=False):
+        '''
+        denCal_single through the store (plots only when it is computed)
+        :return: dens, mob (lists)
+        '''
+        def compute():
+            dens, mob = denCal_single(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit,
+                                      residual_field_in_T, call)
+            return pd.DataFrame({'x': gate_range_to_fit, 'dens': dens, 'mob': mob})
+        arguments = {'AspRatio': AspRatio, 'bf_range': list(bf_range_to_fit),
+                     'gates': [float(gate) for gate in gate_range_to_fit], 'residual_field': residual_field_in_T}
+        table = self.cached(data_formatted, 'denCal_single', arguments, compute)
+        return table['dens'].tolist(), table['mob'].tolist()
+
+    def denCal_double(self, data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit, residual_field_in_T,
+                      alternating=False, call=False):
+        '''
+        denCal_double through the store (plots only when it is computed)
+        :return: ndens, nmob, pdens, pmob (lists)
+        '''
+        def compute():
+            ndens, nmob, pdens, pmob = denCal_double(data_formatted, AspRatio, bf_range_to_fit, gate_range_to_fit,
+                                                     residual_field_in_T, alternating, call)
+            return pd.DataFrame({'x': gate_range_to_fit, 'ndens': ndens, 'nmob': nmob, 'pdens': pdens, 'pmob': pmob})
+        arguments = {'AspRatio': AspRatio, 'bf_range': list(bf_range_to_fit),
+                     'gates': [float(gate) for gate in gate_range_to_fit], 'residual_field': residual_field_in_T,
+                     'alternating': alternating}
+        table = self.cached(data_formatted, 'denCal_double', arguments, compute)
+        return tuple(table[quantity].tolist() for quantity in ['ndens', 'nmob', 'pdens', 'pmob'])
+
+    def query(self, kind=None, folder=None, quantity=None, x_range=None):
+        '''
+        Stored results matching all given conditions
+        :param kind: hallfit, denCal_single or denCal_double
+        :param folder: source folder (prefix, e.g. all folders of a cooldown)
+        :param quantity: e.g. dens, mob, ndens
+        :param x_range: [min, max] of the gate/step value
+        :return: long DataFrame (folder, kind, settings, created, x, quantity, value)
+        '''
+        conditions, parameters = [], []
+        if kind is not None:
+            conditions.append('fits.kind = ?')
+            parameters.append(kind)
+        if folder is not None:
+            conditions.append('fits.folder LIKE ?')
+            parameters.append(os.path.abspath(folder).replace('%', r'\%').replace('_', r'\_') + '%')
+        if quantity is not None:
+            conditions.append('results.quantity = ?')
+            parameters.append(quantity)
+        if x_range is not None:
+            conditions.append('results.x BETWEEN ? AND ?')
+            parameters.extend([float(np.min(x_range)), float(np.max(x_range))])
+        where = ' WHERE ' + ' AND '.join(condition + (" ESCAPE '\\'" if 'LIKE' in condition else '')
+                                         for condition in conditions) if conditions else ''
+        return pd.read_sql_query('SELECT fits.folder, fits.kind, fits.settings, fits.created, results.x, '
+                                 'results.quantity, results.value FROM results JOIN fits ON results.fit_id = fits.id'
+                                 + where + ' ORDER BY fits.id, results.rowid', self.connection, params=parameters)
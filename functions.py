@@ -1,60 +1,158 @@
 # Copyright 2021 Lixian WANG. All Rights Reserved.
 # Standard library imports
+import collections
+import functools
+import io
 import os
 import re
+import warnings
 
 # Third party imports
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from scipy.optimize import curve_fit
 # Local application import
 from .physconst import *
+from .profiling import count_iteration, staged
 # General use
 
-__all__ = ['getnumber','dir2fnm','read_file','pos_neg','is_close',
-           'df_range','range_pick','H1st_ft','H2nd_ft','twocarrierfit',
-           'cutout_bkgd','interp_user','FFT_bs','diffz_df','fc_interp',
-           'quickplot','extents','plot_fftmap','plot_fc_analysis']
+__all__ = ['getnumber','scan_folder','dir2fnm','read_file','read_folder','read_dat','pos_neg','is_close',
+           'df_range','range_pick','H1st_ft','fastH1st_ft','H2nd_ft','twocarrierfit',
+           'cutout_bkgd','interp_user','FFT_bs','diffz_df','fastdiffz_df','fc_interp','fastfc_interp',
+           'uniform_grid','resample_sweeps','map_diff',
+           'm4_decimate','plot_decimated','quickplot','extents','plot_fftmap','plot_fc_analysis']
 
 
-def getnumber(fnm):
-    fnm_strip = fnm.strip('.dat').split('/')[-1] if '/' in fnm else fnm.strip('.dat').split('\\')[-1]
-    # num_str = fnm_strip.replace('T', '').replace(',', '.').replace('DCV', '').replace('B-Field', '').replace('V', '').replace('m','-').replace('p','.').replace('(01)','')
-    num_str = re.sub(r"DCV|set|B-Field|Heater|Ch4|Ch2A|power|%|Vappl1|Vappl2|V|mT|LakeShore|lowfield|T|\(\d\d\)", "", fnm_strip.split('_')[-1])
-    num_str = re.sub(r"(,)|(p)", ".", num_str)
-    num_str = re.sub(r"(m)", "-", num_str)
-    num = float(num_str)
-    return num
+# step value in the filenames, e.g. 'sweep_m0p50V.dat' -> -0.5: remove units/labels, ',' or 'p' is the decimal point
+# and 'm' the minus sign. Pass your own compiled pattern to getnumber/dir2fnm/read_file for other naming schemes.
+STEP_PATTERN = re.compile(r"DCV|set|B-Field|Heater|Ch4|Ch2A|power|%|Vappl1|Vappl2|V|mT|LakeShore|lowfield|T|\(\d\d\)")
+_DECIMAL_PATTERN = re.compile(r"[,p]")
+_MINUS_PATTERN = re.compile(r"m")
 
 
-def dir2fnm(directory, sort_by_fnm=False):
-    # TODO: add a custmizable feature in string pattern recognization
+@functools.lru_cache(maxsize=65536)
+def _parse_step(token, pattern):
+    num_str = pattern.sub("", token)
+    num_str = _DECIMAL_PATTERN.sub(".", num_str)
+    num_str = _MINUS_PATTERN.sub("-", num_str)
+    return float(num_str)
+
+
+def getnumber(fnm, pattern=None):
+    '''
+    Extract the step value from a filename (the last '_'-separated part of the name without .dat)
+    :param fnm: filename or path
+    :param pattern: compiled regular expression of everything to remove around the number (default STEP_PATTERN)
+    :return: step value
+    '''
+    name = fnm.split('/')[-1] if '/' in fnm else fnm.split('\\')[-1]
+    if name.endswith('.dat'):
+        name = name[:-len('.dat')]
+    return _parse_step(name.split('_')[-1], STEP_PATTERN if pattern is None else re.compile(pattern))
+
+
+FileEntry = collections.namedtuple('FileEntry', ['path', 'name', 'mtime', 'size', 'step'])
+_folder_index = {}
+
+
+def scan_folder(directory, pattern=None, ext='.dat', rescan=False):
+    '''
+    Index the files of a folder with a single os.scandir pass (mtime and size from the directory entries, no extra
+    system call per file on Windows). The index is cached per folder and reused as long as the modification time of
+    the folder does not change (files added, removed or renamed).
+    :param directory: directory
+    :param pattern: see getnumber
+    :param ext: file extension
+    :param rescan: scan again, for the current mtime and size of files rewritten or appended in place (these do not
+                   change the modification time of the folder)
+    :return: a list of FileEntry(path, name, mtime, size, step) in the order of os.scandir,
+             step is None if it can not be read from the filename
+    '''
+    pattern = STEP_PATTERN if pattern is None else re.compile(pattern)
+    key = (os.path.abspath(directory), pattern, ext)
+    folder_mtime = os.stat(directory).st_mtime
+    cached = _folder_index.get(key)
+    if cached is not None and cached[0] == folder_mtime and not rescan:
+        return cached[1]
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith('.') or not os.path.normcase(entry.name).endswith(ext) or not entry.is_file():
+                continue
+            try:
+                step = getnumber(entry.name, pattern)
+            except ValueError:
+                step = None
+            stat = entry.stat()
+            entries.append(FileEntry(os.path.join(directory, entry.name), entry.name, stat.st_mtime, stat.st_size,
+                                     step))
+    _folder_index[key] = (folder_mtime, entries)
+    return entries
+
+
+def _sorted_entries(directory, sort_by_fnm, pattern):
+    entries = scan_folder(directory, pattern)
+    if sort_by_fnm:
+        unreadable = [entry.name for entry in entries if entry.step is None]
+        if unreadable:
+            raise ValueError('Error: no step value found in filenames {}'.format(unreadable))
+        return sorted(entries, key=lambda entry: entry.step)
+    return sorted(entries, key=lambda entry: entry.mtime)
+
+
+def dir2fnm(directory, sort_by_fnm=False, pattern=None):
     '''
     Convert a directory to a list of filenames contained inside
     :param directory: directory
-    :return: a list of filenames sorted by the creation time in ascend order
+    :param sort_by_fnm: sort by the step values in the filenames instead of the modification time
+    :param pattern: see getnumber
+    :return: a list of filenames sorted by the modification time in ascend order
     '''
-    import glob
-    import os
-    filename = list(filter(os.path.isfile, glob.glob(os.path.join(directory, '*.dat'))))
+    return [entry.path for entry in _sorted_entries(directory, sort_by_fnm, pattern)]
 
-    if sort_by_fnm:
-        filename.sort(key=lambda x: getnumber(x))
-    else:
-        filename.sort(key=lambda x: os.path.getmtime(x))
-    return filename
+
+def read_file(directory, sort_by_fnm=False, pattern=None):
+    '''
+    Extract the numbers in the filenames of a batch of files and output them in a list (same order as dir2fnm)
+    '''
+    return read_folder(directory, sort_by_fnm, pattern)[1]
+
+
+def read_folder(directory, sort_by_fnm=False, pattern=None):
+    '''
+    dir2fnm and read_file from one look-up of the folder index
+    :return: a list of filenames, a list of their step values (same order)
+    '''
+    entries = _sorted_entries(directory, sort_by_fnm, pattern)
+    unreadable = [entry.name for entry in entries if entry.step is None]
+    if unreadable:
+        raise ValueError('Error: no step value found in filenames {}'.format(unreadable))
+    return [entry.path for entry in entries], [entry.step for entry in entries]
 
 
-def read_file(directory, sort_by_fnm=False):
+def read_dat(file, spr, ucols, nms, dtype=None):
     '''
-    Extract the numbers in the filenames of a batch of files and output them in a list
+    Read columns of a measurement file (numbers separated by tabs after a header of spr lines) into a DataFrame.
+    The numbers are parsed by numpy.loadtxt straight into an array of the ucols columns, 2.5-3 times faster than
+    pandas.read_csv. Files with anything else than numbers (missing values, text, decimal commas, ...) are read by
+    pandas.read_csv as before.
+    :param file: path of the file, or its content (bytes)
+    :param spr: number of header lines to skip
+    :param ucols: columns to read
+    :param nms: names of the columns, in the order of the columns in the file (like pandas)
+    :param dtype: type of the data, float64 if None
+    :return: DataFrame
     '''
-    filenames = dir2fnm(directory, sort_by_fnm=sort_by_fnm)
-    num_list = [0] * len(filenames)
-    for i, fnm in enumerate(filenames):
-        num_list[i] = float(getnumber(fnm))
-    return num_list
+    source = io.BytesIO(file) if isinstance(file, bytes) else file
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')  # loadtxt only warns if there is no data after the header
+            values = np.loadtxt(source, dtype=dtype or np.float64, delimiter='\t', comments=None, skiprows=spr,
+                                usecols=sorted(ucols), ndmin=2, encoding='latin1')
+    except (ValueError, UserWarning):
+        source = io.BytesIO(file) if isinstance(file, bytes) else file
+        return pd.read_csv(source, sep="\t", skiprows=spr, usecols=ucols, names=nms, header=None,
+                           encoding='unicode_escape', dtype=dtype)
+    return pd.DataFrame(values, columns=nms, copy=False)
 
 
 def pos_neg(num):
@@ -83,7 +181,14 @@ def range_pick(yourlist, lb, ub):
 
 # Calculation
 
-def H1st_ft(Bf,Rxx,Rxy,AspRatio=3,threshold = 25, fitpara_output=False):
+def _float64(data):
+    '''fits always run in float64, whatever the storage type of the data (see the dtype of Datajungle)'''
+    if isinstance(data, (pd.Series, pd.DataFrame)):
+        return data.astype(np.float64)
+    return np.asarray(data, dtype=np.float64)
+
+@staged('H1st_ft', points=lambda Bf, *args, **kwargs: len(Bf))
+def H1st_ft(Bf,Rxx,Rxy,AspRatio=3,threshold = 25, fitpara_output=False, call=True):
 
     '''
     Linear fit model for Hall analysis
@@ -93,9 +198,14 @@ def H1st_ft(Bf,Rxx,Rxy,AspRatio=3,threshold = 25, fitpara_output=False):
     :param Rxy:
     :param AspRatio:
     :param threshold:
+    :param call: plot the rejected fit for inspection (set to False in headless runs)
     :return:
     '''
+    from scipy.optimize import curve_fit
+    Bf, Rxx, Rxy = _float64(Bf), _float64(Rxx), _float64(Rxy)
+
     def func_one(x, a, b):
+        count_iteration()
         return a + b * x
     e0 = 1.6021766208E-19
     try:
@@ -112,7 +222,58 @@ def H1st_ft(Bf,Rxx,Rxy,AspRatio=3,threshold = 25, fitpara_output=False):
             mobility = AspRatio / density / e0 / rxx0
         else:
             print('The fitting results is not acceptable, fitCov is {}'.format(fitCovariances))
-            plt.plot(Bf, Rxy, "b-", Bf, func_one(Bf, *fitParams), "r-")
+            if call:
+                import matplotlib.pyplot as plt
+                plt.plot(Bf, Rxy, "b-", Bf, func_one(Bf, *fitParams), "r-")
+            mobility = 0
+            density = 0
+    if fitpara_output:
+        return density,mobility,fitParams
+    else:
+        return density,mobility
+
+
+@staged('fastH1st_ft', points=lambda Bf, *args, **kwargs: len(Bf))
+def fastH1st_ft(Bf,Rxx,Rxy,AspRatio=3,threshold = 25, fitpara_output=False, call=True):
+    '''
+    Same as H1st_ft, but the straight line is fitted in closed form (ordinary least squares) instead of by
+    curve_fit. The parameter errors are computed the same way (residual variance times inv(X^T X)).
+
+    :param Bf:
+    :param Rxx:
+    :param Rxy:
+    :param AspRatio:
+    :param threshold:
+    :param call: plot the rejected fit for inspection (set to False in headless runs)
+    :return:
+    '''
+    e0 = 1.6021766208E-19
+    Bf = np.asarray(Bf, dtype=float)
+    Rxy = np.asarray(Rxy, dtype=float)
+    fitParams = None
+    if len(Bf) < 3 or np.ptp(Bf) == 0:
+        print('The fitting program failed')
+        mobility = 0
+        density = 0
+    else:
+        # centred regression: intercept and slope of Rxy = a + b * Bf
+        B_mean = Bf.mean()
+        dB = Bf - B_mean
+        Sxx = np.dot(dB, dB)
+        slope = np.dot(dB, Rxy - Rxy.mean()) / Sxx
+        fitParams = np.array([Rxy.mean() - slope * B_mean, slope])
+        residual = Rxy - fitParams[0] - slope * Bf
+        variance = np.dot(residual, residual) / (len(Bf) - 2)
+        dev = np.sqrt(variance * np.array([1 / len(Bf) + B_mean ** 2 / Sxx, 1 / Sxx]))
+        if sum(dev) <= threshold:
+            density = 1 / fitParams[1] / e0 / 1e4
+            rxx0 = np.asarray(Rxx, dtype=float)[np.argmin(np.abs(Bf))]
+            mobility = AspRatio / density / e0 / rxx0
+        else:
+            print('The fitting results is not acceptable, fitCov is {}'.format(dev ** 2))
+            if call:
+                import matplotlib.pyplot as plt
+                plt.plot(Bf, Rxy, "b-", Bf, fitParams[0] + fitParams[1] * Bf, "r-")
             mobility = 0
             density = 0
     if fitpara_output:
@@ -131,7 +292,9 @@ def H2nd_ft(Bf, Rxx, Rxy, AspRatio=3):
     :param AspRatio:
     :return:
     '''
+    from scipy.optimize import curve_fit
     e0 = 1.6021766208E-19
+    Bf, Rxx, Rxy = _float64(Bf), _float64(Rxx), _float64(Rxy)
 
     def func_two(x, n1, m1, n2, m2):
         return e0 * x * (n1 * m1 ** 2 / (1 + m1 ** 2 * x ** 2) + n2 * m2 ** 2 / (
@@ -145,6 +308,7 @@ def H2nd_ft(Bf, Rxx, Rxy, AspRatio=3):
     except:
         print('The fitting program failed')
 
+@staged('twocarrierfit', points=lambda Bf, *args, **kwargs: len(Bf))
 def twocarrierfit(Bf, Rxy):
     '''
     Two carrier (electron-hole) model for Hall analysis
@@ -152,9 +316,12 @@ def twocarrierfit(Bf, Rxy):
     :param Rxy:
     :return:
     '''
+    from scipy.optimize import curve_fit
     e0 = 1.6021766208E-19
+    Bf, Rxy = _float64(Bf), _float64(Rxy)
 
     def func(x, n1, m1, n2, m2):
+        count_iteration()
         return  -((n2*m2**2-n1*m1**2)+m2**2*m1**2*x**2*(n2-n1))*x/e0/((n2*m2+n1*m1)**2+m2**2*m1**2*x**2*(n2-n1)**2)  # Reference: Li, Cai-Zhen, et al. ACS nano 10.6 (2016): 6020-6028.
 
     try:
@@ -176,6 +343,7 @@ def cutout_bkgd(x, y):
     :return: the y values after removing the background
     '''
     from scipy.optimize import curve_fit
+    x, y = _float64(x), _float64(y)
 
     def func(x, a, b, c, d, e, f, g):
         return a + b * x + c * x ** 2 + d * x ** 3 + e * x ** 4 + f * x ** 5 + g * x ** 6
@@ -232,6 +400,7 @@ def FFT_bs(x, y):
     return frq, Y
 
 
+@staged('diffz_df', points=lambda dataframe, *args, **kwargs: len(dataframe))
 def diffz_df(dataframe, axes, z_vec, check_output=False):
     '''
     Perform a one-dimensional diff operation on a 2d data.
@@ -272,6 +441,42 @@ def diffz_df(dataframe, axes, z_vec, check_output=False):
     return ax_rest, ax_diff, z_array, z_df
 
 
+@staged('fastdiffz_df', points=lambda dataframe, *args, **kwargs: len(dataframe))
+def fastdiffz_df(dataframe, axes, z_vec, check_output=False):
+    '''
+    Same as diffz_df for data on a complete grid (every value of axes[0] measured at every value of axes[1]),
+    with the diff done on the reshaped array instead of point by point.
+
+    :param dataframe: original 2d data
+    :param axes: [key for another axis in plots,key for the diff axis]
+    :param z_vec: key for z axis
+    :param check_output: print the
+
+    :return:
+    :a_rest(list): vector in rest axis
+    :a_diff(list): vector in diff axis
+    :z_array: yielded z array in shape of (len(a_rest),len(a_diff)-1)
+    :z_df: same content with z_array but in DataFrame format (useful in recursive calls)
+    '''
+    rest_dim = axes[0]
+    diff_dim = axes[1]
+    ax_rest = sorted(dataframe[rest_dim].unique())  # get the x-vector
+    ax_diff = sorted(dataframe[diff_dim].unique())  # get the y-vector
+    if len(dataframe) != len(ax_rest) * len(ax_diff):
+        raise ValueError('Error: the data is not on a complete {} x {} grid, use diffz_df'.format(rest_dim, diff_dim))
+
+    z_sorted = dataframe.sort_values(by=axes)[z_vec].to_numpy()
+    z_array = np.diff(z_sorted.reshape(len(ax_rest), len(ax_diff)), axis=1)
+    z_df = pd.DataFrame({rest_dim: np.repeat(ax_rest, len(ax_diff) - 1),
+                         diff_dim: np.tile(ax_diff[1:], len(ax_rest)),
+                         z_vec: z_array.ravel()})
+    if check_output:
+        print('The output array is in shape {}\nwith ax_rest of length of {} and ax_diff of length of {}'.format(
+            z_array.shape, len(ax_rest), len(ax_diff)))
+    return ax_rest, ax_diff, z_array, z_df
+
+
+@staged('fc_interp', points=lambda x_vec, y_vec, z_df, *args, **kwargs: len(z_df))
 def fc_interp(x_vec, y_vec, z_df, diff=True, mult_factor=3):
     '''
     Interpolate 2d data z_df
@@ -308,9 +513,234 @@ def fc_interp(x_vec, y_vec, z_df, diff=True, mult_factor=3):
     return grid_z
 
 
+@staged('fastfc_interp', points=lambda x_vec, y_vec, z_df, *args, **kwargs: len(z_df))
+def fastfc_interp(x_vec, y_vec, z_df, diff=True, mult_factor=3):
+    '''
+    Same as fc_interp, with the points of the input grid built by broadcasting instead of a double loop
+
+    :param x_vec: vector in x axis
+    :param y_vec: vector in y axis
+    :param z_df: DataFrame data to be interpolated
+    :param diff: True=interpolate 1st differential data (size-1), False = interpolate normal size data
+    :param mult_factor: determine how dense the interpolation could be performed. [size of output] = mult_factor*[size of input] (default=3)
+
+    :return:
+    :grid_z: yielded z array in shape of (len(x_vec)*mult_factor,len(y_vec)*mult_factor)
+
+    '''
+
+    from scipy.interpolate import griddata
+    values = z_df.values
+    points = np.zeros((len(values), 2))
+    x_vec = np.asarray(x_vec, dtype=float)
+    y_vec = np.asarray(y_vec, dtype=float)
+    if diff:
+        # like fc_interp: the first point of every row stays at (0, 0), the others get y_vec[:-2]
+        rows = (np.arange(len(x_vec))[:, None] * (len(y_vec) - 1) + np.arange(1, len(y_vec) - 1)).ravel()
+        points[rows, 0] = np.repeat(x_vec, len(y_vec) - 2)
+        points[rows, 1] = np.tile(y_vec[:-2], len(x_vec))
+    else:
+        points[:len(x_vec) * len(y_vec), 0] = np.repeat(x_vec, len(y_vec))
+        points[:len(x_vec) * len(y_vec), 1] = np.tile(y_vec, len(x_vec))
+    # grids for interpolation
+    grid_x, grid_y = np.mgrid[x_vec[0]:x_vec[-1]:complex(0, len(x_vec) * mult_factor),
+                     y_vec[0]:y_vec[-1]:complex(0, len(y_vec) * mult_factor)]
+    # interpolation
+    grid_z = griddata(points, values, (grid_x, grid_y), method='nearest')
+    return grid_z
+
+
+def uniform_grid(xs, n_points=None):
+    '''
+    Equally spaced grid covering all sweeps
+    :param xs: list of the swept values of every sweep
+    :param n_points: number of grid points, the length of the longest sweep by default
+    :return: 1d array
+    '''
+    lo = min(np.min(x) for x in xs)
+    hi = max(np.max(x) for x in xs)
+    return np.linspace(lo, hi, n_points or max(len(x) for x in xs))
+
+
+@staged('resample_sweeps', points=lambda xs, *args, **kwargs: sum(len(x) for x in xs))
+def resample_sweeps(xs, ys, grid, method='interp'):
+    '''
+    Put sweeps of different lengths and setpoints on one grid, all sweeps at once (no loop over the sweeps)
+
+    :param xs: list of the swept values of every sweep (any order, up or down)
+    :param ys: list of the measured values of every sweep, arrays of shape (len(x),) or (len(x), n_quantities)
+    :param grid: ascending grid of swept values
+    :param method: 'interp' linear interpolation between the measured points,
+                   'bin' mean of the measured points closest to each grid point
+    :return: array of shape (len(xs), len(grid)) or (len(xs), len(grid), n_quantities),
+             NaN outside the range of a sweep ('interp') or without measured points ('bin')
+    '''
+    grid = np.asarray(grid, dtype=float)
+    lengths = np.array([len(x) for x in xs])
+    if (lengths == 0).any():
+        raise ValueError('Error: empty sweep')
+    x_all = np.concatenate([np.asarray(x, dtype=float) for x in xs])
+    y_all = np.concatenate([np.asarray(y, dtype=float) for y in ys])
+    vector = y_all.ndim == 1
+    y_all = y_all.reshape(len(x_all), -1)
+    trace = np.repeat(np.arange(len(xs)), lengths)
+    n_grid = len(grid)
+
+    if method == 'interp':
+        # one global np.interp: the sweeps are scaled into [0, 1] and shifted apart by 2 per sweep
+        lo = min(x_all.min(), grid[0])
+        span = (max(x_all.max(), grid[-1]) - lo) or 1.
+        key = (x_all - lo) / span + 2 * trace
+        order = np.argsort(key, kind='stable')
+        query = ((grid - lo) / span + 2 * np.arange(len(xs))[:, None]).ravel()
+        out = np.column_stack([np.interp(query, key[order], column[order]) for column in y_all.T])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        x_min = np.minimum.reduceat(x_all, starts)
+        x_max = np.maximum.reduceat(x_all, starts)
+        outside = (grid < x_min[:, None]) | (grid > x_max[:, None])
+        out[outside.ravel()] = np.nan
+    elif method == 'bin':
+        # nearest grid point of every measured point, then the mean per (sweep, grid point)
+        nearest = np.searchsorted((grid[1:] + grid[:-1]) / 2, x_all)
+        flat = trace * n_grid + nearest
+        counts = np.bincount(flat, minlength=len(xs) * n_grid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = np.column_stack([np.bincount(flat, weights=column, minlength=len(xs) * n_grid) / counts
+                                   for column in y_all.T])
+    else:
+        raise ValueError('Error: unknown method {}, choose from interp, bin'.format(method))
+    out = out.reshape(len(xs), n_grid, -1)
+    return out[..., 0] if vector else out
+
+
+def _fill_nan(z, axis):
+    # linear interpolation over NaN along axis between the neighbouring valid values (constant at the ends), no loop
+    z = np.moveaxis(z, axis, -1)
+    valid = ~np.isnan(z)
+    position = np.arange(z.shape[-1])
+    previous = np.maximum.accumulate(np.where(valid, position, -1), axis=-1)
+    following = np.flip(np.minimum.accumulate(np.flip(np.where(valid, position, z.shape[-1]), -1), axis=-1), -1)
+    previous = np.where(previous < 0, following, previous)
+    following = np.where(following >= z.shape[-1], previous, following)
+    z_previous = np.take_along_axis(z, np.clip(previous, 0, z.shape[-1] - 1), axis=-1)
+    z_following = np.take_along_axis(z, np.clip(following, 0, z.shape[-1] - 1), axis=-1)
+    weight = np.where(following > previous, (position - previous) / np.maximum(following - previous, 1), 0)
+    return np.moveaxis(np.where(valid, z, z_previous + weight * (z_following - z_previous)), -1, axis)
+
+
+@staged('map_diff', points=lambda z, *args, **kwargs: np.size(z))
+def map_diff(z, x, axis=0, method='gradient', window=7, order=2, sigma=2.):
+    '''
+    Derivative dz/dx of a 2d map along one axis, all rows/columns at once
+
+    :param z: 2d array (or DataFrame)
+    :param x: values of the axis, equally spaced or not (the smoothing methods work on the index and divide by
+              dx/dindex, fine for smoothly varying spacing)
+    :param axis: axis of z along x
+    :param method: 'gradient': second order finite differences (numpy.gradient) on the actual spacing,
+                   'savgol': Savitzky-Golay derivative over window points with a polynomial of the given order,
+                   'gaussian': derivative of a Gaussian with a width of sigma points, convolved by FFT
+    :param window: odd number of points of the Savitzky-Golay window
+    :param order: polynomial order of the Savitzky-Golay filter
+    :param sigma: width (in points) of the Gaussian
+    :return: array of the shape of z, NaN where z is NaN
+    '''
+    z = np.asarray(z, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if z.shape[axis] != len(x):
+        raise ValueError('Error: {} values of x for {} points along axis {}'.format(len(x), z.shape[axis], axis))
+    if method == 'gradient':
+        return np.gradient(z, x, axis=axis)
+    shape = [1] * z.ndim
+    shape[axis] = len(x)
+    dx_dindex = np.gradient(x).reshape(shape)
+    if method == 'savgol':
+        from scipy.signal import savgol_filter
+        return savgol_filter(z, window, order, deriv=1, axis=axis) / dx_dindex
+    if method == 'gaussian':
+        # odd reflection at both ends keeps the slope continuous, the padding absorbs the periodic wrap of the FFT
+        nan = np.isnan(z)
+        pad = [(0, 0)] * z.ndim
+        pad[axis] = (int(4 * sigma) + 1,) * 2
+        padded = np.pad(_fill_nan(z, axis) if nan.any() else z, pad, mode='reflect', reflect_type='odd')
+        n = padded.shape[axis]
+        k = 2 * np.pi * np.fft.rfftfreq(n)
+        kernel = (1j * k * np.exp(-0.5 * (k * sigma) ** 2)).reshape(shape[:axis] + [len(k)] + shape[axis + 1:])
+        dz = np.fft.irfft(np.fft.rfft(padded, axis=axis) * kernel, n=n, axis=axis)
+        dz = np.take(dz, np.arange(pad[axis][0], pad[axis][0] + len(x)), axis=axis) / dx_dindex
+        dz[nan] = np.nan
+        return dz
+    raise ValueError('Error: unknown method {}, choose from gradient, savgol, gaussian'.format(method))
+
+
 # Plotting
 
-def quickplot(path, num_plot, PhyQty, ref, skiprows, nms, ucols, AspRatio=3):
+def m4_decimate(x, y, n_bins, x_range=None):
+    '''
+    Min/max envelope (M4) decimation of a trace: keep the first, last, lowest and highest point of each of n_bins
+    equally wide intervals in x. Drawn n_bins pixels wide, the decimated trace looks the same as the full one.
+    :param x: x values (monotonic sweeps give an exact envelope)
+    :param y: y values
+    :param n_bins: number of intervals, i.e. pixels across the x-range
+    :param x_range: [xmin, xmax] split into the intervals, e.g. the view limits (default: range of x)
+    :return: decimated x, y (at most 4*n_bins points, in the original order)
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    xmin, xmax = (x.min(), x.max()) if x_range is None or len(x) == 0 else x_range
+    if len(x) <= 4 * n_bins or xmax == xmin:
+        return x, y
+    # points outside x_range go to extra bins at both ends
+    bins = np.clip(np.floor((x - xmin) / (xmax - xmin) * n_bins), -1, n_bins).astype(int)
+    by_bin = np.argsort(bins, kind='stable')  # original order within a bin
+    by_bin_y = np.lexsort((y, bins))  # ascending y within a bin
+    bins_sorted = bins[by_bin]
+    start = np.flatnonzero(np.r_[True, bins_sorted[1:] != bins_sorted[:-1]])
+    end = np.r_[start[1:], len(bins_sorted)] - 1
+    keep = np.unique(np.concatenate([by_bin[start], by_bin[end], by_bin_y[start], by_bin_y[end]]))
+    return x[keep], y[keep]
+
+
+def _pixel_width(ax):
+    '''
+    Width of an axes in pixels at the larger of the screen and the savefig resolution
+    '''
+    import matplotlib
+    fig = ax.get_figure()
+    dpi = matplotlib.rcParams['savefig.dpi']
+    dpi = fig.dpi if dpi == 'figure' else max(fig.dpi, dpi)
+    return max(int(ax.get_position().width * fig.get_figwidth() * dpi), 1)
+
+
+def plot_decimated(ax, x, y, *args, **kwargs):
+    '''
+    ax.plot for long traces: plot the M4 decimation (m4_decimate) at the pixel width of the axes and decimate
+    again from the full trace whenever the x-range changes (zoom/pan)
+    :param ax: axes handle
+    :param x: x values
+    :param y: y values
+    :param args, kwargs: passed to ax.plot
+    :return: the Line2D handle
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    line, = ax.plot(*m4_decimate(x, y, _pixel_width(ax)), *args, **kwargs)
+
+    def redecimate(ax):
+        xmin, xmax = sorted(ax.get_xlim())
+        # one more point on each side, so that the line runs to the edges of the view
+        inside = np.flatnonzero((x >= xmin) & (x <= xmax))
+        if len(inside):
+            visible = slice(max(inside[0] - 1, 0), inside[-1] + 2)
+            line.set_data(*m4_decimate(x[visible], y[visible], _pixel_width(ax), [xmin, xmax]))
+
+    ax.callbacks.connect('xlim_changed', redecimate)
+    return line
+
+
+def quickplot(path, num_plot, PhyQty, ref, skiprows, nms, ucols, AspRatio=3, decimate=True):
     '''
     Quick plot for multiple files containing the same type of data
     Arguments:
@@ -321,10 +751,12 @@ def quickplot(path, num_plot, PhyQty, ref, skiprows, nms, ucols, AspRatio=3):
     nms: Names for all used columns
     ucols: Used columns
     AspRatio: The aspect ratio of the Hall bar. Default is 3
+    decimate: plot the min/max envelope of each trace at screen resolution (see plot_decimated)
 
     Return:
     the handle of axes to facilitate further adjustment if necessary
     '''
+    import matplotlib.pyplot as plt
 
     fig = plt.figure(figsize=(10, 5 * len(PhyQty)))
     fnm = dir2fnm(path)
@@ -336,9 +768,10 @@ def quickplot(path, num_plot, PhyQty, ref, skiprows, nms, ucols, AspRatio=3):
     else:
         plots_ax = fig.add_subplot(111)
 
+    plot = plot_decimated if decimate else lambda ax, *args, **kwargs: ax.plot(*args, **kwargs)
     for file in fnm:
         color = next(colors)
-        data = pd.read_csv(file, sep="\t", skiprows=skiprows, usecols=ucols, names=nms, header=None)
+        data = read_dat(file, skiprows, ucols, nms)
         data['rxx'] = data.uxx / data.curr * ref
         data['rxy'] = data.uxy / data.curr * ref
         data['sxx'] = data['rxx'] / AspRatio / ((data['rxx'] / AspRatio) ** 2 + data['rxy'] ** 2) / e0 ** 2 * h0
@@ -346,9 +779,9 @@ def quickplot(path, num_plot, PhyQty, ref, skiprows, nms, ucols, AspRatio=3):
         if len(PhyQty) > 1:
             for index, phyqty in enumerate(PhyQty):
                 plot_ax = plots_ax[index]
-                plot_ax.plot(data.x, data[phyqty], color=color)
+                plot(plot_ax, data.x, data[phyqty], color=color)
         else:
-            plots_ax.plot(data.x, data[PhyQty[0]], color=color)
+            plot(plots_ax, data.x, data[PhyQty[0]], color=color)
     return plots_ax
 
 
@@ -365,7 +798,60 @@ def extents(f):
 
 ## interactive plotting
 
-def plot_fc_analysis(datafc, label, vmin=-0.005, vmax=0, equal_spaced=True, bgortg=True, axis_diff='gate', zoom_in=[]):
+def _blocks(keys, values):
+    '''
+    Sort the rows of values once by keys, so that the rows of every key form a contiguous block
+    :param keys: 1d array
+    :param values: 2d array, one row per key
+    :return: unique keys, list of blocks (views into the sorted array, the original order is kept within a block)
+    '''
+    order = np.argsort(keys, kind='stable')
+    keys_sorted = np.asarray(keys)[order]
+    values_sorted = np.asarray(values)[order]
+    uniq, start = np.unique(keys_sorted, return_index=True)
+    end = np.append(start[1:], len(keys_sorted))
+    return uniq, [values_sorted[s:e] for s, e in zip(start, end)]
+
+
+def _full_grid(data, rows, columns, value):
+    '''
+    Long-form data on a complete grid as a 2d array
+    :return: sorted values of rows, sorted values of columns, array of shape (len(rows), len(columns))
+    '''
+    row_values = np.unique(data[rows].to_numpy())
+    column_values = np.unique(data[columns].to_numpy())
+    if len(data) != len(row_values) * len(column_values):
+        raise ValueError('Error: the data is not on a complete {} x {} grid'.format(rows, columns))
+    grid = data.sort_values(by=[rows, columns])[value].to_numpy().reshape(len(row_values), len(column_values))
+    return row_values, column_values, grid
+
+
+def _nearest(keys, value):
+    return int(np.abs(np.asarray(keys) - value).argmin())
+
+
+def _refresh(fig):
+    '''
+    Show the updated artists: redraw in place with an interactive backend (%matplotlib widget/notebook),
+    display the figure again with the inline backend
+    '''
+    import matplotlib
+    if 'inline' in matplotlib.get_backend():
+        from IPython.display import display
+        display(fig)
+    else:
+        fig.canvas.draw_idle()
+
+
+def plot_fc_analysis(datafc, label, vmin=-0.005, vmax=0, equal_spaced=True, bgortg=True, axis_diff='gate', zoom_in=[],
+                     derivative=None, **options):
+    '''
+    Interactive fan chart: the differential map with a cut at constant field (top) and at constant gate (right).
+    The figure and all the cuts the sliders can reach are prepared once, the sliders only move the cuts.
+    derivative: None uses the first differences of the data, 'gradient', 'savgol' or 'gaussian' differentiates the
+    sxy(gate, bf) map along axis_diff with map_diff (options: window, order, sigma), the data have to be a full grid
+    '''
+    import matplotlib.pyplot as plt
     from ipywidgets import interactive, FloatSlider, Dropdown
     fc, data = datafc.getdata()
     diffsxy2D = fc['z1']
@@ -377,94 +863,103 @@ def plot_fc_analysis(datafc, label, vmin=-0.005, vmax=0, equal_spaced=True, bgor
     gate_step = abs(np.mean(np.diff(gates)))
     x_bybf, y_bybf, diffsxy2d_bybf, diffsxy_bybf = diffz_df(data, ['gate', 'bf'], 'sxy')
 
-    def plot_animation(uplim, gate):
-
-        fig = plt.figure(figsize=(15, 12))
-        ax1 = plt.subplot2grid((5, 5), (2, 0), colspan=4, rowspan=3)
-
-        if equal_spaced:
-            if axis_diff == 'gate':
-                ax1.imshow(diffsxy2D, aspect='auto', interpolation='none',
-                           extent=extents(x.tolist()) + extents(y.tolist()), origin='lower', cmap='inferno', vmin=vmin,
-                           vmax=vmax)
-            else:
-                ax1.imshow(diffsxy2d_bybf.T, aspect='auto', interpolation='none',
-                           extent=extents(x_bybf) + extents(y_bybf), origin='lower', cmap='inferno', vmin=vmin,
-                           vmax=vmax)
-        elif axis_diff == 'gate':
-            interp_diffsxy = fc_interp(y, x, data.diffsxy.dropna())
-            ax1.imshow(interp_diffsxy, aspect='auto', interpolation='none', extent=extents(x) + extents(y),
-                       origin='lower', cmap='inferno', vmin=vmin, vmax=vmax)
-        else:
-            interp_diffsxy = fc_interp(x_bybf, y_bybf, diffsxy_bybf.sxy)
-            ax1.imshow(interp_diffsxy.T, aspect='auto', interpolation='none', extent=extents(x_bybf) + extents(y_bybf),
-                       origin='lower', cmap='inferno', vmin=vmin, vmax=vmax)
-
-        if bgortg:
-            ax1.set_xlabel('$U_{tg}(V)$')
-        else:
-            ax1.set_xlabel('$U_{bg}(V)$')
-
-        ax1.set_ylabel('B(T)')
-        if not zoom_in:
-            ax1.set_ylim([min(bf), max(bf)])
-            ax1.set_xlim([min(gates), max(gates)])
-        else:
-            ax1.set_xlim([zoom_in[0], zoom_in[1]])
-            ax1.set_ylim([zoom_in[2], zoom_in[3]])
-        ax1.axhline(y=uplim, linestyle='--', color='b', linewidth=2)
-        ax1.axvline(x=gate, linestyle='--', color='g', linewidth=2)
-        ax2 = plt.subplot2grid((5, 5), (0, 0), colspan=4, rowspan=2)
-        ax3 = ax2.twinx()
-
-        if equal_spaced:
-            if axis_diff == 'gate':
-                data_p = df_range(data, 'bf', [uplim - bf_step / 2, uplim + bf_step / 2])
-            else:
-                data_p = df_range(data, 'bf', [uplim - bf_step / 2, uplim + bf_step / 2])
-                data_pbybf = df_range(diffsxy_bybf, 'bf', [uplim - bf_step / 2, uplim + bf_step / 2])
-
-        elif axis_diff == 'gate':
-            data_p = df_range(data, 'bf', [uplim - 0.001, uplim + 0.001])
+    # map
+    if equal_spaced:
+        if axis_diff == 'gate':
+            image, extent = diffsxy2D, extents(x.tolist()) + extents(y.tolist())
         else:
-            data_p = df_range(data, 'bf', [uplim - 0.001, uplim + 0.001])
-            data_pbybf = df_range(diffsxy_bybf, 'bf', [uplim - 0.001, uplim + 0.001])
-
-        ax2.plot(data_p.gate, data_p.sxy / e0 ** 2 * h0, 'k-', linewidth=3, label=r'$\sigma_{xy}(e^2/h)$')
+            image, extent = diffsxy2d_bybf.T, extents(x_bybf) + extents(y_bybf)
+    elif axis_diff == 'gate':
+        image, extent = fc_interp(y, x, data.diffsxy.dropna()), extents(x) + extents(y)
+    else:
+        image, extent = fc_interp(x_bybf, y_bybf, diffsxy_bybf.sxy).T, extents(x_bybf) + extents(y_bybf)
 
+    if derivative is not None:
+        gate_grid, bf_grid, sxy_grid = _full_grid(data, 'gate', 'bf', 'sxy')
         if axis_diff == 'gate':
-            ax3.plot(data_p.gate[1:], -data_p.diffsxy[1:], 'r-', linewidth=2, label=r'$-d\sigma_{xy}/dU_{tg}$')
-            ax3.set_ylabel(r'$-d\sigma_{xy}/dU_{tg}$')
-        else:
-            ax3.plot(x_bybf[1:], -data_pbybf.sxy[1:], 'r-', linewidth=2, label=r'$-d\sigma_{xy}/dB$')
-            ax3.set_ylabel(r'$-d\sigma_{xy}/dB$')
-
-        ax2.set_xlim([min(gates), max(gates)])
-        ax2.set_ylim([-5, 15])
-        ax2.legend(bbox_to_anchor=(0, 0.8), loc='center left')
-        ax3.legend(bbox_to_anchor=(0.15, 0.8), loc='center left')
-        ax2.set_ylabel(r'$\sigma_{xy}/(e^2/h)$')
-
-        ax2.axhline(y=0, linestyle=':', color='c', linewidth=2)
-        [ax2.axhline(y=yi, linestyle=':', color='y', linewidth=2) for yi in range(1, 15)]
-        [ax2.axhline(y=-yi, linestyle=':', color='g', linewidth=2) for yi in range(1, 15)]
-        data_gp = df_range(data, 'gate', [gate - gate_step / 2, gate + gate_step / 2])
-        ax4 = plt.subplot2grid((5, 5), (2, 4), colspan=1, rowspan=3)
-        ax4.plot(data_gp.rxy, data_gp.bf, 'k-', linewidth=3, label='$r_{xy}$')
-        ax4.set_xlim([min(data_gp.rxy) - 500, max(data_gp.rxy) + 500])
-        ax4.set_ylim([min(bf), max(bf)])
-        ax4.set_xlabel(r'$R_{xy}(\Omega)$')
-        [ax4.axvline(x=h0 / e0 ** 2 / xi, linestyle=':', color='y', linewidth=2) for xi in range(1, 10)]
-        [ax4.axvline(x=-h0 / e0 ** 2 / xi, linestyle=':', color='g', linewidth=2) for xi in range(1, 10)]
-        props = dict(boxstyle='round', fc='b', alpha=0.5)
-
-        if bgortg:
-            textstr = ''.join((r'$U_{bg} = $', label))
+            dsxy = map_diff(sxy_grid, gate_grid, 0, derivative, **options)
         else:
-            textstr = ''.join((r'$U_{tg} = $', label))
+            dsxy = map_diff(sxy_grid, bf_grid, 1, derivative, **options)
+        image, extent = dsxy.T, extents(gate_grid) + extents(bf_grid)
+
+    # cuts at constant field: gate, sxy and the differential along the chosen axis
+    if derivative is not None:
+        field_keys, field_cuts = _blocks(data['bf'].round(4).values, data[['gate', 'sxy']].values)
+        diff_cuts = [(gate_grid, -dsxy[:, _nearest(bf_grid, key)]) for key in field_keys]
+    elif axis_diff == 'gate':
+        field_keys, field_cuts = _blocks(data['bf'].round(4).values, data[['gate', 'sxy', 'diffsxy']].values)
+        diff_cuts = [(cut[1:, 0], -cut[1:, 2]) for cut in field_cuts]
+    else:
+        field_keys, field_cuts = _blocks(data['bf'].round(4).values, data[['gate', 'sxy']].values)
+        diff_keys, diff_blocks = _blocks(diffsxy_bybf['bf'].round(4).values, diffsxy_bybf[['sxy']].values)
+        diff_cuts = [(np.asarray(x_bybf[1:]), -diff_blocks[_nearest(diff_keys, key)][1:, 0]) for key in field_keys]
+    # cuts at constant gate: rxy and bf
+    gate_keys, gate_cuts = _blocks(data['gate'].round(4).values, data[['rxy', 'bf']].values)
+
+    fig = plt.figure(figsize=(15, 12))
+    ax1 = plt.subplot2grid((5, 5), (2, 0), colspan=4, rowspan=3)
+    ax1.imshow(image, aspect='auto', interpolation='none', extent=extent, origin='lower', cmap='inferno', vmin=vmin,
+               vmax=vmax)
+    if bgortg:
+        ax1.set_xlabel('$U_{tg}(V)$')
+    else:
+        ax1.set_xlabel('$U_{bg}(V)$')
+    ax1.set_ylabel('B(T)')
+    if not zoom_in:
+        ax1.set_ylim([min(bf), max(bf)])
+        ax1.set_xlim([min(gates), max(gates)])
+    else:
+        ax1.set_xlim([zoom_in[0], zoom_in[1]])
+        ax1.set_ylim([zoom_in[2], zoom_in[3]])
+    field_line = ax1.axhline(y=min(bf), linestyle='--', color='b', linewidth=2)
+    gate_line = ax1.axvline(x=min(gates), linestyle='--', color='g', linewidth=2)
+
+    ax2 = plt.subplot2grid((5, 5), (0, 0), colspan=4, rowspan=2)
+    ax3 = ax2.twinx()
+    sxy_line, = ax2.plot([], [], 'k-', linewidth=3, label=r'$\sigma_{xy}(e^2/h)$')
+    if axis_diff == 'gate':
+        diff_line, = ax3.plot([], [], 'r-', linewidth=2, label=r'$-d\sigma_{xy}/dU_{tg}$')
+        ax3.set_ylabel(r'$-d\sigma_{xy}/dU_{tg}$')
+    else:
+        diff_line, = ax3.plot([], [], 'r-', linewidth=2, label=r'$-d\sigma_{xy}/dB$')
+        ax3.set_ylabel(r'$-d\sigma_{xy}/dB$')
+    ax2.set_xlim([min(gates), max(gates)])
+    ax2.set_ylim([-5, 15])
+    ax2.legend(bbox_to_anchor=(0, 0.8), loc='center left')
+    ax3.legend(bbox_to_anchor=(0.15, 0.8), loc='center left')
+    ax2.set_ylabel(r'$\sigma_{xy}/(e^2/h)$')
+    ax2.axhline(y=0, linestyle=':', color='c', linewidth=2)
+    [ax2.axhline(y=yi, linestyle=':', color='y', linewidth=2) for yi in range(1, 15)]
+    [ax2.axhline(y=-yi, linestyle=':', color='g', linewidth=2) for yi in range(1, 15)]
+
+    ax4 = plt.subplot2grid((5, 5), (2, 4), colspan=1, rowspan=3)
+    rxy_line, = ax4.plot([], [], 'k-', linewidth=3, label='$r_{xy}$')
+    ax4.set_ylim([min(bf), max(bf)])
+    ax4.set_xlabel(r'$R_{xy}(\Omega)$')
+    [ax4.axvline(x=h0 / e0 ** 2 / xi, linestyle=':', color='y', linewidth=2) for xi in range(1, 10)]
+    [ax4.axvline(x=-h0 / e0 ** 2 / xi, linestyle=':', color='g', linewidth=2) for xi in range(1, 10)]
+    props = dict(boxstyle='round', fc='b', alpha=0.5)
+    if bgortg:
+        textstr = ''.join((r'$U_{bg} = $', label))
+    else:
+        textstr = ''.join((r'$U_{tg} = $', label))
+    ax2.text(0.85, 0.9, textstr, transform=ax2.transAxes, fontsize=14, verticalalignment='top', bbox=props,
+             color='w')
+    if 'inline' in plt.get_backend():
+        plt.close(fig)  # shown by _refresh instead
 
-        ax2.text(0.85, 0.9, textstr, transform=ax2.transAxes, fontsize=14, verticalalignment='top', bbox=props,
-                 color='w')
+    def plot_animation(uplim, gate):
+        field_cut = field_cuts[_nearest(field_keys, uplim)]
+        sxy_line.set_data(field_cut[:, 0], field_cut[:, 1] / e0 ** 2 * h0)
+        diff_line.set_data(*diff_cuts[_nearest(field_keys, uplim)])
+        ax3.relim()
+        ax3.autoscale_view()
+        field_line.set_ydata([uplim, uplim])
+        gate_cut = gate_cuts[_nearest(gate_keys, gate)]
+        rxy_line.set_data(gate_cut[:, 0], gate_cut[:, 1])
+        ax4.set_xlim([min(gate_cut[:, 0]) - 500, max(gate_cut[:, 0]) + 500])
+        gate_line.set_xdata([gate, gate])
+        _refresh(fig)
 
     if equal_spaced:
         return interactive(plot_animation,
@@ -482,6 +977,11 @@ def plot_fc_analysis(datafc, label, vmin=-0.005, vmax=0, equal_spaced=True, bgor
 
 
 def plot_fftmap(datafc, vmin=0, vmax=25, tgorbg=True, bf_range=[0.25, 1]):
+    '''
+    Interactive FFT map of Rxx(1/B) versus gate, with the spectrum and the trace at the selected gate.
+    The figure and all the traces are prepared once, the slider only moves the cut.
+    '''
+    import matplotlib.pyplot as plt
     from ipywidgets import interactive, FloatSlider
     _, data = datafc.getdata()
     gates = data['gate'].apply(lambda x: round(x, 3)).unique()
@@ -489,52 +989,62 @@ def plot_fftmap(datafc, vmin=0, vmax=25, tgorbg=True, bf_range=[0.25, 1]):
     ## extract pieces of data
 
     data_p = df_range(data, 'bf', bf_range)
+    gate_keys, gate_cuts = _blocks(data_p['gate'].round(3).values, data_p[['bf', 'rxx']].values)
     fft2d = np.zeros([len(gates), (len(data_p) // len(gates) + 1) // 2])
+    traces = []
     ## obtain fft2d values in 2d array format
     for index, gate in enumerate(gates):
-        data_pp = df_range(data_p, 'gate', [gate - gate_step / 2, gate + gate_step / 2])
-        x_vals, yinterp = interp_user(1 / data_pp.bf.values, cutout_bkgd(1. / data_pp.bf.values, data_pp.rxx.values),
-                                      len(data_pp.bf))  # interpolation if applicable
+        bf_pp, rxx_pp = gate_cuts[_nearest(gate_keys, gate)].T
+        signal = cutout_bkgd(1. / bf_pp, rxx_pp)
+        x_vals, yinterp = interp_user(1 / bf_pp, signal, len(bf_pp))  # interpolation if applicable
         frq, Y = FFT_bs(x_vals, yinterp)
         fft2d[index, :] = (abs(Y) / np.mean(
             abs(Y))) ** 2  # normalized amplitude of fft and the power square is for color coding.
+        traces.append((1 / bf_pp, signal, rxx_pp))
 
     ## transform frequency into 2D electron/hole density
     n2d = e0 * frq / h0 / 1e15
     x = n2d.tolist()
     y = [round(x, 3) for x in gates.tolist()]
 
-    def plot_animation(volt_slice):
+    fig = plt.figure(figsize=(14, 10))
+    ax1 = plt.subplot2grid((5, 5), (0, 0), colspan=3, rowspan=3)
+    ax1.imshow(fft2d, aspect='auto', interpolation='none', extent=(extents(x) + extents(y)), origin='lower',
+               cmap='inferno', vmin=vmin, vmax=vmax)
+    ax1.set_ylim([min(gates), max(gates)])
+    if tgorbg:
+        ax1.set_ylabel(r'$U_{tg}$ (V)')
+    else:
+        ax1.set_ylabel(r'$U_{bg}$ (V)')
+    slice_line = ax1.axhline(y=min(gates), color='w', linestyle=':', linewidth=2)
+    ax2 = plt.subplot2grid((5, 5), (3, 0), colspan=3, rowspan=2)
+    fft_line, = ax2.plot(n2d, fft2d[0, :], '-x')
+    ax2.set_ylim([vmin, vmax])
+    ax2.set_xlabel('$n_{2d}$ in $10^{11} cm^{-2}$')
+    ax2.set_ylabel('FFT (a.u.)')
+    ax3 = plt.subplot2grid((5, 5), (0, 3), colspan=2, rowspan=5)
+    signal_line, = ax3.plot([], [], 'r-x', linewidth=1, label='raw data - background')
+    ax4 = plt.twinx(ax3)
+    raw_line, = ax4.plot([], [], 'b-x', linewidth=1, label='raw data')
+    ax3.set_xlabel(r'$B^{-1} (T^{-1})$')
+    ax3.set_ylabel(r'$R_{xx} (\Omega)$')
+    ax3.legend(loc='lower right')
+    ax4.legend(loc='upper right')
+    fig.tight_layout()
+    if 'inline' in plt.get_backend():
+        plt.close(fig)  # shown by _refresh instead
 
-        fig = plt.figure(figsize=(14, 10))
-        ax1 = plt.subplot2grid((5, 5), (0, 0), colspan=3, rowspan=3)
-        pos = ax1.imshow(fft2d, aspect='auto', interpolation='none', extent=(extents(x) + extents(y)), origin='cool',
-                         cmap='inferno', vmin=vmin, vmax=vmax)
-        ax1.set_ylim([min(gates), max(gates)])
-        if tgorbg:
-            ax1.set_ylabel(r'$U_{tg}$ (V)')
-        else:
-            ax1.set_ylabel(r'$U_{bg}$ (V)')
-        ax1.axhline(y=volt_slice, color='w', linestyle=':', linewidth=2)
-        ax2 = plt.subplot2grid((5, 5), (3, 0), colspan=3, rowspan=2)
-        ax2.plot(n2d, fft2d[y.index(volt_slice), :], '-x')
-        ax2.set_ylim([vmin, vmax])
-        ax2.set_xlabel('$n_{2d}$ in $10^{11} cm^{-2}$')
-        ax2.set_ylabel('FFT (a.u.)')
-        ax3 = plt.subplot2grid((5, 5), (0, 3), colspan=2, rowspan=5)
-        data_pp = df_range(data_p, 'gate', [volt_slice - gate_step / 2, volt_slice + gate_step / 2])
-        ax3.plot(1 / data_pp.bf, cutout_bkgd(1 / data_pp.bf.values, data_pp.rxx.values), 'r-x', linewidth=1,
-                 label='raw data - background')
-        ax4 = plt.twinx(ax3)
-        ax4.plot(1 / data_pp.bf, data_pp.rxx.values, 'b-x', linewidth=1, label='raw data')
-        ax3.set_xlabel(r'$B^{-1} (T^{-1})$')
-        #         ax3.yaxis.tick_right()
-        #         ax3.yaxis.set_label_position('right')
-        ax3.set_ylabel(r'$R_{xx} (\Omega)$')
-        #         ax3.set_xlim([0.25,0.6])
-        ax3.legend(loc='lower right')
-        ax4.legend(loc='upper right')
-        fig.tight_layout()
+    def plot_animation(volt_slice):
+        index = _nearest(y, volt_slice)
+        slice_line.set_ydata([volt_slice, volt_slice])
+        fft_line.set_ydata(fft2d[index, :])
+        invbf, signal, rxx = traces[index]
+        signal_line.set_data(invbf, signal)
+        raw_line.set_data(invbf, rxx)
+        for ax in (ax3, ax4):
+            ax.relim()
+            ax.autoscale_view()
+        _refresh(fig)
 
     return interactive(plot_animation,
                        volt_slice=FloatSlider(min=min(gates), max=max(gates), step=gate_step, continuous_update=False))
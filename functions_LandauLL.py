@@ -6,14 +6,20 @@ functions and base classes for Landau level calculation in a three-band model
 import os
 
 # Third party imports
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from scipy.integrate import quad
+from scipy.special import erf
 
 # Local application import
-from physconst import *
-from utils import deprecated
+try:  # imported as a submodule of the package (SciData.functions_LandauLL)
+    from .physconst import *
+    from .profiling import staged
+    from .utils import deprecated
+except ImportError:  # imported as a script module, e.g. from the notebooks
+    from physconst import *
+    from profiling import staged
+    from utils import deprecated
 
 
 # Some low-level functions
@@ -37,6 +43,53 @@ def LL_fillfactor(fermi_energy, LLenergy: list):
     return index - 0.5
 
 
+def _batch_searchsorted(a, v, side='left'):
+    """np.searchsorted applied row by row without a Python loop: every row of a (any order) and v becomes a range of
+    integer ranks in one global sort, the rows are shifted apart and searched at once, ties are resolved exactly
+    Arguments:
+    a: rows, shape (..., N), sorted here along the last axis
+    v: values to look up in each row, shape (..., M)
+    side: 'left' counts the values of a row < v, 'right' the values <= v
+    Return:
+    number of values of each row of a below v, shape (..., M)
+    """
+    a = np.asarray(a, dtype=float)
+    v = np.asarray(v, dtype=float)
+    batch = np.broadcast_shapes(a.shape[:-1], v.shape[:-1])
+    N, M = a.shape[-1], v.shape[-1]
+    rows_a = np.sort(np.broadcast_to(a, batch + (N,)).reshape(-1, N), axis=-1)
+    rows_v = np.broadcast_to(v, batch + (M,)).reshape(-1, M)
+    if N == 0 or rows_v.size == 0:
+        return np.zeros(batch + (M,), dtype=int)
+    values = np.sort(rows_a, axis=None)
+    # a < v (side left) or a <= v (side right) <=> rank of a < rank of v
+    rank_a = np.searchsorted(values, rows_a, side='left')
+    rank_v = np.searchsorted(values, rows_v, side=side)
+    shift = np.arange(len(rows_a))[:, None] * (len(values) + 1)
+    count = np.searchsorted((rank_a + shift).ravel(), (rank_v + shift).ravel(), side='left') - np.repeat(
+        np.arange(len(rows_a)) * N, M)
+    return count.reshape(batch + (M,))
+
+
+def LL_fillfactor_map(fermi_energy, LLenergy):
+    """ Vectorized LL_fillfactor: Landau level filling factor on a whole grid of Fermi energies and fields
+    Arguments:
+    fermi_energy: Fermi energies (or chemical potentials), shape (..., nE), e.g. (B, E), or (nE,) for all fields
+    LLenergy: energy values of Landau levels, shape (..., N), e.g. (B, N), in any order (levels of several bands
+    may be concatenated)
+    Returns:
+    number of occupied Landau levels (integer), shape (..., nE)
+    integer-0.5: Landau level filling factor, as returned by LL_fillfactor (also capped at N-1-0.5 above the
+    highest level)
+    """
+    LLenergy = np.asarray(LLenergy, dtype=float)
+    if LLenergy.shape[-1] == 0:
+        raise ValueError('No Laudau level found, check your inputs!')
+    occupied = np.minimum(_batch_searchsorted(LLenergy, fermi_energy, side='left'), LLenergy.shape[-1] - 1)
+    # 0.5 accounts for the half-integer of the lowest Landau level in Dirac dispersion case
+    return occupied, occupied - 0.5
+
+
 def density2energy(density, vf):
     """Calculate the energy shift relative to the zero-density point by assuming a carrier density in Dirac dispersion case
     Arguments:
@@ -111,6 +164,67 @@ def llenergy_generator(Ets, Ebs, Evp, B, angle, meff, Nmax=30, vf=1e6, gfactor=2
     return llenergy_top_surface, llenergy_bottom_surface, llenergy_vps_up, llenergy_vps_down
 
 
+def llenergy_generator_batch(Ets, Ebs, Evp, B, angle, meff, Nmax=30, vf=1e6, gfactor=28):
+    """Vectorized llenergy_generator, all of Ets, Ebs, Evp, B and angle may be arrays broadcast against each other
+    Arguments:
+    see llenergy_generator
+    Return:
+    Energy for each Landau level from each band, arrays of shape broadcast(Ets, Ebs, Evp, B, angle) + (Nmax-1,)
+    """
+    Ets, Ebs, Evp, B, angle = [np.asarray(x, dtype=float)[..., None] for x in (Ets, Ebs, Evp, B, angle)]
+    N = np.arange(Nmax - 1)
+    # the cosine is evaluated once for the whole grid instead of once per Landau index
+    B_perp = B * np.cos(angle * np.pi / 180)
+    shape = np.broadcast_shapes(Ets.shape, Ebs.shape, Evp.shape, B.shape, angle.shape, N.shape)
+    # llenergy_dirac for N >= 0
+    llenergy_dirac_N = np.where(N > 0, (2 * e0 * hbar * vf ** 2 * B_perp * N + (gfactor * muB * B) ** 2) ** 0.5,
+                                -gfactor * muB * B)
+    # llenergy_conv with its default g-factor, as in llenergy_generator
+    llenergy_conv_N = (N + 0.5) * hbar * e0 * B_perp / me / meff
+    zeeman_conv = 6 * muB * B / 2
+    return (np.broadcast_to(Ets + llenergy_dirac_N, shape), np.broadcast_to(Ebs + llenergy_dirac_N, shape),
+            np.broadcast_to(Evp + llenergy_conv_N + zeeman_conv, shape),
+            np.broadcast_to(Evp + llenergy_conv_N - zeeman_conv, shape))
+
+
+def _batch_interp(x, xp, fp):
+    """np.interp applied row by row without a Python loop
+    Arguments:
+    x: value to look up in each row, shape (...)
+    xp: non-decreasing rows, shape (..., n)
+    fp: values on xp, shape (n,) or (..., n)
+    Return:
+    interpolated values, shape (...)
+    """
+    return _batch_interp_grid(np.asarray(x, dtype=float)[..., None], xp, fp)[..., 0]
+
+
+def _batch_interp_grid(x, xp, fp):
+    """np.interp applied row by row without a Python loop, for several values per row
+    Arguments:
+    x: values to look up in each row, shape (..., M)
+    xp: non-decreasing rows, shape (..., n)
+    fp: values on xp, shape (n,) or (..., n)
+    Return:
+    interpolated values, shape (..., M)
+    """
+    x = np.asarray(x, dtype=float)
+    xp = np.asarray(xp, dtype=float)
+    batch = np.broadcast_shapes(x.shape[:-1], xp.shape[:-1])
+    x = np.broadcast_to(x, batch + x.shape[-1:])
+    xp = np.broadcast_to(xp, batch + xp.shape[-1:])
+    fp = np.broadcast_to(fp, xp.shape)
+    n = xp.shape[-1]
+    # index of the left neighbour, the same bracket np.interp would use
+    right = np.clip(_batch_searchsorted(xp, x, side='right'), 1, n - 1)
+    x0, x1 = np.take_along_axis(xp, right - 1, -1), np.take_along_axis(xp, right, -1)
+    f0, f1 = np.take_along_axis(fp, right - 1, -1), np.take_along_axis(fp, right, -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = np.where(x1 > x0, f0 + (x - x0) * (f1 - f0) / (x1 - x0), f0)
+    f = np.where(x < xp[..., :1], fp[..., :1], f)
+    return np.where(x >= xp[..., -1:], fp[..., -1:], f)
+
+
 def electron_density_of_state(E, B, sigma, angle, llenergy_top_surface, llenergy_bottom_surface):
     """ Calculate the density of state at a set of certain chemical potential and magnetic field for top/bottom surface states
     Arguments:
@@ -295,6 +409,257 @@ def fastIntegral_hole_DOS(Energy, B, sigma, angle, llenergy_vps_up, llenergy_vps
     return output
 
 
+def _nsigma(tol):
+    """Half width of the window (in units of sigma) outside of which a Gaussian is below tol of its peak"""
+    return (2 * np.log(1 / tol)) ** 0.5
+
+
+def _windowed_gaussian_sum(E, centres, sigma, nsigma, cumulative=False):
+    """Sum the Gaussian distributions (or their CDF) of a set of Landau levels, only over the levels within
+    nsigma*sigma of each energy: the levels are sorted once and the window of every energy is found by searchsorted,
+    the cost scales with the number of levels near E instead of the number of levels
+    Arguments:
+    E: energies, shape (..., nE)
+    centres: central energies of Landau levels, shape (..., N), any order
+    sigma: broadening of Landau level
+    nsigma: half width of the window in units of sigma
+    cumulative: sum the CDF instead of the density (the levels below the window count 1 each)
+    Return:
+    sum over N, shape (..., nE)
+    """
+    E = np.asarray(E, dtype=float)
+    centres = np.asarray(centres, dtype=float)
+    batch = np.broadcast_shapes(E.shape[:-1], centres.shape[:-1])
+    nE, N = E.shape[-1], centres.shape[-1]
+    energies = np.broadcast_to(E, batch + (nE,)).reshape(-1, nE)
+    levels = np.sort(np.broadcast_to(centres, batch + (N,)).reshape(-1, N), axis=-1)
+    if N == 0 or energies.size == 0:
+        return np.zeros(batch + (nE,))
+    # all rows in one sorted array: every row is shifted by more than the width of all energies and levels
+    lowest, highest = min(energies.min(), levels.min()), max(energies.max(), levels.max())
+    half = min(nsigma * sigma, highest - lowest + sigma)  # nsigma=np.inf: every level is in the window
+    lowest -= half
+    shift = 2 * (highest + half - lowest)
+    rows = np.arange(len(levels))[:, None] * shift
+    keys = (levels - lowest + rows).ravel()
+    queries = energies - lowest + rows
+    first = np.searchsorted(keys, (queries - half).ravel(), side='left')
+    last = np.searchsorted(keys, (queries + half).ravel(), side='right')
+    # ragged (energy, level) pairs inside the windows
+    counts = last - first
+    pair_energy = np.repeat(np.arange(counts.size), counts)
+    pair_level = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    x = (energies.ravel()[pair_energy] - levels.ravel()[pair_level]) / sigma
+    if cumulative:
+        below = first - np.repeat(np.arange(len(levels)) * N, nE)
+        total = below + np.bincount(pair_energy, weights=0.5 * (1 + erf(x / 2 ** 0.5)), minlength=counts.size)
+    else:
+        total = np.bincount(pair_energy, weights=np.exp(-0.5 * x ** 2), minlength=counts.size) / sigma / (
+            2 * np.pi) ** 0.5
+    return total.reshape(batch + (nE,))
+
+
+def _gaussian_cdf_sum(E, centres, sigma, nsigma=None):
+    """Sum the cumulative Gaussian distributions of a set of Landau levels
+    Arguments:
+    E: energies, shape (..., nE)
+    centres: central energies of Landau levels, shape (..., N)
+    sigma: broadening of Landau level
+    nsigma: None sums over all levels, otherwise only over the levels within nsigma*sigma (see _windowed_gaussian_sum)
+    Return:
+    sum over N of the Gaussian CDF at E, shape (..., nE)
+    """
+    if nsigma is not None:
+        return _windowed_gaussian_sum(E, centres, sigma, nsigma, cumulative=True)
+    E = np.asarray(E, dtype=float)
+    centres = np.asarray(centres, dtype=float)
+    total = np.zeros(np.broadcast_shapes(E.shape, centres.shape[:-1] + (1,)))
+    # loop over the levels only, every level is vectorized over the whole energy (and batch) grid
+    for n in range(centres.shape[-1]):
+        total += 0.5 * (1 + erf((E - centres[..., n:n + 1]) / sigma / 2 ** 0.5))
+    return total
+
+
+def windowed_electron_DOS(Energy, B, sigma, angle, llenergy_top_surface, llenergy_bottom_surface, tol=1e-12):
+    """Density of state of the top/bottom surface states on a grid of chemical potentials, same as
+    electron_density_of_state but vectorized and only summed over the Landau levels near each energy: the cost scales
+    with the local density of levels, not with Nmax. Batched over leading axes (e.g. one row per magnetic field).
+    Arguments:
+    Energy: positions of chemical potential, shape (..., nE)
+    B: total magnetic field, scalar or shape (...)
+    sigma: broadening of Landau level by assuming a Gaussian-shape distribution around the central energy
+    angle: the angle of magnetic field with the normal of sample plane
+    llenergy_top_surface: energy of Landau levels from top surface state, shape (..., N) (N may be 0)
+    llenergy_bottom_surface: energy of Landau levels from bottom surface state, shape (..., N) (N may be 0)
+    tol: levels further than sqrt(2*ln(1/tol))*sigma are skipped, every skipped level contributes less than tol of
+    the peak DOS of one level; None sums over all levels
+    Return:
+    Density of state from all the bands, shape (..., nE)
+    """
+    top = np.asarray(llenergy_top_surface, dtype=float)
+    bot = np.asarray(llenergy_bottom_surface, dtype=float)
+    if top.shape[-1] == 0 and bot.shape[-1] == 0:
+        raise ValueError('No Laudau level found, check your inputs!')
+    Energy = np.asarray(Energy, dtype=float)
+    lldegeneracy = np.asarray(B * np.cos(angle * np.pi / 180) * e0 / h0, dtype=float)[..., None]
+    batch = np.broadcast_shapes(top.shape[:-1], bot.shape[:-1])
+    centres = np.concatenate([np.broadcast_to(ll, batch + ll.shape[-1:]) for ll in (top, bot)], axis=-1)
+    nsigma = np.inf if tol is None else _nsigma(tol)
+    dos = _windowed_gaussian_sum(Energy, centres, sigma, nsigma)
+    # DOS from 0LL should be half of other LLs.
+    for ll in (top, bot):
+        if ll.shape[-1]:
+            dos = dos - 0.5 * _windowed_gaussian_sum(Energy, ll.min(axis=-1, keepdims=True), sigma, nsigma)
+    return lldegeneracy * dos
+
+
+def windowed_hole_DOS(Energy, B, sigma, angle, llenergy_vps_up, llenergy_vps_down, tol=1e-12):
+    """Density of state of the Volkov-Pankratov states on a grid of chemical potentials, same as hole_density_of_state
+    but vectorized and windowed (see windowed_electron_DOS)
+    """
+    up = np.asarray(llenergy_vps_up, dtype=float)
+    down = np.asarray(llenergy_vps_down, dtype=float)
+    batch = np.broadcast_shapes(up.shape[:-1], down.shape[:-1])
+    centres = np.concatenate([np.broadcast_to(ll, batch + ll.shape[-1:]) for ll in (up, down)], axis=-1)
+    lldegeneracy = np.asarray(B * np.cos(angle * np.pi / 180) * e0 / h0, dtype=float)[..., None]
+    nsigma = np.inf if tol is None else _nsigma(tol)
+    return -lldegeneracy * _windowed_gaussian_sum(Energy, centres, sigma, nsigma)
+
+
+def _electron_IDOS(Energy, lldegeneracy, sigma, llenergy_top_surface, llenergy_bottom_surface, nsigma=None):
+    """Closed-form IDOS of the surface states, batched over leading axes
+    Arguments:
+    Energy: energies, shape (..., nE)
+    lldegeneracy: degeneracy of Landau levels, shape (...)
+    sigma: broadening of Landau level
+    llenergy_top_surface: energy of Landau levels from top surface state, shape (..., N) (N may be 0)
+    llenergy_bottom_surface: energy of Landau levels from bottom surface state, shape (..., N) (N may be 0)
+    nsigma: None: exact, otherwise only the levels within nsigma*sigma of each energy are evaluated
+    Return:
+    IDOS, shape (..., nE)
+    """
+    top = np.asarray(llenergy_top_surface, dtype=float)
+    bot = np.asarray(llenergy_bottom_surface, dtype=float)
+    if top.shape[-1] == 0 and bot.shape[-1] == 0:
+        raise ValueError('No Laudau level found, check your inputs!')
+    centres = np.concatenate([top, bot], axis=-1)
+    # same lower bound as fastIntegral_electron_DOS, the integral starts at lowest_energy-3*sigma
+    lower = centres.min(axis=-1, keepdims=True) - 3 * sigma
+
+    def primitive(x):
+        cdf = _gaussian_cdf_sum(x, centres, sigma, nsigma)
+        # DOS from 0LL should be half of other LLs.
+        for ll in (top, bot):
+            if ll.shape[-1]:
+                cdf = cdf - 0.5 * _gaussian_cdf_sum(x, ll.min(axis=-1, keepdims=True), sigma)
+        return cdf
+
+    Energy = np.asarray(Energy, dtype=float)
+    IDOS = np.asarray(lldegeneracy, dtype=float)[..., None] * (primitive(Energy) - primitive(lower))
+    return np.where(Energy > lower, IDOS, 0)
+
+
+def _hole_IDOS(Energy, lldegeneracy, sigma, llenergy_vps_up, llenergy_vps_down, nsigma=None):
+    """Closed-form IDOS of the Volkov-Pankratov states, batched over leading axes (see _electron_IDOS)
+    """
+    centres = np.concatenate([np.asarray(llenergy_vps_up, dtype=float),
+                              np.asarray(llenergy_vps_down, dtype=float)], axis=-1)
+    # same upper bound as fastIntegral_hole_DOS, the integral ends at highest_energy+3*sigma
+    upper = centres.max(axis=-1, keepdims=True) + 3 * sigma
+    Energy = np.asarray(Energy, dtype=float)
+    IDOS = -np.asarray(lldegeneracy, dtype=float)[..., None] * (
+        _gaussian_cdf_sum(upper, centres, sigma, nsigma) - _gaussian_cdf_sum(Energy, centres, sigma, nsigma))
+    return np.where(Energy < upper, IDOS, 0)
+
+
+def erfIntegral_electron_DOS(Energy, B, sigma, angle, llenergy_top_surface, llenergy_bottom_surface, tol=None):
+    """Calculate the integral of DOS from the electron_density_of_state function in closed form (error function).
+    Same result as fastIntegral_electron_DOS, but Energy does not need to be equally spaced.
+    Arguments:
+    Energy: positions of chemical potential
+    B: total magnetic field
+    sigma: broadening of Landau level by assuming a Gaussian-shape distribution around the central energy
+    angle: the angle of magnetic field with the normal of sample plane
+    llenergy_top_surface: energy of Landau levels from top surface state
+    llenergy_bottom_surface: energy of Landau levels from bottom surface state
+    tol: None: exact, otherwise only the Landau levels within sqrt(2*ln(1/tol))*sigma of each energy are evaluated
+    (the levels below count as filled), the cost then scales with the local density of levels instead of Nmax
+    Return:
+    Integral of density of state from all the bands at (E,B)
+    """
+    lldegeneracy = B * np.cos(angle * np.pi / 180) * e0 / h0
+    return _electron_IDOS(Energy, lldegeneracy, sigma, list(llenergy_top_surface), list(llenergy_bottom_surface),
+                          None if tol is None else _nsigma(tol))
+
+
+def erfIntegral_hole_DOS(Energy, B, sigma, angle, llenergy_vps_up, llenergy_vps_down, tol=None):
+    """Calculate the integral of DOS from the hole_density_of_state function in closed form (error function).
+    Same result as fastIntegral_hole_DOS, but Energy does not need to be equally spaced.
+    Arguments:
+    Energy: positions of chemical potential
+    B: total magnetic field
+    sigma: broadening of Landau level by assuming a Gaussian-shape distribution around the central energy
+    angle: the angle of magnetic field with the normal of sample plane
+    llenergy_vps_up: energy of Landau levels from Volkov-Pankratov state (spin-up)
+    llenergy_vps_down: energy of Landau levels from Volkov-Pankratov state (spin-down)
+    tol: None: exact, otherwise only the Landau levels within sqrt(2*ln(1/tol))*sigma of each energy are evaluated
+    (the levels below count as filled), the cost then scales with the local density of levels instead of Nmax
+    Return:
+    Integral of density of state from all the bands at (E,B)
+    """
+    lldegeneracy = B * np.cos(angle * np.pi / 180) * e0 / h0
+    return _hole_IDOS(Energy, lldegeneracy, sigma, list(llenergy_vps_up), list(llenergy_vps_down),
+                      None if tol is None else _nsigma(tol))
+
+
+def adaptive_Erange(llenergy, sigma, Emin, Emax, nsigma=4, npoints=17, nbase=16):
+    """Build an energy grid clustered around the Landau levels
+    Arguments:
+    llenergy: energy of all Landau levels at a certain field
+    sigma: (smallest) broadening of Landau level
+    Emin: lower bound of the energy window
+    Emax: upper bound of the energy window
+    nsigma: half width of the window around each level in units of sigma
+    npoints: number of points within the window around each level
+    nbase: number of equally spaced points across [Emin, Emax] for the flat parts in between
+    Return:
+    sorted energy grid, its size scales with the number of levels inside [Emin, Emax]
+    """
+    llenergy = np.asarray(llenergy, dtype=float).ravel()
+    llenergy = llenergy[(llenergy > Emin - nsigma * sigma) & (llenergy < Emax + nsigma * sigma)]
+    window = sigma * np.linspace(-nsigma, nsigma, npoints)
+    Egrid = np.concatenate([np.linspace(Emin, Emax, nbase), (llenergy[:, None] + window).ravel()])
+    return np.unique(Egrid[(Egrid >= Emin) & (Egrid <= Emax)])
+
+
+class AdaptiveIDOS():
+    """
+    IDOS sampled on an adaptive energy grid for each magnetic field, with linear interpolation in between
+    Arguments:
+    Brange: magnetic fields
+    Egrids: energy grid for each field
+    IDOS: IDOS on Egrids for each field
+    Methods:
+    __call__: interpolate the IDOS onto a common energy range, shape (len(Brange), len(Erange))
+    find_energy: chemical potential for a carrier density at each field
+    """
+
+    def __init__(self, Brange, Egrids, IDOS):
+        self.Brange = Brange
+        self.Egrids = Egrids
+        self.IDOS = IDOS
+
+    def __repr__(self):
+        return f'AdaptiveIDOS(fields = {len(self.Brange)}, points = {sum(len(Egrid) for Egrid in self.Egrids)})'
+
+    def __call__(self, Erange):
+        return np.array([np.interp(Erange, Egrid, IDOS_B) for Egrid, IDOS_B in zip(self.Egrids, self.IDOS)])
+
+    def find_energy(self, target_density):
+        return np.array([find_energy_bydensity(target_density, B, IDOS_B, Egrid)
+                         for B, Egrid, IDOS_B in zip(self.Brange, self.Egrids, self.IDOS)])
+
+
 def find_energy_bydensity(target_density, B, IDOS_B, energy):
     """Find the energy corresponding to target_density by IDOS at a certain B
     Arguments:
@@ -424,6 +789,7 @@ class TBLLsimu():
         '''
         Plot the landau levels in energy versus magnetic field from all bands
         '''
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(8, 8))
         ax = fig.add_subplot(111)
 
@@ -467,6 +833,7 @@ class TBLLsimu():
         '''
         Plot the landau levels in density versus magnetic field from all bands
         '''
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(8, 7))
         ax = fig.add_subplot(111)
         lw = 3
@@ -497,6 +864,7 @@ class TBLLsimu():
         ax.set_ylabel('Density ($10^{11}cm^{-2}$)')
         return fig, ax
 
+    @staged('IDOS_generator', points=lambda self, angle, Brange, Erange, *args, **kwargs: len(Brange) * len(Erange))
     def IDOS_generator(self, angle, Brange, Erange, LLenergy_top_surface, LLenergy_bottom_surface, LLenergy_vps_up=None,
                        LLenergy_vps_down=None):
         """ Calculate a two-dimensional matrix of IDOS 
@@ -526,6 +894,150 @@ class TBLLsimu():
 
         return IDOS
 
+    def IDOS_adaptive(self, angle, Brange, Emin, Emax, LLenergy_top_surface, LLenergy_bottom_surface,
+                      LLenergy_vps_up=None, LLenergy_vps_down=None, nsigma=4, npoints=17, nbase=16, tol=None):
+        """ Calculate the IDOS on an energy grid clustered around the Landau levels of each field (see adaptive_Erange).
+        Replaces a dense uniform Erange in IDOS_generator, the cost scales with the number of levels.
+        tol: see erfIntegral_electron_DOS, e.g. 1e-12 for many Landau levels (large Nmax)
+        Return:
+        AdaptiveIDOS, call it with an Erange to get the same matrix as IDOS_generator
+        """
+        sigmaE = self.sigmaE
+        sigmaH = self.sigmaH
+        threeband = all([LLenergy_vps_up, LLenergy_vps_down])
+        Egrids = []
+        IDOS = []
+        for index, B in enumerate(Brange):
+            llenergy_electron = [LLenergy_top_surface[index], LLenergy_bottom_surface[index]]
+            llenergy_hole = [LLenergy_vps_up[index], LLenergy_vps_down[index]] if threeband else []
+            Egrid = np.union1d(adaptive_Erange(sum(map(list, llenergy_electron), []), sigmaE, Emin, Emax, nsigma,
+                                               npoints, nbase),
+                               adaptive_Erange(sum(map(list, llenergy_hole), []), sigmaH, Emin, Emax, nsigma,
+                                               npoints, nbase))
+            IDOS_B = erfIntegral_electron_DOS(Egrid, B, sigmaE, angle, *llenergy_electron, tol=tol)
+            if threeband:
+                IDOS_B = IDOS_B + erfIntegral_hole_DOS(Egrid, B, sigmaH, angle, *llenergy_hole, tol=tol)
+            Egrids.append(Egrid)
+            IDOS.append(IDOS_B)
+        return AdaptiveIDOS(Brange, Egrids, IDOS)
+
+    def angle_sweep(self, angles, Brange, Erange, Nmax, den_top, den_bot, den_vps=None, threeband=False):
+        """ Calculate Landau levels, IDOS and chemical potential for a whole angle x field grid in one vectorized call
+        (instead of looping get_ll_en/IDOS_generator over angles)
+        Return:
+        dictionary with
+        llenergy_ts/llenergy_bs(/llenergy_vpsup/llenergy_vpsdown): shape (len(angles), len(Brange), Nmax-1)
+        IDOS: shape (len(angles), len(Brange), len(Erange))
+        mu: chemical potential, shape (len(angles), len(Brange))
+        """
+        vf = self.vf
+        gfactor = self.gfactor
+        meff = self.meff
+
+        angles = np.asarray(angles, dtype=float)[:, None]
+        Brange = np.asarray(Brange, dtype=float)[None, :]
+        Erange = np.asarray(Erange, dtype=float)
+        Ets = -hbar * vf * (4 * np.pi * den_top) ** 0.5
+        Ebs = -hbar * vf * (4 * np.pi * den_bot) ** 0.5
+        Evp = -hbar ** 2 * den_vps * np.pi / (meff * me) / 2 if threeband else 0
+        LL_ts, LL_bs, LL_vpsup, LL_vpsdown = llenergy_generator_batch(Ets, Ebs, Evp, Brange, angles, meff, Nmax, vf,
+                                                                      gfactor)
+        lldegeneracy = Brange * np.cos(angles * np.pi / 180) * e0 / h0
+        IDOS = _electron_IDOS(Erange, lldegeneracy, self.sigmaE, LL_ts, LL_bs)
+        density = den_top + den_bot
+        output = {'angle': angles[:, 0], 'bfield': Brange[0], 'energy': Erange, 'llenergy_ts': LL_ts,
+                  'llenergy_bs': LL_bs}
+        if threeband:
+            IDOS += _hole_IDOS(Erange, lldegeneracy, self.sigmaH, LL_vpsup, LL_vpsdown)
+            density = density - den_vps
+            output.update({'llenergy_vpsup': LL_vpsup, 'llenergy_vpsdown': LL_vpsdown})
+        output.update({'IDOS': IDOS, 'mu': _batch_interp(density, IDOS, Erange)})
+        return output
+
+    def transport_map(self, angle, Brange, densities, Erange, Nmax, den_top, den_bot, den_vps=None, threeband=False,
+                      sweep='bf', AspRatio=3, tol=1e-12):
+        """ Simulate conductivity maps over a whole field x density grid in one vectorized call, in the layout of the
+        grids of Datamap.getdata, so that a measured map and a simulated one can be subtracted directly.
+        Rigid bands: the Landau levels are those of get_ll_en (den_top, den_bot, den_vps), the gate only changes the
+        total density, the chemical potential is found from the IDOS at every (B, density).
+        Proxies of the conductivity tensor, in S:
+        sxy: Hall conductivity of the filling factors, (nu_ts + nu_bs - holes in the VPS levels above mu) * e^2/h,
+        with nu from LL_fillfactor_map
+        sxx: DOS at the chemical potential of every band, in units of the peak DOS of one Landau level, * e^2/h
+        Arguments:
+        Brange: magnetic fields, e.g. fc['v1'] of a map of field sweeps
+        densities: total carrier density of every gate step (e.g. from denCal_single), for the threeband model the
+        total is den_top + den_bot - den_vps at the reference point
+        Erange: energy grid on which the IDOS is inverted (covering the chemical potentials of all densities)
+        sweep: 'bf': field along v1 and density along v2 (maps of field sweeps), 'density': the transpose
+        AspRatio: aspect ratio of the Hall bar, for rxx2d as in Datamap
+        tol: see windowed_electron_DOS, None sums over all Landau levels
+        Return:
+        dictionary with
+        v1, v2, rxx2d, rxy2d, sxy2d, sxx2d, dv1, dv2: as returned by Datamap.getdata (DataFrames of shape v1 x v2)
+        mu, dos, nu: chemical potential, total DOS and filling factor (arrays v1 x v2)
+        """
+        if sweep not in ['bf', 'density']:
+            raise ValueError("Error: sweep has to be 'bf' or 'density'")
+        vf = self.vf
+        gfactor = self.gfactor
+        meff = self.meff
+        sigmaE = self.sigmaE
+        sigmaH = self.sigmaH
+        nsigma = None if tol is None else _nsigma(tol)
+
+        Brange = np.asarray(Brange, dtype=float)
+        densities = np.asarray(densities, dtype=float)
+        Ets = -hbar * vf * (4 * np.pi * den_top) ** 0.5
+        Ebs = -hbar * vf * (4 * np.pi * den_bot) ** 0.5
+        Evp = -hbar ** 2 * den_vps * np.pi / (meff * me) / 2 if threeband else 0
+        LL_ts, LL_bs, LL_vpsup, LL_vpsdown = llenergy_generator_batch(Ets, Ebs, Evp, Brange, angle, meff, Nmax, vf,
+                                                                      gfactor)
+        lldegeneracy = Brange * np.cos(angle * np.pi / 180) * e0 / h0
+        IDOS = _electron_IDOS(Erange, lldegeneracy, sigmaE, LL_ts, LL_bs, nsigma)
+        if threeband:
+            IDOS += _hole_IDOS(Erange, lldegeneracy, sigmaH, LL_vpsup, LL_vpsdown, nsigma)
+        # chemical potential of every (B, density), shape (len(Brange), len(densities))
+        mu = _batch_interp_grid(np.broadcast_to(densities, (len(Brange), len(densities))), IDOS, Erange)
+
+        dos = windowed_electron_DOS(mu, Brange, sigmaE, angle, LL_ts, LL_bs, tol)
+        level_peak = lldegeneracy[:, None] / sigmaE / (2 * np.pi) ** 0.5
+        sxx = dos / level_peak
+        nu = LL_fillfactor_map(mu, LL_ts)[1] + LL_fillfactor_map(mu, LL_bs)[1]
+        if threeband:
+            hole_dos = windowed_hole_DOS(mu, Brange, sigmaH, angle, LL_vpsup, LL_vpsdown, tol)
+            dos = dos + hole_dos
+            sxx = sxx - hole_dos / (lldegeneracy[:, None] / sigmaH / (2 * np.pi) ** 0.5)
+            LL_vps = np.concatenate([LL_vpsup, LL_vpsdown], axis=-1)
+            nu = nu - (LL_vps.shape[-1] - _batch_searchsorted(LL_vps, mu, side='right'))
+        sxx = sxx * e0 ** 2 / h0
+        sxy = nu * e0 ** 2 / h0
+        # sheet resistivities, rxx2d is the resistance of the Hall bar like in Datamap.transport
+        rho = sxx ** 2 + sxy ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rxx, rxy = sxx / rho * AspRatio, sxy / rho
+
+        if sweep == 'bf':
+            v1, v2 = Brange, densities
+            grids = {'rxx2d': rxx, 'rxy2d': rxy, 'sxy2d': sxy, 'sxx2d': sxx, 'mu': mu, 'dos': dos, 'nu': nu}
+        else:
+            v1, v2 = densities, Brange
+            grids = {'rxx2d': rxx.T, 'rxy2d': rxy.T, 'sxy2d': sxy.T, 'sxx2d': sxx.T, 'mu': mu.T, 'dos': dos.T,
+                     'nu': nu.T}
+        output = {'v1': v1, 'v2': v2}
+        for key in ['rxx2d', 'rxy2d', 'sxy2d', 'sxx2d']:
+            output[key] = pd.DataFrame(grids[key], columns=[key[:3]] * len(v2))
+        # first differences of sxy like Datamap.getdata without derivative (first row/column NaN)
+        sxy2D = output['sxy2d']
+        spacing = np.abs(np.diff(v1))
+        if np.allclose(spacing, spacing[0], rtol=1e-3):
+            output['dv1'] = sxy2D.diff(axis=0) / abs(v1[0] - v1[1])
+        else:
+            output['dv1'] = sxy2D.diff(axis=0).div(np.append(np.nan, spacing), axis=0)
+        output['dv2'] = sxy2D.diff(axis=1) / abs(v2[0] - v2[1])
+        output.update({key: grids[key] for key in ['mu', 'dos', 'nu']})
+        return output
+
     def plot_DOS(self, angle, Bfield, Erange, Nmax, den_top, den_bot, den_vps=None, threeband=False):
         '''
         Plot the scan of DOS within an energy window at a specific magnetic field/orientation (Bfield/angle) 
@@ -540,6 +1052,7 @@ class TBLLsimu():
         Ets = -hbar * vf * (4 * np.pi * den_top) ** 0.5
         Ebs = -hbar * vf * (4 * np.pi * den_bot) ** 0.5
 
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(8, 8))
         ax = fig.add_subplot(111)
 
@@ -588,6 +1101,7 @@ class TBLLsimu():
         '''
         Plot DOS versus magnetic field for each Landau level at a certain chemical potential/gate voltages
         '''
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(8, 8))
         ax = fig.add_subplot(111)
         sigmaE = self.sigmaE
@@ -0,0 +1,221 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Out-of-core processing of maps that do not fit in memory: the files of a Datamap are processed in blocks of step
+files and every grid is written into a .npy file on disk (numpy memmap), so the memory only depends on the block size.
+Grids (v1 x v2, as in Datamap.getdata): rxx2d, rxy2d, sxy2d, sxx2d, dv1, dv2 and optionally the FFT of a quantity
+along v1 (fft, frequencies frq). Min, max, mean and standard deviation of every grid are accumulated block by block.
+    fc = process_map(datamap, 'D:/processed/map1', memory=512 * 2 ** 20, fft='rxx')
+    fc['dv1'][:, 100:200]       # memmap, only this part is read from the disk
+    fc.stats['dv1']['max']      # e.g. for the colour scale
+    fc = open_map('D:/processed/map1')  # later, without processing again
+'''
+# Standard library
+import json
+import os
+from collections.abc import Mapping
+
+# Third party
+import numpy as np
+
+# Local application
+from .functions import map_diff, resample_sweeps
+from .profiling import stage
+
+__all__ = ['process_map', 'open_map', 'MapStore']
+
+QUANTITIES = {'rxx2d': 'rxx', 'rxy2d': 'rxy', 'sxy2d': 'sxy', 'sxx2d': 'sxx'}
+BYTES_PER_POINT = 16  # columns of a read file + transport tensor + resampled grids, per grid point and byte of dtype
+
+
+class MapStore(Mapping):
+    '''
+    Grids of a processed map, opened as read-only memmaps
+    KEYS: v1, v2, rxx2d, rxy2d, sxy2d, sxx2d, dv1, dv2 (and frq, fft)
+    stats: {grid: {'min', 'max', 'mean', 'std', 'count'}} over the finite values
+    settings: the arguments of process_map
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        self.keys_ = meta['keys']
+        self.stats = meta['stats']
+        self.settings = meta['settings']
+
+    def __getitem__(self, key):
+        if key not in self.keys_:
+            raise KeyError(key)
+        return np.load(os.path.join(self.folder, key + '.npy'), mmap_mode='r')
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def __repr__(self):
+        return 'MapStore({!r}, keys = {})'.format(self.folder, self.keys_)
+
+
+def open_map(folder):
+    '''grids written by process_map'''
+    return MapStore(folder)
+
+
+class _Stats:
+    '''min, max, mean and std of a grid accumulated block by block'''
+
+    def __init__(self):
+        self.count, self.total, self.squares, self.min, self.max = 0, 0., 0., np.inf, -np.inf
+
+    def add(self, block):
+        values = np.asarray(block, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values):
+            self.count += len(values)
+            self.total += values.sum()
+            self.squares += np.square(values).sum()
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+
+    def as_dict(self):
+        if not self.count:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None, 'std': None}
+        mean = self.total / self.count
+        return {'count': self.count, 'min': float(self.min), 'max': float(self.max), 'mean': float(mean),
+                'std': float(np.sqrt(max(self.squares / self.count - mean ** 2, 0.)))}
+
+
+def _v1_column(datamap):
+    '''position of v1 in the columns of read_dat (the columns are read in ascending order of ucols)'''
+    return sorted(datamap.ucols)[list(datamap.nms).index('v1')]
+
+
+def _scan_v1(datamap):
+    '''v1 of the first file, whether all files have the same v1, range and longest sweep (reads only the v1 column)'''
+    from .functions import read_dat
+    first, same, lo, hi, longest = None, True, np.inf, -np.inf, 0
+    for path in datamap.dir:
+        v1 = read_dat(path, datamap.spr, [_v1_column(datamap)], ['v1']).v1.to_numpy()
+        if first is None:
+            first = v1
+        same = same and len(v1) == len(first) and np.array_equal(v1, first)
+        lo, hi, longest = min(lo, v1.min()), max(hi, v1.max()), max(longest, len(v1))
+    return first, same, lo, hi, longest
+
+
+def _halo(derivative, options):
+    '''columns of the neighbouring blocks needed by map_diff along v2'''
+    if derivative == 'savgol':
+        return options.get('window', 7)  # the edges of a block are fitted over a whole window
+    if derivative == 'gaussian':
+        return int(4 * options.get('sigma', 2.)) + 2
+    return 1
+
+
+def process_map(datamap, folder, memory=256 * 2 ** 20, block=None, v1grid=None, method='interp', derivative=None,
+                fft=None, **options):
+    '''
+    Process a Datamap block by block into .npy files
+    :param datamap: Datamap instance
+    :param folder: output folder (created), existing grids are overwritten
+    :param memory: memory budget in bytes, sets the number of files per block
+    :param block: number of files per block (overrides memory)
+    :param v1grid, method, derivative, options: as in Datamap.getdata
+    :param fft: None or a quantity (rxx, rxy, sxx, sxy), |FFT| along v1 of every file (as FFT_bs, mean removed)
+    :return: MapStore of the written grids
+    '''
+    if fft is not None and fft not in QUANTITIES.values():
+        raise ValueError('Error: unknown quantity {} for the FFT, choose from {}'.format(fft, list(QUANTITIES.values())))
+    os.makedirs(folder, exist_ok=True)
+    nfiles = len(datamap.dir)
+    dtype = np.dtype(float) if datamap.dtype is None else datamap.dtype
+    first, same, lo, hi, longest = _scan_v1(datamap)
+    steps = np.diff(first)
+    aligned = v1grid is None and same and ((steps > 0).all() or (steps < 0).all())
+    if aligned:
+        v1 = first
+    elif v1grid is None or np.ndim(v1grid) == 0:
+        v1 = np.linspace(lo, hi, v1grid or longest)
+    else:
+        v1 = np.asarray(v1grid)
+    v1 = v1.astype(dtype)
+    v2 = np.asarray(datamap.step)
+    ngrid = len(v1)
+    if block is None:
+        block = max(1, int(memory // (max(ngrid, longest) * dtype.itemsize * BYTES_PER_POINT)))
+    np.save(os.path.join(folder, 'v1.npy'), v1)
+    np.save(os.path.join(folder, 'v2.npy'), v2)
+
+    def create(key, rows):
+        # Fortran order: the column of every file is contiguous on the disk
+        return np.lib.format.open_memmap(os.path.join(folder, key + '.npy'), mode='w+', dtype=dtype,
+                                         shape=(rows, nfiles), fortran_order=True)
+
+    grids = {key: create(key, ngrid) for key in list(QUANTITIES) + ['dv1', 'dv2']}
+    stats = {key: _Stats() for key in grids}
+    if fft is not None:
+        nfreq = ngrid // 2
+        grids['fft'] = create('fft', nfreq)
+        stats['fft'] = _Stats()
+        np.save(os.path.join(folder, 'frq.npy'), np.arange(nfreq) / (np.max(v1) - np.min(v1)))
+    spacing = np.abs(np.diff(v1.astype(float)))
+    uniform = np.allclose(spacing, spacing[0], rtol=1e-3)
+
+    # pass 1: tensors, dv1 and the FFT, every column only depends on its own file
+    for start in range(0, nfiles, block):
+        stop = min(start + block, nfiles)
+        with stage('outofcore_block', stop - start):
+            sweeps = [datamap.transport(datamap.read(i)) for i in range(start, stop)]
+            for key, quantity in QUANTITIES.items():
+                if aligned:
+                    values = np.column_stack([data[quantity].to_numpy() for data in sweeps])
+                else:
+                    values = resample_sweeps([data['v1'].to_numpy() for data in sweeps],
+                                             [data[quantity].to_numpy() for data in sweeps], v1, method).T
+                grids[key][:, start:stop] = values
+                stats[key].add(values)
+            sxy = np.asarray(grids['sxy2d'][:, start:stop], dtype=float)
+            if derivative is not None:
+                dv1 = map_diff(sxy, v1.astype(float), 0, derivative, **options)
+            elif uniform:
+                dv1 = np.vstack([np.full((1, stop - start), np.nan), np.diff(sxy, axis=0) / spacing[0]])
+            else:
+                dv1 = np.vstack([np.full((1, stop - start), np.nan), np.diff(sxy, axis=0) / spacing[:, None]])
+            grids['dv1'][:, start:stop] = dv1
+            stats['dv1'].add(dv1)
+            if fft is not None:
+                signal = np.asarray(grids[fft + '2d'][:, start:stop], dtype=float)
+                signal = np.nan_to_num(signal - np.nanmean(signal, axis=0))  # no data outside a sweep: 0
+                spectrum = np.abs(np.fft.fft(signal, axis=0)[:nfreq]) / ngrid
+                grids['fft'][:, start:stop] = spectrum
+                stats['fft'].add(spectrum)
+        del sweeps
+
+    # pass 2: dv2 from the sxy grid on the disk, blocks with the neighbouring columns they need
+    halo = _halo(derivative, options)
+    for start in range(0, nfiles, block):
+        stop = min(start + block, nfiles)
+        lo_, hi_ = max(start - halo, 0), min(stop + halo, nfiles)
+        sxy = np.asarray(grids['sxy2d'][:, lo_:hi_], dtype=float)
+        if derivative is not None:
+            dv2 = map_diff(sxy, v2[lo_:hi_].astype(float), 1, derivative, **options)
+        else:
+            dv2 = np.hstack([np.full((ngrid, 1), np.nan), np.diff(sxy, axis=1) / abs(v2[0] - v2[1])]) \
+                if lo_ == 0 else np.diff(sxy, axis=1) / abs(v2[0] - v2[1])
+            lo_ = lo_ if lo_ == 0 else lo_ + 1
+        dv2 = dv2[:, start - lo_:stop - lo_]
+        grids['dv2'][:, start:stop] = dv2
+        stats['dv2'].add(dv2)
+
+    keys = ['v1', 'v2'] + list(grids) + (['frq'] if fft is not None else [])
+    for grid in grids.values():
+        grid.flush()
+    settings = {'files': list(datamap.dir), 'block': block, 'v1grid': None if v1grid is None else np.asarray(
+        v1grid).tolist(), 'method': method, 'derivative': derivative, 'fft': fft, 'options': options,
+        'dtype': str(dtype)}
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump({'keys': keys, 'stats': {key: value.as_dict() for key, value in stats.items()},
+                   'settings': settings}, f, indent=2)
+    return MapStore(folder)
@@ -1,4 +1,5 @@
 #Copyright 2021 Lixian WANG. All Rights Reserved.
+import numpy as np
 import pandas as pd
 
 def scissor(c,x,y):
@@ -58,6 +59,25 @@ def peakIden(x,y,pid):
                 peak_id.append(pid[i+1])
                 
         return peak_x, peak_y, peak_id
+
+
+def fastpeakIden(x,y,pid):
+    '''
+    Same as peakIden, with the 3-point moving window compared on arrays
+    Arguments:
+    x:input data in x-axis.
+    y:input data in y-axis. The same length as x
+    pid:the index stored
+    Return:
+    peak_x: x-value of peaks
+    peak_y: y-value of peaks
+    peak_id: index of peaks
+    '''
+    if len(x) <= 2: # trival cases
+        return peakIden(x,y,pid)
+    y_arr = np.asarray(y)
+    ids = np.flatnonzero((y_arr[:-2] < y_arr[1:-1]) & (y_arr[1:-1] > y_arr[2:])) + 1
+    return [x[i] for i in ids], [y[i] for i in ids], [pid[i] for i in ids]
     
 
 class peakFilter():
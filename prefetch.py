@@ -0,0 +1,93 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Read-ahead of data files for slow (network) folders: a background thread reads the raw bytes of the next files
+while the current one is parsed and processed, so that reading and computing overlap.
+The read-ahead is bounded by a number of files (depth) and by the bytes held in memory.
+    for i, raw in prefetch(files, depth=4):
+        data = read_dat(raw, spr, ucols, nms)
+Datajungle uses it when created with prefetch=<depth>.
+'''
+# Standard library
+import collections
+import os
+import threading
+
+__all__ = ['prefetch', 'Prefetcher']
+
+MEMORY = 256 * 2 ** 20  # default cap of the bytes read ahead
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class Prefetcher:
+    '''
+    Iterator over (index, bytes) of files, read ahead by a background thread
+    Arguments:
+    paths: files, yielded in this order
+    depth: number of files read ahead
+    memory: cap of the bytes read ahead (a file larger than the cap is still read, alone)
+    '''
+
+    def __init__(self, paths, depth=4, memory=MEMORY):
+        if depth < 1:
+            raise ValueError('Error: the read-ahead depth has to be at least 1')
+        self.paths = list(paths)
+        self.depth = depth
+        self.memory = memory
+        self.ready = collections.deque()  # (index, bytes or exception)
+        self.held = 0  # bytes in ready
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for index, path in enumerate(self.paths):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or not self.ready or (
+                    len(self.ready) < self.depth and self.held + size <= self.memory))
+                if self.stopped:
+                    return
+            try:
+                item = _read_bytes(path)
+            except Exception as error:  # raised in the consumer, at the position of the file
+                item = error
+            with self.condition:
+                self.ready.append((index, item))
+                self.held += 0 if isinstance(item, Exception) else len(item)
+                self.condition.notify_all()
+
+    def __iter__(self):
+        try:
+            for _ in range(len(self.paths)):
+                with self.condition:
+                    self.condition.wait_for(lambda: self.ready)
+                    index, item = self.ready.popleft()
+                    if not isinstance(item, Exception):
+                        self.held -= len(item)
+                    self.condition.notify_all()
+                if isinstance(item, Exception):
+                    raise item
+                yield index, item
+        finally:
+            self.close()
+
+    def close(self):
+        '''stop reading ahead (e.g. when the consumer stops early)'''
+        with self.condition:
+            self.stopped = True
+            self.ready.clear()
+            self.held = 0
+            self.condition.notify_all()
+
+
+def prefetch(paths, depth=4, memory=MEMORY):
+    '''(index, bytes) of every file in paths, read ahead in the background, see Prefetcher'''
+    return iter(Prefetcher(paths, depth, memory))
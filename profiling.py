@@ -0,0 +1,202 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Opt-in instrumentation of the hot paths: wall time, points processed, memory high-water mark and
+fit iterations (model evaluations) per stage.
+
+Switch it on for a block of code:
+    with profile(memory=True) as report:
+        fc, data = datamap.getdata()
+        dens, mob = denCal_single(datamap, 3, [-1, 1], gates, 0)
+    print(report.summary())
+    report.to_json('profile.json')
+
+or for a whole run with the environment variable SCIDATA_PROFILE=1 (report printed as JSON to stderr at exit)
+or SCIDATA_PROFILE=<path.json> (report written to that file); SCIDATA_PROFILE_MEMORY=1 also tracks memory.
+Without an active report every instrumented call costs one list lookup.
+'''
+# Standard library
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+__all__ = ['profile', 'stage', 'staged', 'count_iteration', 'Report']
+
+_reports = []  # active reports, innermost last
+_stages = []  # open stage records, innermost last
+_environment_profile = None  # profile switched on by SCIDATA_PROFILE
+
+
+class _Record:
+    __slots__ = ['name', 'points', 'iterations', 'start_memory', 'peak']
+
+    def __init__(self, name, points):
+        self.name = name
+        self.points = points
+        self.iterations = 0
+        self.start_memory = 0
+        self.peak = 0
+
+
+class Report:
+    '''
+    Collection of stage timings. Stages with the same name are aggregated.
+    METHODS:
+    as_dict: {stage: {calls, time, points, iterations, peak_memory}}
+    to_json: dump as_dict to a file (or return the string without a path)
+    to_frame: pandas.DataFrame with one row per stage
+    summary: text table
+    '''
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+
+    def __repr__(self):
+        return 'Report(stages = {})'.format(list(self.stages))
+
+    def add(self, name, elapsed, points, iterations, peak_memory):
+        entry = self.stages.setdefault(name, {'calls': 0, 'time': 0., 'points': 0, 'iterations': 0,
+                                              'peak_memory': None})
+        entry['calls'] += 1
+        entry['time'] += elapsed
+        entry['points'] += points
+        entry['iterations'] += iterations
+        if peak_memory is not None:
+            entry['peak_memory'] = max(entry['peak_memory'] or 0, peak_memory)
+
+    def as_dict(self):
+        return {name: dict(entry) for name, entry in self.stages.items()}
+
+    def to_json(self, path=None):
+        text = json.dumps(self.as_dict(), indent=2)
+        if path is None:
+            return text
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame.from_dict(self.as_dict(), orient='index')
+
+    def summary(self):
+        lines = ['{:<28}{:>7}{:>11}{:>12}{:>11}{:>12}'.format('stage', 'calls', 'time (s)', 'points', 'iterations',
+                                                              'peak (MB)')]
+        for name, entry in sorted(self.stages.items(), key=lambda item: -item[1]['time']):
+            peak = '-' if entry['peak_memory'] is None else '{:.1f}'.format(entry['peak_memory'] / 2 ** 20)
+            lines.append('{:<28}{:>7}{:>11.4f}{:>12}{:>11}{:>12}'.format(name, entry['calls'], entry['time'],
+                                                                         entry['points'], entry['iterations'], peak))
+        return '\n'.join(lines)
+
+
+def _memory_tracked():
+    return any(report.memory for report in _reports) and tracemalloc.is_tracing()
+
+
+def _sync_peaks():
+    # credit the peak since the last sync to every open stage, then start a new interval
+    current, peak = tracemalloc.get_traced_memory()
+    for record in _stages:
+        record.peak = max(record.peak, peak)
+    tracemalloc.reset_peak()
+    return current
+
+
+@contextlib.contextmanager
+def profile(memory=False):
+    '''
+    Record every instrumented stage run inside the block
+    :param memory: also track the memory high-water mark with tracemalloc (slows Python allocations down)
+    :return: the Report
+    '''
+    report = Report(memory=memory)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _reports.append(report)
+    try:
+        yield report
+    finally:
+        _reports.remove(report)
+        if started_tracing:
+            tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def stage(name, points=0):
+    '''
+    Time a stage of the calculation (no-op without an active report)
+    :param name: name of the stage in the report
+    :param points: number of rows/points processed, can also be added later to the yielded record
+    :return: the record (record.points, record.iterations can be increased inside the block), None if inactive
+    '''
+    if not _reports:
+        yield None
+        return
+    record = _Record(name, points)
+    memory = _memory_tracked()
+    if memory:
+        record.start_memory = _sync_peaks()
+    _stages.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        peak_memory = None
+        if memory:
+            _sync_peaks()
+            peak_memory = record.peak - record.start_memory
+        _stages.remove(record)
+        for report in _reports:
+            report.add(name, elapsed, record.points, record.iterations, peak_memory)
+
+
+def staged(name, points=None):
+    '''
+    Decorator running the whole function as a stage
+    :param name: name of the stage
+    :param points: function of the call arguments returning the number of points processed
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _reports:
+                return func(*args, **kwargs)
+            with stage(name, points(*args, **kwargs) if points else 0):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_iteration(n=1):
+    '''
+    Count a model evaluation of a fit in the innermost open stage
+    '''
+    if _stages:
+        _stages[-1].iterations += n
+
+
+def _profile_from_environment():
+    target = os.environ.get('SCIDATA_PROFILE')
+    if not target or target == '0':
+        return
+    global _environment_profile
+    # keep a reference, the report is removed when the context is garbage collected
+    _environment_profile = profile(memory=os.environ.get('SCIDATA_PROFILE_MEMORY', '0') != '0')
+    report = _environment_profile.__enter__()
+
+    def dump():
+        if target == '1':
+            sys.stderr.write(report.to_json() + '\n')
+        else:
+            report.to_json(target)
+
+    atexit.register(dump)
+
+
+_profile_from_environment()
@@ -0,0 +1,248 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Multi-resolution (mip-map) pyramid of a 2d map for fast pan/zoom: every level reduces blocks of the level below
+by min, mean and max, so a view of the map is drawn from the coarsest level that still has one value per pixel.
+Pyramids of the grids of a Datamap are cached on disk and opened as memmaps, only the part of a level inside the view
+is read. The cache is kept in a user folder (CACHE_DIR: the environment variable SCIDATA_CACHE or ~/.cache/SciData),
+not next to the data: data folders on read-only shares work, and their modification time does not change.
+    pyr = map_pyramid(datamap, 'dv1')
+    plot_pyramid(ax, pyr, vmin=-1e-3, vmax=1e-3, cmap='terrain')   # redrawn from the matching level on zoom/pan
+or datamap.plotmap(vmin1, vmax1, vmin2, vmax2, pyramid=True)
+'''
+# Standard library
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import warnings
+
+# Third party
+import numpy as np
+
+# Local application
+from .functions import _pixel_width, extents
+
+__all__ = ['MapPyramid', 'map_pyramid', 'plot_pyramid']
+
+REDUCTIONS = ['min', 'mean', 'max']
+CACHE_DIR = os.environ.get('SCIDATA_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'SciData')
+
+
+def _blocks(z, b1, b2):
+    '''z padded with NaN to multiples of (b1, b2) and reshaped into blocks (n1, b1, n2, b2)'''
+    n1, n2 = -(-z.shape[0] // b1), -(-z.shape[1] // b2)
+    padded = np.full((n1 * b1, n2 * b2), np.nan, dtype=z.dtype)
+    padded[:z.shape[0], :z.shape[1]] = z
+    return padded.reshape(n1, b1, n2, b2)
+
+
+def _coarsen(values, b):
+    '''mean of blocks of b coordinates'''
+    n = -(-len(values) // b)
+    padded = np.full(n * b, np.nan)
+    padded[:len(values)] = values
+    return np.nanmean(padded.reshape(n, b), axis=1)
+
+
+class MapPyramid:
+    '''
+    Min/mean/max pyramid of a map z[v1, v2] (the layout of the grids of Datamap)
+    levels: list of {'min', 'mean', 'max'} arrays, level 0 is the map itself
+    blocks: (b1, b2) points of level 0 per value of every level
+    coords: list of (v1, v2) of every level (centres of the blocks)
+    METHODS:
+    build: pyramid of a map
+    save/load: folder of .npy files, loaded as memmaps
+    level: level to draw a view at a resolution
+    view: part of a level inside a view
+    '''
+
+    def __init__(self, levels, blocks, coords):
+        self.levels = levels
+        self.blocks = blocks
+        self.coords = coords
+
+    def __repr__(self):
+        return 'MapPyramid(levels = {})'.format([level['mean'].shape for level in self.levels])
+
+    @classmethod
+    def build(cls, z, v1, v2, factor=2, min_size=64):
+        '''
+        :param z: 2d array (or DataFrame) of shape (len(v1), len(v2)), NaN allowed
+        :param factor: reduction of every level along each axis
+        :param min_size: an axis is only reduced while the next level keeps at least min_size values along it
+        '''
+        z = np.asarray(z)
+        v1, v2 = np.asarray(v1, dtype=float), np.asarray(v2, dtype=float)
+        levels = [{reduction: z for reduction in REDUCTIONS}]
+        blocks, coords = [(1, 1)], [(v1, v2)]
+        count = np.isfinite(z).astype(float)  # finite values and their sum per value of the level
+        total = np.where(count > 0, z, 0).astype(float)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN blocks stay NaN
+            while True:
+                shape = levels[-1]['mean'].shape
+                f1 = factor if shape[0] // factor >= min_size else 1
+                f2 = factor if shape[1] // factor >= min_size else 1
+                if f1 == f2 == 1:
+                    break
+                previous = levels[-1]
+                count = np.nansum(_blocks(count, f1, f2), axis=(1, 3))
+                total = np.nansum(_blocks(total, f1, f2), axis=(1, 3))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = np.where(count > 0, total / count, np.nan)
+                levels.append({'min': np.nanmin(_blocks(previous['min'], f1, f2), axis=(1, 3)),
+                               'mean': mean.astype(z.dtype),
+                               'max': np.nanmax(_blocks(previous['max'], f1, f2), axis=(1, 3))})
+                blocks.append((blocks[-1][0] * f1, blocks[-1][1] * f2))
+                coords.append((_coarsen(coords[-1][0], f1), _coarsen(coords[-1][1], f2)))
+        return cls(levels, blocks, coords)
+
+    def save(self, folder, **meta):
+        '''write the levels as .npy files (replaces folder atomically), meta: stored in meta.json'''
+        parent = os.path.dirname(os.path.abspath(folder))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for k, (level, (c1, c2)) in enumerate(zip(self.levels, self.coords)):
+            for reduction in REDUCTIONS[:1 if k == 0 else 3]:  # level 0 is stored once
+                np.save(os.path.join(tmp, 'level{}_{}.npy'.format(k, reduction)), level[reduction])
+            np.save(os.path.join(tmp, 'level{}_v1.npy'.format(k)), c1)
+            np.save(os.path.join(tmp, 'level{}_v2.npy'.format(k)), c2)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, blocks=self.blocks), f)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        os.replace(tmp, folder)
+
+    @classmethod
+    def load(cls, folder):
+        '''levels written by save, as read-only memmaps'''
+        with open(os.path.join(folder, 'meta.json')) as f:
+            blocks = [tuple(block) for block in json.load(f)['blocks']]
+
+        def array(k, name):
+            return np.load(os.path.join(folder, 'level{}_{}.npy'.format(k, name)), mmap_mode='r')
+        levels = [{reduction: array(k, 'min' if k == 0 else reduction) for reduction in REDUCTIONS}
+                  for k in range(len(blocks))]
+        coords = [(array(k, 'v1'), array(k, 'v2')) for k in range(len(blocks))]
+        return cls(levels, blocks, coords)
+
+    def level(self, points, pixels):
+        '''
+        coarsest level with at least one value per pixel along every reduced axis
+        :param points: number of level-0 values along (v1, v2) inside the view
+        :param pixels: pixels of the view along (v1, v2)
+        '''
+        chosen = 0
+        for k, (b1, b2) in enumerate(self.blocks):
+            if (b1 == 1 or points[0] / b1 >= pixels[0]) and (b2 == 1 or points[1] / b2 >= pixels[1]):
+                chosen = k
+        return chosen
+
+    def view(self, v1_range=None, v2_range=None, pixels=None, reduction='mean'):
+        '''
+        Part of the map inside a view at the resolution of the view
+        :param v1_range, v2_range: limits of the view (None: whole axis)
+        :param pixels: (pixels along v1, pixels along v2), None: level 0
+        :param reduction: 'min', 'mean' or 'max'
+        :return: 2d array (v1 x v2), extent [v1 limits, v2 limits] for imshow of its transpose, level
+        '''
+        def inside(values, limits):
+            if limits is None:
+                return slice(0, len(values))
+            index = np.flatnonzero((values >= min(limits)) & (values <= max(limits)))
+            if not len(index):
+                return slice(0, 0)
+            return slice(max(index[0] - 1, 0), index[-1] + 2)  # one more value on each side, up to the edges
+
+        v1, v2 = self.coords[0]
+        s1, s2 = inside(v1, v1_range), inside(v2, v2_range)
+        k = 0 if pixels is None else self.level((s1.stop - s1.start, s2.stop - s2.start), pixels)
+        c1, c2 = self.coords[k]
+        s1, s2 = inside(np.asarray(c1), v1_range), inside(np.asarray(c2), v2_range)
+        c1, c2 = np.asarray(c1[s1]), np.asarray(c2[s2])
+        image = np.asarray(self.levels[k][reduction][s1, s2])
+        if len(c1) < 2 or len(c2) < 2:
+            return image, None, k
+        return image, extents(list(c1)) + extents(list(c2)), k
+
+
+def _source_signature(datamap):
+    digest = hashlib.sha1()
+    for path in datamap.dir:
+        stat = os.stat(path)
+        digest.update('{}|{}|{}\n'.format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size).encode())
+    return digest.hexdigest()[:16]
+
+
+def _cached_source(folder):
+    try:
+        with open(os.path.join(folder, 'meta.json')) as f:
+            return json.load(f).get('source')
+    except (OSError, ValueError):
+        return None
+
+
+def map_pyramid(datamap, key='dv1', cache=True, factor=2, min_size=64, v1grid=None, method='interp',
+                derivative=None, fc=None, cache_dir=None, **options):
+    '''
+    Pyramid of a grid of a Datamap, cached in <cache_dir>/pyramid/<data folder>/<key>_<settings>
+    :param key: grid of Datamap.getmap (dv1, dv2, rxx2d, rxy2d, sxy2d, sxx2d)
+    :param cache: read/write the cache; the cache of a key and settings is rebuilt in place when a file changes
+    :param v1grid, method, derivative, options: as in Datamap.getdata
+    :param fc: Datamap.getmap of these settings, to share the computed grids between several pyramids
+    :param cache_dir: root of the cache, default CACHE_DIR; if it is not writable the pyramid is not cached
+    :return: MapPyramid
+    '''
+    settings = {'factor': factor, 'min_size': min_size, 'method': method, 'derivative': derivative,
+                'options': options, 'dtype': str(datamap.dtype),
+                'v1grid': None if v1grid is None else np.asarray(v1grid).tolist()}
+    datadir = os.path.dirname(os.path.abspath(datamap.dir[0]))
+    folder = os.path.join(cache_dir or CACHE_DIR, 'pyramid', hashlib.sha1(datadir.encode()).hexdigest()[:16],
+                          '{}_{}'.format(key, hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode())
+                                         .hexdigest()[:16]))
+    source = _source_signature(datamap)
+    if cache and _cached_source(folder) == source:
+        return MapPyramid.load(folder)
+    fc = datamap.getmap(v1grid, method, derivative, **options) if fc is None else fc
+    pyramid = MapPyramid.build(fc[key], fc['v1'], fc['v2'], factor, min_size)
+    if cache:
+        try:
+            pyramid.save(folder, source=source, data=datadir)  # replaces the pyramid of the old files
+        except OSError as error:
+            warnings.warn('pyramid not cached, {} is not writable: {}'.format(folder, error))
+            return pyramid
+        return MapPyramid.load(folder)
+    return pyramid
+
+
+def _pixel_height(ax):
+    fig = ax.get_figure()
+    return max(int(_pixel_width(ax) * ax.get_position().height * fig.get_figheight()
+                   / (ax.get_position().width * fig.get_figwidth())), 1)
+
+
+def plot_pyramid(ax, pyramid, reduction='mean', **kwargs):
+    '''
+    ax.imshow of a map (v1 horizontal, v2 vertical, like plotmap) from its pyramid, drawn again from the matching
+    level whenever the view changes (zoom/pan)
+    :param reduction: 'mean', or 'min'/'max' to keep narrow features visible when zoomed out
+    :param kwargs: passed to imshow (cmap, vmin, vmax, ...)
+    :return: the AxesImage handle
+    '''
+    kwargs = dict({'aspect': 'auto', 'interpolation': 'none', 'origin': 'lower'}, **kwargs)
+    image, extent, _ = pyramid.view(pixels=(_pixel_width(ax), _pixel_height(ax)), reduction=reduction)
+    handle = ax.imshow(image.T, extent=extent, **kwargs)
+
+    def redraw(ax):
+        image, extent, _ = pyramid.view(ax.get_xlim(), ax.get_ylim(), (_pixel_width(ax), _pixel_height(ax)),
+                                        reduction)
+        if extent is not None:
+            ax.set_autoscale_on(False)  # the new extent must not move the view (and call redraw again)
+            handle.set_data(image.T)
+            handle.set_extent(extent)
+
+    ax.callbacks.connect('xlim_changed', redraw)
+    ax.callbacks.connect('ylim_changed', redraw)
+    return handle
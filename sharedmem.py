@@ -0,0 +1,187 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Hand a loaded map to worker processes without pickling it: the grids and the bundle of Datamap.getdata are copied
+once into multiprocessing.shared_memory blocks, and only a small descriptor (names, shapes, dtypes) is sent to the
+workers, which attach to the blocks without copying.
+    fc, bundle = datamap.getdata()
+    with share_map(fc, bundle) as shared:
+        with ProcessPoolExecutor() as pool:
+            results = list(pool.map(analyse, [shared] * len(gates), gates))
+
+    def analyse(shared, gate):
+        fc, bundle = shared.attach()   # read-only DataFrames/arrays on the shared blocks
+        ...
+        del fc, bundle
+        shared.detach()                # unmap the blocks in the worker
+The blocks live until the with-block of the owner ends (or shared.unlink()), the workers must not keep the arrays
+after that. A worker keeps the blocks of a map mapped until it detaches (shared.detach()) or attaches another map,
+a block is only closed once no array on it is referenced any more.
+The workers have to be started by multiprocessing (they share the resource tracker of the owner).
+'''
+# Standard library
+import uuid
+from multiprocessing import shared_memory
+
+# Third party
+import numpy as np
+import pandas as pd
+
+__all__ = ['SharedArray', 'SharedMap', 'share_array', 'share_map']
+
+_attached = {}  # blocks attached in this process, until detached
+_maps = {}  # token of a SharedMap: names of the blocks it attached in this process
+
+
+def _close(name):
+    '''close a block attached in this process, False if arrays on it are still in use (it stays open)'''
+    block = _attached.get(name)
+    if block is None:
+        return True
+    try:
+        block.close()
+    except BufferError:  # an array (or DataFrame) on the block is still referenced
+        return False
+    del _attached[name]
+    return True
+
+
+class SharedArray:
+    '''
+    Descriptor of an array in a shared memory block (picklable, a few hundred bytes)
+    '''
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+
+    def __repr__(self):
+        return 'SharedArray({!r}, shape = {}, dtype = {})'.format(self.name, self.shape, self.dtype)
+
+    def attach(self):
+        '''read-only array on the block, no copy'''
+        if self.name not in _attached:
+            _attached[self.name] = shared_memory.SharedMemory(name=self.name)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=_attached[self.name].buf)
+        array.flags.writeable = False
+        return array
+
+    def detach(self):
+        '''close the block in this process, once the arrays on it are no longer used (see _close)'''
+        return _close(self.name)
+
+
+def share_array(array):
+    '''
+    Copy an array into a new shared memory block
+    :return: the block (owned by the caller, close and unlink it when done), its descriptor
+    '''
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, SharedArray(block.name, array.shape, array.dtype)
+
+
+class SharedMap:
+    '''
+    Descriptor of a map (grids of Datamap.getdata and optionally the bundle) in shared memory
+    METHODS:
+    attach: fc (dict, grids as DataFrames like getdata), bundle (DataFrame or None) on the shared blocks
+    detach: close the blocks attached in this process, also done at the end of a with-block in a worker
+    unlink: free the blocks (owner only), also done at the end of a with-block in the owner
+    '''
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex
+        self.arrays = {}  # key: (SharedArray, columns or None)
+        self.bundle = None  # (index SharedArray, {column: SharedArray})
+        self._blocks = []  # only in the owner, not pickled
+
+    def __getstate__(self):
+        return {'token': self.token, 'arrays': self.arrays, 'bundle': self.bundle}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._blocks = []
+
+    def __repr__(self):
+        return 'SharedMap(keys = {}, bundle = {})'.format(list(self.arrays), self.bundle is not None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._blocks:
+            self.unlink()
+        else:
+            self.detach()
+
+    def _share(self, array):
+        block, descriptor = share_array(array)
+        self._blocks.append(block)
+        return descriptor
+
+    def _descriptors(self):
+        return [descriptor for descriptor, _ in self.arrays.values()] + (
+            [] if self.bundle is None else [self.bundle[0]] + list(self.bundle[1].values()))
+
+    def attach(self):
+        # blocks of the maps attached before in this process (e.g. an older round of a pool) are closed if unused
+        for token in [token for token in _maps if token != self.token]:
+            _maps[token] = [name for name in _maps[token] if not _close(name)]
+            if not _maps[token]:
+                del _maps[token]
+        _maps[self.token] = [descriptor.name for descriptor in self._descriptors()]
+        fc = {}
+        for key, (descriptor, columns) in self.arrays.items():
+            array = descriptor.attach()
+            fc[key] = array if columns is None else pd.DataFrame(array, columns=columns, copy=False)
+        if self.bundle is None:
+            return fc, None
+        index, columns = self.bundle
+        bundle = pd.DataFrame({name: descriptor.attach() for name, descriptor in columns.items()},
+                              index=index.attach(), copy=False)
+        return fc, bundle
+
+    def detach(self):
+        '''
+        Close the blocks of this map attached in this process (drop the arrays and DataFrames of attach first)
+        :return: True if all blocks are closed, blocks still in use stay open
+        '''
+        names = [name for name in _maps.pop(self.token, []) if not _close(name)]
+        if names:
+            _maps[self.token] = names
+        return not names
+
+    def unlink(self):
+        self.detach()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def share_map(fc, bundle=None, keys=None):
+    '''
+    Put a map into shared memory
+    :param fc: dict of grids as returned by Datamap.getdata (or a Mapfc of Datamap.getmap)
+    :param bundle: DataFrame of getdata, optional
+    :param keys: grids to share (default: all grids of fc; the bundle of a Mapfc is not a grid)
+    :return: SharedMap, use it as a context manager in the owner
+    '''
+    shared = SharedMap()
+    try:
+        for key in (keys or [key for key in fc if key != 'bundle']):
+            value = fc[key]
+            if isinstance(value, pd.DataFrame):
+                # the values of a DataFrame grid are stored in the layout of the grid, (v1, v2)
+                shared.arrays[key] = (shared._share(value.to_numpy()), list(value.columns))
+            else:
+                shared.arrays[key] = (shared._share(np.asarray(value)), None)
+        if bundle is not None:
+            shared.bundle = (shared._share(bundle.index.to_numpy()),
+                             {name: shared._share(bundle[name].to_numpy()) for name in bundle.columns})
+    except BaseException:
+        shared.unlink()
+        raise
+    return shared
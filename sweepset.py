@@ -0,0 +1,161 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Ragged container for the sweeps of a folder: one contiguous array per quantity, the offsets of the sweeps in these
+arrays and the step value of every sweep (CSR layout). Sweep i is rows offsets[i]:offsets[i+1] of every array.
+    sweeps = databs.getsweeps()
+    sweeps.sweep(3)                  # DataFrame of the 4th file, views into the arrays
+    sweeps.mean('rxx')               # one value per sweep, no loop over the files
+    sweeps.range('bf', [-0.5, 0.5])  # same rows as df_range on the long-form DataFrame, structure kept
+    sweeps.to_frame()                # the long-form DataFrame of getdata, the columns are not copied
+'''
+# Third party
+import numpy as np
+import pandas as pd
+
+__all__ = ['SweepSet']
+
+
+class SweepSet:
+    '''
+    Sweeps of different lengths in contiguous arrays
+    Arguments:
+    columns: dict {quantity: 1d array}, the sweeps one after the other
+    offsets: start of every sweep and the total length, len(step) + 1 integers
+    step: step value of every sweep
+    step_name: name of the step column in to_frame (gate, bf, v2, x)
+    '''
+
+    def __init__(self, columns, offsets, step, step_name='step'):
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.step = np.asarray(step)
+        self.step_name = step_name
+        if len(self.offsets) != len(self.step) + 1:
+            raise ValueError('Error: {} offsets for {} sweeps'.format(len(self.offsets), len(self.step)))
+        for name, values in self.columns.items():
+            if len(values) != self.offsets[-1]:
+                raise ValueError('Error: column {} has {} rows, the offsets {}'.format(name, len(values),
+                                                                                    self.offsets[-1]))
+
+    @classmethod
+    def from_frames(cls, frames, step, step_name='step'):
+        '''one DataFrame per sweep (same columns) -> SweepSet, every column is copied once'''
+        if not len(frames):  # empty folder
+            return cls({}, [0], [], step_name)
+        lengths = [len(frame) for frame in frames]
+        columns = {name: np.concatenate([frame[name].to_numpy() for frame in frames]) for name in frames[0].columns}
+        return cls(columns, np.concatenate([[0], np.cumsum(lengths)]), step, step_name)
+
+    @classmethod
+    def from_frame(cls, frame, step_name):
+        '''long-form DataFrame -> SweepSet, a new sweep starts wherever the value of step_name changes'''
+        step_column = frame[step_name].to_numpy()
+        starts = np.flatnonzero(np.append(True, step_column[1:] != step_column[:-1]))
+        columns = {name: frame[name].to_numpy() for name in frame.columns if name != step_name}
+        return cls(columns, np.append(starts, len(frame)), step_column[starts], step_name)
+
+    def __len__(self):
+        return len(self.step)
+
+    def __repr__(self):
+        return 'SweepSet({} sweeps, {} points, columns = {})'.format(len(self), self.offsets[-1], list(self.columns))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def trace(self):
+        '''index of the sweep of every row'''
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def values(self, name, i):
+        '''values of one quantity in sweep i (a view)'''
+        return self.columns[name][self.offsets[i]:self.offsets[i + 1]]
+
+    def split(self, name):
+        '''values of one quantity as a list of views, one per sweep'''
+        return np.split(self.columns[name], self.offsets[1:-1])
+
+    def sweep(self, i):
+        '''sweep i as a DataFrame (views, index 0..n-1 like the files)'''
+        return pd.DataFrame({name: self.values(name, i) for name in self.columns}, copy=False)
+
+    def reduce(self, name, ufunc):
+        '''
+        ufunc.reduceat over every sweep, e.g. reduce('rxx', np.maximum)
+        :return: 1d array, one value per sweep, NaN for empty sweeps
+        '''
+        values = self.columns[name]
+        lengths = self.lengths
+        out = np.full(len(self), np.nan, dtype=np.result_type(values, np.float32))
+        filled = lengths > 0
+        if filled.any():
+            out[filled] = ufunc.reduceat(values, self.offsets[:-1][filled])
+        return out
+
+    def sum(self, name):
+        return self.reduce(name, np.add)
+
+    def mean(self, name):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(name) / self.lengths
+
+    def min(self, name):
+        return self.reduce(name, np.minimum)
+
+    def max(self, name):
+        return self.reduce(name, np.maximum)
+
+    def take(self, rows):
+        '''
+        SweepSet of the selected rows (boolean mask or ascending indices), sweeps keep their order, may become empty
+        '''
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=np.int64)
+        lengths = np.bincount(np.searchsorted(self.offsets, rows, side='right') - 1, minlength=len(self))
+        return SweepSet({name: values[rows] for name, values in self.columns.items()},
+                        np.concatenate([[0], np.cumsum(lengths)]), self.step, self.step_name)
+
+    def range(self, name, col_range):
+        '''rows with col_range[0] < name < col_range[1], like df_range'''
+        values = self.columns[name]
+        return self.take((values > col_range[0]) & (values < col_range[1]))
+
+    def select(self, sweeps):
+        '''
+        SweepSet of some sweeps (slice, boolean mask or indices), a slice gives views into the arrays
+        '''
+        if isinstance(sweeps, slice):
+            start, stop, stride = sweeps.indices(len(self))
+            if stride == 1:
+                stop = max(start, stop)
+                lo, hi = self.offsets[start], self.offsets[stop]
+                return SweepSet({name: values[lo:hi] for name, values in self.columns.items()},
+                                self.offsets[start:stop + 1] - lo, self.step[start:stop], self.step_name)
+            sweeps = np.arange(start, stop, stride)
+        sweeps = np.flatnonzero(sweeps) if np.asarray(sweeps).dtype == bool else np.asarray(sweeps, dtype=np.int64)
+        lengths = self.lengths[sweeps]
+        rows = np.repeat(self.offsets[sweeps] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + \
+            np.arange(lengths.sum())
+        return SweepSet({name: values[rows] for name, values in self.columns.items()},
+                        np.concatenate([[0], np.cumsum(lengths)]), self.step[sweeps], self.step_name)
+
+    def where_step(self, step_range):
+        '''sweeps with step_range[0] < step < step_range[1]'''
+        return self.select((self.step > step_range[0]) & (self.step < step_range[1]))
+
+    def to_frame(self):
+        '''
+        Long-form DataFrame (the format of getdata): the columns, then the step column, index 0..n-1 in every sweep.
+        The columns share the memory of the arrays, only the step column and the index are new
+        '''
+        if not len(self):
+            return pd.DataFrame()  # like the getdata of an empty folder always did
+        lengths = self.lengths
+        frame = pd.DataFrame(dict(self.columns), copy=False)
+        frame[self.step_name] = np.repeat(self.step, lengths)
+        frame.index = np.arange(self.offsets[-1]) - np.repeat(self.offsets[:-1], lengths)
+        return frame
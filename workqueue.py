@@ -0,0 +1,258 @@
+#Copyright 2021 Lixian WANG. All Rights Reserved.
+'''
+Distributed batch processing over a shared filesystem, without any server: every worker (on any machine that mounts
+the queue and output folders) walks through the jobs of a manifest (see batch.py), claims a job by creating its lock
+file atomically (O_CREAT | O_EXCL), processes it with batch.run_job and writes the output atomically.
+A worker refreshes the modification time of its locks (heartbeat); the lock of a crashed worker goes stale and the
+job is claimed again by another worker. Outputs that are up to date are skipped, so running again is harmless.
+With -f every job is processed again once: the workers skip the jobs processed after the start of the run (--since).
+The clocks of the machines have to agree to well within the stale time.
+
+Queue folder: locks/<name>.lock (owner, time), status/<name>.json (last result of every job)
+Usage, on every machine (or several times on one):
+python -m SciData.workqueue manifest.json -o /shared/processed -q /shared/queue -j 4
+'''
+# Standard library
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+# Local application
+from .batch import check_names, is_uptodate, load_manifest, output_name, run_job
+
+__all__ = ['claim', 'release', 'work', 'status']
+
+HEARTBEAT = 30.  # seconds between two refreshes of a lock
+STALE = 120.  # a lock not refreshed for this long belongs to a crashed worker
+
+
+def _owner():
+    return {'host': socket.gethostname(), 'pid': os.getpid(), 'worker': uuid.uuid4().hex}
+
+
+def _write_atomic(path, text):
+    tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _age(path):
+    '''seconds since the last modification of a file, None if it does not exist'''
+    try:
+        return time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+
+
+def _lock_owner(lockfile):
+    '''worker id written in a lock, None if the lock does not exist or is being written'''
+    try:
+        with open(lockfile) as f:
+            return json.load(f).get('worker')
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _take_over(lockfile, stale):
+    '''
+    Remove a stale lock. The takeover is serialized by a second lock and the age is checked again inside it,
+    so a lock that was refreshed or claimed again meanwhile is never removed
+    :return: True if the lock is gone
+    '''
+    guard = lockfile + '.takeover'
+    try:
+        os.close(os.open(guard, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        age = _age(guard)
+        if age is not None and age >= stale:  # left behind by a worker that crashed during a takeover
+            try:
+                os.remove(guard)
+            except FileNotFoundError:
+                pass
+        return False
+    try:
+        age = _age(lockfile)
+        if age is not None and age < stale:
+            return False
+        os.remove(lockfile)
+        return True
+    except FileNotFoundError:
+        return True
+    finally:
+        os.remove(guard)
+
+
+def claim(lockfile, owner, stale=STALE):
+    '''
+    Create a lock file atomically, a stale lock (not refreshed for stale seconds) is taken over
+    :return: True if the lock now belongs to owner
+    '''
+    for _ in range(2):
+        try:
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            age = _age(lockfile)
+            if age is not None and (age < stale or not _take_over(lockfile, stale)):
+                return False
+            continue  # released or taken over, try again
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(owner, claimed=time.time()), f)
+        return True
+    return False
+
+
+def release(lockfile, owner):
+    '''remove a lock if it still belongs to owner'''
+    try:
+        with open(lockfile) as f:
+            if json.load(f).get('worker') != owner['worker']:
+                return
+        os.remove(lockfile)
+    except (FileNotFoundError, ValueError):
+        pass
+
+
+class _Heartbeat(threading.Thread):
+    '''refresh the modification time of a lock as long as it belongs to owner, until stopped'''
+
+    def __init__(self, lockfile, owner, interval):
+        super().__init__(daemon=True)
+        self.lockfile = lockfile
+        self.owner = owner
+        self.interval = interval
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            worker = _lock_owner(self.lockfile)
+            if worker is None:
+                continue  # missing for a moment or being written: try again at the next beat
+            if worker != self.owner['worker']:
+                return  # taken over by another worker
+            try:
+                os.utime(self.lockfile)
+            except FileNotFoundError:
+                pass
+
+
+def _done_since(output, statusfile, since):
+    '''the job was processed (or failed) after since, i.e. by a worker of the same forced run'''
+    try:
+        if os.path.getmtime(output) >= since:
+            return True
+    except FileNotFoundError:
+        pass
+    try:
+        with open(statusfile) as f:
+            return json.load(f)['finished'] >= since
+    except (FileNotFoundError, ValueError, KeyError):
+        return False
+
+
+def work(jobs, outdir, queue, force=False, retry=False, heartbeat=HEARTBEAT, stale=STALE, profiled=False,
+         since=None):
+    '''
+    Process the jobs that no other worker holds, until none is left
+    :param jobs: list of jobs (see batch.load_manifest)
+    :param outdir: output folder (shared)
+    :param queue: queue folder for the locks and the status (shared)
+    :param force: process jobs again even if their outputs are up to date, once per run
+    :param retry: process jobs again whose last run failed
+    :param since: start time of the run (time.time()), the same for all workers of a forced run: jobs processed
+                  after it are not processed again (default: the start of this call)
+    :return: list of (name, status, report) of the jobs processed by this worker
+    '''
+    check_names(jobs)  # the output name is also the name of the lock and of the status file
+    since = time.time() if since is None else since
+    for folder in [outdir, os.path.join(queue, 'locks'), os.path.join(queue, 'status')]:
+        os.makedirs(folder, exist_ok=True)
+    owner = _owner()
+    results = []
+    for job in jobs:
+        name = output_name(job)
+        output = os.path.join(outdir, name + '.npz')
+        statusfile = os.path.join(queue, 'status', name + '.json')
+        settings = json.dumps(job, sort_keys=True)
+
+        def finished():
+            return _done_since(output, statusfile, since) if force else is_uptodate(job, output)
+
+        if finished():
+            continue
+        if not retry and os.path.isfile(statusfile):
+            with open(statusfile) as f:
+                last = json.load(f)
+            if last['settings'] == settings and last['status'].startswith('failed'):
+                continue
+        lockfile = os.path.join(queue, 'locks', name + '.lock')
+        if not claim(lockfile, owner, stale):
+            continue
+        beat = _Heartbeat(lockfile, owner, heartbeat)
+        beat.start()
+        try:
+            # another worker may have finished the job between the check and the claim
+            if finished():
+                continue
+            started = time.time()
+            name, state, report = run_job(job, outdir, force=True, profiled=profiled)
+            _write_atomic(statusfile, json.dumps(dict(owner, name=name, status=state, settings=settings,
+                                                      started=started, finished=time.time())))
+            results.append((name, state, report))
+        finally:
+            beat.done.set()
+            release(lockfile, owner)
+    return results
+
+
+def status(queue):
+    '''last status of every job of a queue folder: {name: {'status', 'host', 'pid', 'started', 'finished'}}'''
+    folder = os.path.join(queue, 'status')
+    result = {}
+    for entry in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if entry.endswith('.json'):
+            with open(os.path.join(folder, entry)) as f:
+                state = json.load(f)
+            result[state['name']] = {key: state[key] for key in ['status', 'host', 'pid', 'started', 'finished']}
+    return result
+
+
+def main(argv=None):
+    ''' command line entry '''
+    parser = argparse.ArgumentParser(description='Process the folders of a manifest together with other workers')
+    parser.add_argument('manifest', help='JSON manifest of folders (see batch.py)')
+    parser.add_argument('-o', '--outdir', default='processed', help='output folder, shared by all workers')
+    parser.add_argument('-q', '--queue', default=None, help='queue folder, shared by all workers '
+                                                              '(default: <outdir>/queue)')
+    parser.add_argument('-j', '--processes', type=int, default=1, help='number of local worker processes')
+    parser.add_argument('-f', '--force', action='store_true', help='ignore up-to-date outputs')
+    parser.add_argument('--retry', action='store_true', help='process failed jobs again')
+    parser.add_argument('--stale', type=float, default=STALE, help='seconds after which a lock is taken over')
+    parser.add_argument('--since', type=float, default=None, help='with -f: start time of the run (time.time()) '
+                                                                  'shared by the workers of all machines '
+                                                                  '(default: now)')
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    queue = args.queue or os.path.join(args.outdir, 'queue')
+    since = time.time() if args.since is None else args.since
+    arguments = (jobs, args.outdir, queue, args.force, args.retry, min(HEARTBEAT, args.stale / 4), args.stale, False,
+                 since)
+    if args.processes == 1:
+        results = work(*arguments)
+    else:
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            results = [result for worker in pool.map(work, *[[value] * args.processes for value in arguments])
+                       for result in worker]
+    for name, state, _ in results:
+        print('{}: {}'.format(name, state))
+    return int(any(state.startswith('failed') for _, state, _ in results))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())